@@ -3,10 +3,15 @@ import logging
 from functools import wraps
 import os
 import sys
-from pathlib import Path
+import copy
 import asyncio
+import secrets
+import signal
+import time
+from typing import Any
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,13 +20,30 @@ from telegram.ext import (
     filters,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
 )
 import pyotp
-from botlib.translations import tr
-from botlib.storage import JSONStorage
+from botlib.buyer_view import BUYER_ACTIONS, export_buyers, render_buyers
+from botlib.catalog import CatalogView
+from botlib.config import Config
+from botlib.credentials import CredentialView
+from botlib.delivery import FAILED, SENT, Delivery
+from botlib.picker import PICKER_ACTIONS, ProductIndex, render_picker
+from botlib.translations import available_languages, tr
+from botlib.webhook import WebhookServer
+from botlib.indexes import BuyerSet, buyers_of, pending_of
+from botlib.jobs import JobRegistry
+from botlib.locks import LockManager, UserSerializer
+from botlib.markup import MarkupCache
+from botlib.outbox import CREDENTIALS, outbox_of, owe
+from botlib.prefs import PreferenceStore
+from botlib.review import render_review
+from botlib.sessions import SessionEvictor
+from botlib.storage import DEFAULT_DATA, JSONStorage, WriteBehindStorage
+from botlib.sqlite_storage import SQLiteStorage
 
 # Languages that can be used with /setlang
-SUPPORTED_LANGS = {"en", "fa"}
+SUPPORTED_LANGS = set(available_languages())
 
 logger = logging.getLogger("accounts_bot")
 logging.basicConfig(
@@ -29,37 +51,126 @@ logging.basicConfig(
     level=logging.INFO,
 )
 
-# Data file path can be overridden via DATA_FILE env var
-DEFAULT_DATA_FILE = Path(__file__).resolve().parent / 'data.json'
-DATA_FILE = Path(os.environ.get('DATA_FILE', DEFAULT_DATA_FILE))
-try:
-    ADMIN_ID = int(os.environ["ADMIN_ID"])
-except KeyError:
-    logger.error("ADMIN_ID environment variable not set")
-    raise SystemExit("ADMIN_ID environment variable not set")
-except ValueError as e:
-    logger.error("ADMIN_ID must be an integer")
-    raise SystemExit("ADMIN_ID must be an integer") from e
 
-ADMIN_PHONE = os.environ.get("ADMIN_PHONE")  # manager contact number
-if not ADMIN_PHONE:
-    logger.error("ADMIN_PHONE environment variable not set")
-    raise SystemExit("ADMIN_PHONE environment variable not set")
-
-FERNET_KEY = os.environ.get("FERNET_KEY")
-if not FERNET_KEY:
-    logger.error("FERNET_KEY environment variable not set")
-    raise SystemExit("FERNET_KEY environment variable not set")
+def create_storage(config: Config) -> Any:
+    """Build the storage backend described by *config* without loading it."""
+    key = config.fernet_key.encode()
+    if config.data_backend == 'sqlite':
+        backend = SQLiteStorage(config.data_file, key)
+    else:
+        backend = JSONStorage(
+            config.data_file, key, journal=config.data_journal, fsync=config.data_fsync
+        )
+    if config.save_delay_ms > 0:
+        return WriteBehindStorage(backend, config.save_delay_ms / 1000)
+    return backend
+
+
+def create_prefs(config: Config) -> PreferenceStore:
+    """Build the preference store described by *config* without loading it."""
+    return PreferenceStore(config.prefs_file, config.prefs_delay_ms / 1000)
+
+
+def in_conversation(user_data) -> bool:
+    """Return whether a user is adding a product.
+
+    ConversationHandler keeps the step apart from ``user_data``, so the
+    draft must survive session eviction for the next step to find it.
+    """
+    return 'new_product' in user_data
+
+
+# Reading the environment is cheap; the data itself is loaded by load_data()
+config = Config.from_env()
+ADMIN_ID = config.admin_id
+ADMIN_PHONE = config.admin_phone
+storage = create_storage(config)
+prefs = create_prefs(config)
+sessions = SessionEvictor(config.session_max_users, config.session_ttl, keep=in_conversation)
+delivery = Delivery(config.send_rate, config.send_retries)
+catalog = CatalogView()
+credential_view = CredentialView()
+product_index = ProductIndex()
+# Keyboards depend only on their arguments and are shared between users
+markups = MarkupCache()
+# Filled in place so references imported from this module stay valid
+data: dict = copy.deepcopy(DEFAULT_DATA)
+# Background jobs: the outbox drain and resends to all buyers of a product
+jobs = JobRegistry()
+# Updates run concurrently: hold ('product', pid), ('pending', user_id, pid)
+# or ('outbox', key) while changing that part of the data across awaits
+locks = LockManager()
+
+# Buyers per resend checkpoint, and seconds between progress message edits
+RESEND_BATCH = 100
+RESEND_PROGRESS_INTERVAL = 3.0
+
+# Seconds between retries of undelivered outbox entries, and the attempts
+# after which an entry is dropped and reported to the admin
+OUTBOX_RETRY_INTERVAL = 60.0
+OUTBOX_MAX_ATTEMPTS = 5
+
+
+def configure(new_config: Config) -> None:
+    """Point the handlers at *new_config* and a fresh, empty storage."""
+    global config, ADMIN_ID, ADMIN_PHONE, storage, prefs, sessions, delivery
+    config = new_config
+    ADMIN_ID = new_config.admin_id
+    ADMIN_PHONE = new_config.admin_phone
+    storage = create_storage(new_config)
+    prefs = create_prefs(new_config)
+    sessions = SessionEvictor(new_config.session_max_users, new_config.session_ttl, keep=in_conversation)
+    delivery = Delivery(new_config.send_rate, new_config.send_retries)
+    data.clear()
+    data.update(copy.deepcopy(DEFAULT_DATA))
+
+
+async def load_data(app: Application | None = None) -> None:
+    """Load the stored data into :data:`data` inside the running loop.
+
+    Language preferences found in the catalog, from before they moved to
+    :data:`prefs`, are migrated once and dropped from the catalog after
+    :data:`prefs` was written; otherwise the next start retries. Deliveries
+    still in the outbox and interrupted resends are resumed in the
+    background once *app* is given.
+    """
+    loaded = await storage.load()
+    await prefs.load()
+    data.clear()
+    data.update(loaded)
+    legacy = data.pop('languages', None)
+    if legacy:
+        await prefs.update(legacy)
+        if await prefs.flush():
+            storage.touch('languages')
+            await storage.save(data, wait=True)
+            logger.info("Moved %d language preferences to %s", len(legacy), prefs.path)
+        else:
+            data['languages'] = legacy
+            logger.error("Language preferences kept in the catalog until %s is written", prefs.path)
+    if app is None:
+        return
+    if data.get('outbox'):
+        logger.info("Resuming %d owed deliveries", len(data['outbox']))
+        jobs.start('outbox', retry_outbox(app.bot, delay=0))
+    for pid in data.get('resends', {}):
+        logger.info("Resuming resend of %s", pid)
+        jobs.start(f'resend:{pid}', run_resend(app.bot, pid))
 
 
-storage = JSONStorage(DATA_FILE, FERNET_KEY.encode())
-data = asyncio.run(storage.load())
-data.setdefault('languages', {})
+def products_changed(pid: str) -> None:
+    """Drop cached pages, picker indexes, messages and keyboards after
+    editing *pid*.
+    """
+    catalog.invalidate()
+    product_index.invalidate()
+    credential_view.invalidate(pid)
+    markups.invalidate(pid)
 
 
 def user_lang(user_id: int) -> str:
     """Return stored language for a user, defaulting to 'en'."""
-    return data.get('languages', {}).get(str(user_id), 'en')
+    return prefs.get_lang(user_id)
 
 
 def ensure_lang(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
@@ -67,6 +178,11 @@ def ensure_lang(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
     context.user_data.setdefault('lang', user_lang(user_id))
 
 
+def credential(product: dict, field: str):
+    """Return the plaintext of a product credential, decrypting on demand."""
+    return storage.cipher.reveal(product.get(field))
+
+
 def log_command(func):
     """Log user ID and command text before executing a handler."""
     @wraps(func)
@@ -130,22 +246,18 @@ async def setlang(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if lang_code not in SUPPORTED_LANGS:
         await update.message.reply_text(tr('unsupported_language', lang))
         return
-    data.setdefault('languages', {})[str(update.effective_user.id)] = lang_code
-    await storage.save(data)
+    await prefs.set_lang(update.effective_user.id, lang_code)
     context.user_data['lang'] = lang_code
     await update.message.reply_text(tr('language_set', lang_code))
 
 
-def product_keyboard(product_id: str, lang: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[InlineKeyboardButton(tr('buy_button', lang), callback_data=f'buy:{product_id}')]])
-
-
-def code_keyboard(pid: str, lang: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton(tr('code_button', lang), callback_data=f'code:{pid}')]]
-    )
+def credential_message(product: dict, pid: str, lang: str) -> tuple:
+    """Return the ``(text, kwargs)`` message delivering *product* to a buyer."""
+    text, markup = credential_view.render(product, pid, lang, storage.cipher.reveal)
+    return text, {'reply_markup': markup}
 
 
+@markups.memoize
 def build_back_menu(lang: str) -> InlineKeyboardMarkup:
     """Return a markup with a single back button."""
     return InlineKeyboardMarkup(
@@ -153,6 +265,7 @@ def build_back_menu(lang: str) -> InlineKeyboardMarkup:
     )
 
 
+@markups.memoize
 def build_admin_menu(lang: str) -> InlineKeyboardMarkup:
     """Return the admin submenu keyboard."""
     keyboard = [
@@ -173,6 +286,7 @@ def build_admin_menu(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
+@markups.memoize
 def build_products_menu(lang: str) -> InlineKeyboardMarkup:
     """Return submenu for managing products."""
     keyboard = [
@@ -201,6 +315,7 @@ def build_products_menu(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
+@markups.memoize
 def build_main_menu(lang: str, is_admin: bool = False) -> InlineKeyboardMarkup:
     """Return the main menu keyboard."""
     keyboard = [
@@ -221,12 +336,26 @@ async def products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not data['products']:
         await update.message.reply_text(tr('no_products', lang))
         return
-    for pid, info in data['products'].items():
-        text = f"{pid}: {info['price']}"
-        name = info.get('name')
-        if name:
-            text += f"\n{name}"
-        await update.message.reply_text(text, reply_markup=product_keyboard(pid, lang))
+    text, markup = catalog.render(data['products'], lang)
+    await update.message.reply_text(text, reply_markup=markup)
+
+
+@log_command
+async def catalog_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show another catalog page by editing the catalog message."""
+    ensure_lang(context, update.effective_user.id)
+    lang = context.user_data['lang']
+    query = update.callback_query
+    await query.answer()
+    try:
+        page = int(query.data.split(':')[1])
+    except (IndexError, ValueError):
+        return
+    if not data['products']:
+        await query.edit_message_text(tr('no_products', lang), reply_markup=build_back_menu(lang))
+        return
+    text, markup = catalog.render(data['products'], lang, page)
+    await query.edit_message_text(text, reply_markup=markup)
 
 
 @log_command
@@ -252,10 +381,10 @@ async def code_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not product:
         await query.message.reply_text(tr('product_not_found', lang))
         return
-    if query.from_user.id not in product.get('buyers', []):
+    if query.from_user.id not in buyers_of(product):
         await query.message.reply_text(tr('not_purchased', lang))
         return
-    secret = product.get('secret')
+    secret = credential(product, 'secret')
     if not secret:
         await query.message.reply_text(tr('no_secret', lang))
         return
@@ -282,17 +411,8 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 tr('no_products', lang), reply_markup=build_back_menu(lang)
             )
             return
-        for pid, info in data['products'].items():
-            text = f"{pid}: {info['price']}"
-            name = info.get('name')
-            if name:
-                text += f"\n{name}"
-            await query.message.reply_text(
-                text, reply_markup=product_keyboard(pid, lang)
-            )
-        await query.message.reply_text(
-            tr('menu_back', lang), reply_markup=build_back_menu(lang)
-        )
+        text, markup = catalog.render(data['products'], lang)
+        await query.message.reply_text(text, reply_markup=markup)
     elif action == 'contact':
         await query.message.reply_text(
             tr('admin_phone', lang).format(phone=ADMIN_PHONE),
@@ -335,6 +455,17 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@markups.memoize
+def build_language_menu(lang: str) -> InlineKeyboardMarkup:
+    """Return the language selection keyboard."""
+    keyboard = [
+        [InlineKeyboardButton(tr(f'lang_{code}', lang), callback_data=f'language:{code}')]
+        for code in available_languages()
+    ]
+    keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='menu:main')])
+    return InlineKeyboardMarkup(keyboard)
+
+
 @log_command
 async def language_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show language selection menu and handle selection."""
@@ -344,20 +475,14 @@ async def language_menu_callback(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     parts = query.data.split(':')
     if query.data == 'menu:language':
-        buttons = [
-            [InlineKeyboardButton(tr('lang_en', lang), callback_data='language:en')],
-            [InlineKeyboardButton(tr('lang_fa', lang), callback_data='language:fa')],
-            [InlineKeyboardButton(tr('menu_back', lang), callback_data='menu:main')],
-        ]
         await query.message.reply_text(
-            tr('menu_language', lang), reply_markup=InlineKeyboardMarkup(buttons)
+            tr('menu_language', lang), reply_markup=build_language_menu(lang)
         )
         return
     if parts[0] == 'language' and len(parts) > 1:
         lang_code = parts[1]
         if lang_code in SUPPORTED_LANGS:
-            data.setdefault('languages', {})[str(update.effective_user.id)] = lang_code
-            await storage.save(data)
+            await prefs.set_lang(update.effective_user.id, lang_code)
             context.user_data['lang'] = lang_code
             await query.message.reply_text(
                 tr('language_set', lang_code),
@@ -367,6 +492,67 @@ async def language_menu_callback(update: Update, context: ContextTypes.DEFAULT_T
             )
 
 
+# Admin menu action -> product picker action
+ADMIN_PICKERS = {
+    'editproduct': 'edit',
+    'deleteproduct': 'delete',
+    'stats': 'stats',
+    'buyers': 'buyers',
+    'clearbuyers': 'clearbuyers',
+    'resend': 'resend',
+}
+
+
+@markups.memoize
+def manage_back_menu(lang: str) -> InlineKeyboardMarkup:
+    """Return a markup with a single button back to product management."""
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
+    )
+
+
+async def send_picker(message, action: str, lang: str, prefix: str = '') -> None:
+    """Reply with the first page of the product picker for *action*."""
+    if not data['products']:
+        await message.reply_text(tr('no_products', lang), reply_markup=manage_back_menu(lang))
+        return
+    rendered = render_picker(product_index, data['products'], action, lang, prefix=prefix)
+    if rendered is None:
+        await message.reply_text(tr('no_matches', lang), reply_markup=manage_back_menu(lang))
+        return
+    text, markup = rendered
+    await message.reply_text(text, reply_markup=markup)
+
+
+@log_command
+@admin_required
+async def picker_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Page through a product picker or start a prefix search."""
+    lang = context.user_data['lang']
+    query = update.callback_query
+    await query.answer()
+    parts = query.data.split(':', 3)
+    if parts[0] == 'picksearch':
+        if len(parts) > 1 and parts[1] in PICKER_ACTIONS:
+            context.user_data['pick_search'] = parts[1]
+            await query.message.reply_text(tr('enter_search_prefix', lang))
+        return
+    try:
+        action = parts[1]
+        page = int(parts[2])
+    except (IndexError, ValueError):
+        return
+    if action not in PICKER_ACTIONS:
+        return
+    prefix = parts[3] if len(parts) > 3 else ''
+    rendered = render_picker(product_index, data['products'], action, lang, page, prefix)
+    if rendered is None:
+        await query.edit_message_text(tr('no_matches', lang), reply_markup=manage_back_menu(lang))
+        return
+    text, markup = rendered
+    await query.edit_message_text(text, reply_markup=markup)
+
+
 @log_command
 @admin_required
 async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -376,26 +562,7 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
     action = query.data.split(':')[1]
     if action == 'pending':
-        if not data['pending']:
-            await query.message.reply_text(tr('no_pending', lang))
-            return
-        for p in data['pending']:
-            text = tr('pending_entry', lang).format(
-                user_id=p['user_id'], product_id=p['product_id']
-            )
-            buttons = [
-                InlineKeyboardButton(
-                    tr('approve_button', lang),
-                    callback_data=f"admin:approve:{p['user_id']}:{p['product_id']}"
-                ),
-                InlineKeyboardButton(
-                    tr('reject_button', lang),
-                    callback_data=f"admin:reject:{p['user_id']}:{p['product_id']}"
-                ),
-            ]
-            await query.message.reply_text(
-                text, reply_markup=InlineKeyboardMarkup([buttons])
-            )
+        await send_review(query.message, lang)
     elif action == 'manage':
         await query.message.reply_text(
             tr('menu_manage_products', lang), reply_markup=build_products_menu(lang)
@@ -407,106 +574,17 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
                 [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
             ),
         )
-    elif action == 'editproduct':
-        if not data['products']:
-            await query.message.reply_text(
-                tr('no_products', lang),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
-                ),
-            )
-            return
-        keyboard = [
-            [InlineKeyboardButton(pid, callback_data=f"editprod:{pid}")]
-            for pid in data['products']
-        ]
-        keyboard.append([
-            InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')
-        ])
-        await query.message.reply_text(
-            tr('select_product_edit', lang),
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-    elif action == 'deleteproduct':
-        if not data['products']:
-            await query.message.reply_text(
-                tr('no_products', lang),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
-                ),
-            )
-            return
-        keyboard = [[InlineKeyboardButton(pid, callback_data=f'delprod:{pid}')]
-                    for pid in data['products']]
-        keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')])
-        await query.message.reply_text(
-            tr('select_product_delete', lang),
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-    elif action == 'stats':
-        if not data['products']:
-            await query.message.reply_text(
-                tr('no_products', lang),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
-                ),
-            )
-            return
-        keyboard = [[InlineKeyboardButton(pid, callback_data=f"adminstats:{pid}")]
-                    for pid in data['products']]
-        keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')])
-        await query.message.reply_text(
-            tr('select_product_stats', lang),
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-    elif action == 'buyers':
-        if not data['products']:
-            await query.message.reply_text(
-                tr('no_products', lang),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
-                ),
-            )
-            return
-        keyboard = [[InlineKeyboardButton(pid, callback_data=f"buyerlist:{pid}")]
-                    for pid in data['products']]
-        keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')])
-        await query.message.reply_text(
-            tr('select_product_buyers', lang),
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-    elif action == 'clearbuyers':
-        if not data['products']:
-            await query.message.reply_text(
-                tr('no_products', lang),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
-                ),
-            )
-            return
-        keyboard = [[InlineKeyboardButton(pid, callback_data=f"adminclearbuyers:{pid}")]
-                    for pid in data['products']]
-        keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')])
-        await query.message.reply_text(
-            tr('select_product_clearbuyers', lang),
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
-    elif action == 'resend':
-        if not data['products']:
-            await query.message.reply_text(
-                tr('no_products', lang),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')]]
-                ),
-            )
-            return
-        keyboard = [[InlineKeyboardButton(pid, callback_data=f"adminresend:{pid}")]
-                    for pid in data['products']]
-        keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')])
-        await query.message.reply_text(
-            tr('select_product_buyers', lang),
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+    elif action in ADMIN_PICKERS:
+        await send_picker(query.message, ADMIN_PICKERS[action], lang)
+
+
+@markups.memoize_product
+def build_field_menu(pid: str) -> InlineKeyboardMarkup:
+    """Return the buttons choosing which field of *pid* to edit."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(field, callback_data=f'editfield:{pid}:{field}')]
+        for field in ('price', 'username', 'password', 'secret', 'name')
+    ])
 
 
 @log_command
@@ -517,16 +595,9 @@ async def editprod_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     pid = query.data.split(':')[1]
-    buttons = [
-        [InlineKeyboardButton('price', callback_data=f'editfield:{pid}:price')],
-        [InlineKeyboardButton('username', callback_data=f'editfield:{pid}:username')],
-        [InlineKeyboardButton('password', callback_data=f'editfield:{pid}:password')],
-        [InlineKeyboardButton('secret', callback_data=f'editfield:{pid}:secret')],
-        [InlineKeyboardButton('name', callback_data=f'editfield:{pid}:name')],
-    ]
     await query.message.reply_text(
         tr('select_field_edit', lang),
-        reply_markup=InlineKeyboardMarkup(buttons),
+        reply_markup=build_field_menu(pid),
     )
 
 
@@ -555,11 +626,15 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     photo = update.message.photo[-1]
     file_id = photo.file_id
-    data['pending'].append({'user_id': update.message.from_user.id, 'product_id': pid, 'file_id': file_id})
-    # Remove the pid after recording the pending payment so later photos aren't
-    # mistakenly associated with this purchase.
-    context.user_data.pop('buy_pid', None)
-    await storage.save(data)
+    user_id = update.message.from_user.id
+    async with locks.hold(('pending', user_id, pid)):
+        # A repeated proof for the same purchase joins the existing entry
+        pending_of(data).add(user_id, pid, file_id)
+        # Remove the pid after recording the pending payment so later photos aren't
+        # mistakenly associated with this purchase.
+        context.user_data.pop('buy_pid', None)
+        storage.touch('pending', user_id, pid)
+        await storage.save(data)
     await update.message.reply_text(tr('payment_submitted', lang))
     await context.bot.send_photo(ADMIN_ID, file_id, caption=f"/approve {update.message.from_user.id} {pid}")
 
@@ -569,15 +644,15 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Update product field when awaiting new value from admin."""
     lang = context.user_data['lang']
+    search = context.user_data.pop('pick_search', None)
+    if search:
+        await send_picker(update.message, search, lang, prefix=update.message.text.strip())
+        return
     pid = context.user_data.get('edit_pid')
     field = context.user_data.get('edit_field')
     if not pid or not field:
         return
-    value = update.message.text
-    product = data['products'].get(pid)
-    if product is not None:
-        product[field] = value
-        await storage.save(data)
+    if await update_product(pid, field, update.message.text):
         await update.message.reply_text(tr('product_updated', lang))
     else:
         await update.message.reply_text(tr('product_not_found', lang))
@@ -607,6 +682,52 @@ async def stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.reply_text(text)
 
 
+async def send_buyers(message, product: dict, pid: str, mode: str, lang: str) -> None:
+    """Reply with the first page of the buyers of *product*."""
+    product_buyers = buyers_of(product)
+    if not product_buyers:
+        await message.reply_text(tr('no_buyers', lang))
+        return
+    text, markup = render_buyers(product_buyers, pid, mode, lang)
+    await message.reply_text(text, reply_markup=markup)
+
+
+@log_command
+@admin_required
+async def buyers_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show another page of a buyer list or send the whole list as a file."""
+    lang = context.user_data['lang']
+    query = update.callback_query
+    await query.answer()
+    if query.data.startswith('buyersexport:'):
+        pid = query.data.split(':', 1)[1]
+        product = data['products'].get(pid)
+        if not product:
+            await query.message.reply_text(tr('product_not_found', lang))
+            return
+        if not buyers_of(product):
+            # Telegram refuses empty files
+            await query.message.reply_text(tr('no_buyers', lang))
+            return
+        with export_buyers(buyers_of(product)) as fh:
+            await query.message.reply_document(fh, filename=f'{pid}-buyers.txt')
+        return
+    try:
+        _, mode, page, pid = query.data.split(':', 3)
+        page = int(page)
+    except ValueError:
+        return
+    product = data['products'].get(pid)
+    if not product or mode not in BUYER_ACTIONS:
+        await query.message.reply_text(tr('product_not_found', lang))
+        return
+    if not buyers_of(product):
+        await query.edit_message_text(tr('no_buyers', lang))
+        return
+    text, markup = render_buyers(buyers_of(product), pid, mode, lang, page)
+    await query.edit_message_text(text, reply_markup=markup)
+
+
 @log_command
 async def buyerlist_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List buyers with delete buttons."""
@@ -619,18 +740,7 @@ async def buyerlist_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not product:
         await query.message.reply_text(tr('product_not_found', lang))
         return
-    buyers = product.get('buyers', [])
-    if not buyers:
-        await query.message.reply_text(tr('no_buyers', lang))
-        return
-    for uid in buyers:
-        buttons = [
-            InlineKeyboardButton(
-                tr('delete_button', lang),
-                callback_data=f'admin:deletebuyer:{pid}:{uid}',
-            )
-        ]
-        await query.message.reply_text(str(uid), reply_markup=InlineKeyboardMarkup([buttons]))
+    await send_buyers(query.message, product, pid, 'delete', lang)
 
 
 @log_command
@@ -641,15 +751,132 @@ async def clearbuyers_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     pid = query.data.split(':')[1]
-    product = data['products'].get(pid)
-    if not product:
+    if await remove_buyers(pid) is None:
         await query.message.reply_text(tr('product_not_found', lang))
         return
-    product['buyers'] = []
-    await storage.save(data)
     await query.message.reply_text(tr('all_buyers_removed', lang))
 
 
+def resend_summary(pid: str, state: dict, lang: str) -> str:
+    """Return the final report of a finished resend."""
+    failed = state['failed']
+    text = tr('resend_report', lang).format(
+        sent=state['sent'], total=state['sent'] + len(failed)
+    )
+    if failed:
+        text += '\n' + tr('resend_failed', lang).format(ids=', '.join(map(str, failed[:50])))
+    return text
+
+
+def resend_progress(pid: str, state: dict, lang: str) -> tuple:
+    """Return the text and cancel button of a running resend."""
+    text = tr('resend_progress', lang).format(
+        product_id=pid,
+        sent=state['sent'],
+        failed=len(state['failed']),
+        remaining=max(0, state['total'] - state['position']),
+    )
+    markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(tr('cancel_button', lang), callback_data=f'resendcancel:{pid}')]]
+    )
+    return text, markup
+
+
+async def edit_resend_message(bot, state: dict, text: str, markup=None) -> None:
+    """Update the progress message of a resend, if it has one."""
+    if state.get('message_id') is None:
+        return
+    try:
+        await bot.edit_message_text(
+            text, chat_id=state['chat_id'], message_id=state['message_id'], reply_markup=markup
+        )
+    except TelegramError as exc:
+        logger.warning("Could not update resend progress: %s", exc)
+
+
+async def start_resend(message, bot, pid: str, lang: str) -> None:
+    """Start resending *pid*'s credentials to all its buyers in the background."""
+    if f'resend:{pid}' in jobs:
+        await message.reply_text(tr('resend_running', lang).format(product_id=pid))
+        return
+    total = len(buyers_of(data['products'][pid]))
+    if not total:
+        await message.reply_text(tr('no_buyers_send', lang))
+        return
+    state = {'lang': lang, 'position': 0, 'total': total, 'sent': 0, 'failed': []}
+    text, markup = resend_progress(pid, state, lang)
+    progress = await message.reply_text(text, reply_markup=markup)
+    state['chat_id'] = getattr(progress, 'chat_id', None)
+    state['message_id'] = getattr(progress, 'message_id', None)
+    data.setdefault('resends', {})[pid] = state
+    storage.touch('resends', pid)
+    await storage.save(data)
+    jobs.start(f'resend:{pid}', run_resend(bot, pid))
+
+
+async def run_resend(bot, pid: str) -> None:
+    """Resend credentials batch by batch from the stored checkpoint.
+
+    ``position`` counts the buyers handled so far and is saved after every
+    batch of :data:`RESEND_BATCH`, so a resend interrupted by a restart
+    continues where it stopped, repeating at most one batch. Buyers removed
+    meanwhile are taken out of the count, by :func:`remove_buyers` for the
+    handled ones and here for the batch being sent, so no buyer is skipped.
+    """
+    state = data['resends'][pid]
+    lang = state['lang']
+    last_progress = time.monotonic()
+    while True:
+        product = data['products'].get(pid)
+        if product is None:
+            break
+        start = state['position']
+        batch = buyers_of(product).slice(start, start + RESEND_BATCH)
+        if not batch:
+            break
+        report = await delivery.broadcast(bot, batch, [credential_message(product, pid, lang)])
+        async with locks.hold(('product', pid)):
+            buyers = buyers_of(product)
+            state['position'] += sum(1 for uid in batch if uid in buyers)
+            state['sent'] += report.sent
+            state['failed'].extend(report.failed)
+            storage.touch('resends', pid)
+            await storage.save(data)
+        if time.monotonic() - last_progress >= RESEND_PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            await edit_resend_message(bot, state, *resend_progress(pid, state, lang))
+    data['resends'].pop(pid, None)
+    storage.touch('resends', pid)
+    await storage.save(data)
+    await edit_resend_message(bot, state, resend_summary(pid, state, lang))
+
+
+@log_command
+@admin_required
+async def resend_job_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start a resend to all buyers of a product or cancel a running one."""
+    lang = context.user_data['lang']
+    query = update.callback_query
+    await query.answer()
+    action, pid = query.data.split(':', 1)
+    if action == 'adminresendall':
+        if pid not in data['products']:
+            await query.message.reply_text(tr('product_not_found', lang))
+            return
+        await start_resend(query.message, context.bot, pid, lang)
+        return
+    await jobs.cancel(f'resend:{pid}')
+    state = data.get('resends', {}).pop(pid, None)
+    if state is None:
+        await query.edit_message_text(tr('resend_not_running', lang).format(product_id=pid))
+        return
+    storage.touch('resends', pid)
+    await storage.save(data)
+    await query.edit_message_text(
+        tr('resend_cancelled', lang).format(product_id=pid, sent=state['sent'])
+    )
+
+
 @log_command
 async def resend_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle resend inline actions."""
@@ -665,20 +892,7 @@ async def resend_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not product:
             await query.message.reply_text(tr('product_not_found', lang))
             return
-        buyers = product.get('buyers', [])
-        if not buyers:
-            await query.message.reply_text(tr('no_buyers', lang))
-            return
-        for uid in buyers:
-            button = [
-                InlineKeyboardButton(
-                    tr('resend_button', lang),
-                    callback_data=f'adminresend:{pid}:{uid}',
-                )
-            ]
-            await query.message.reply_text(
-                str(uid), reply_markup=InlineKeyboardMarkup([button])
-            )
+        await send_buyers(query.message, product, pid, 'resend', lang)
         return
     try:
         _, pid, uid_str = parts
@@ -689,20 +903,23 @@ async def resend_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not product:
         await query.message.reply_text(tr('product_not_found', lang))
         return
-    if uid not in product.get('buyers', []):
+    if uid not in buyers_of(product):
         await query.message.reply_text(tr('buyer_not_found', lang))
         return
-    msg = tr('credentials_msg', lang).format(
-        username=product.get('username'),
-        password=product.get('password'),
-    )
-    await context.bot.send_message(uid, msg)
-    await context.bot.send_message(
-        uid,
-        tr('use_code_button', lang),
-        reply_markup=code_keyboard(pid, lang),
-    )
-    await query.message.reply_text(tr('credentials_resent', lang))
+    text, kwargs = credential_message(product, pid, lang)
+    if await delivery.send(context.bot, uid, text, **kwargs):
+        await query.message.reply_text(tr('credentials_resent', lang))
+    else:
+        await query.message.reply_text(tr('delivery_failed', lang).format(user_id=uid))
+
+
+@markups.memoize_product
+def build_delete_menu(pid: str, lang: str) -> InlineKeyboardMarkup:
+    """Return the buttons confirming the deletion of *pid*."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(tr('delete_button', lang), callback_data=f'delprod:{pid}:confirm')],
+        [InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:deleteproduct')],
+    ])
 
 
 @log_command
@@ -719,25 +936,234 @@ async def deleteprod_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         if pid not in data['products']:
             await query.message.reply_text(tr('product_not_found', lang))
             return
-        buttons = [
-            [InlineKeyboardButton(tr('delete_button', lang), callback_data=f'delprod:{pid}:confirm')],
-            [InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:deleteproduct')],
-        ]
         await query.message.reply_text(
             tr('confirm_delete', lang).format(pid=pid),
-            reply_markup=InlineKeyboardMarkup(buttons),
+            reply_markup=build_delete_menu(pid, lang),
         )
         return
     if len(parts) == 3 and parts[2] == 'confirm':
-        if pid in data['products']:
-            del data['products'][pid]
-            await storage.save(data)
+        if await remove_product(pid):
             await query.message.reply_text(tr('product_deleted', lang))
         else:
             await query.message.reply_text(tr('product_not_found', lang))
         return
 
 
+async def update_product(pid: str, field: str, value: str) -> bool:
+    """Set *field* of the product *pid*; return False if it does not exist."""
+    async with locks.hold(('product', pid)):
+        product = data['products'].get(pid)
+        if product is None:
+            return False
+        product[field] = value
+        storage.cipher.invalidate(pid, field)
+        storage.touch('products', pid, field)
+        products_changed(pid)
+        await storage.save(data)
+    return True
+
+
+async def remove_product(pid: str) -> bool:
+    """Delete the product *pid*; return False if it does not exist."""
+    async with locks.hold(('product', pid)):
+        if data['products'].pop(pid, None) is None:
+            return False
+        storage.cipher.invalidate(pid)
+        storage.touch('products', pid)
+        products_changed(pid)
+        await storage.save(data)
+    return True
+
+
+async def remove_buyers(pid: str, uid: int | None = None) -> bool | None:
+    """Remove the buyer *uid*, or every buyer, of the product *pid*.
+
+    Return ``None`` if the product does not exist and False if *uid* is
+    not one of its buyers. A running resend of *pid* is moved back by the
+    buyers removed from the part it already handled.
+    """
+    async with locks.hold(('product', pid)):
+        product = data['products'].get(pid)
+        if not product:
+            return None
+        buyers = buyers_of(product)
+        resend = data.get('resends', {}).get(pid)
+        if uid is None:
+            buyers.clear()
+            storage.touch('products', pid, 'buyers')
+            handled = resend['position'] if resend else 0
+        elif uid in buyers:
+            handled = 1 if resend and uid in buyers.slice(0, resend['position']) else 0
+            buyers.discard(uid)
+            storage.touch('products', pid, 'buyers', uid)
+        else:
+            return False
+        if handled:
+            resend['position'] -= handled
+            storage.touch('resends', pid)
+        await storage.save(data)
+    return True
+
+
+async def settle_purchase(context, user_id: int, pid: str, approve_it: bool, lang: str) -> str | None:
+    """Approve or reject a pending purchase and return the translation key
+    of the outcome, or ``None`` if the purchase is not pending.
+
+    Approving records the buyer and the delivery owed to them in the same
+    save, so credentials that could not be sent are retried on the next
+    start instead of being lost. If that save fails the credentials are
+    not sent yet; the outbox job retries once a save succeeds. Decisions on the same purchase wait for
+    each other, so only the first one is applied.
+    """
+    async with locks.hold(('pending', user_id, pid)):
+        async with locks.hold(('product', pid)):
+            if pending_of(data).pop(user_id, pid) is None:
+                return None
+            storage.touch('pending', user_id, pid)
+            if not approve_it:
+                await storage.save(data)
+                return 'rejected'
+            if pid in data['products']:
+                storage.touch('products', pid, 'buyers', user_id)
+            else:
+                storage.touch('products', pid)
+            buyers_of(data['products'].setdefault(pid, {})).append(user_id)
+            key = owe(data, user_id, pid, CREDENTIALS, lang)
+            storage.touch('outbox', key)
+            saved = await storage.save(data, wait=True)
+        if not saved:
+            logger.error("Purchase of %s by %s not saved, delivery postponed", pid, user_id)
+            jobs.start('outbox', retry_outbox(context.bot))
+            return 'approved_undelivered'
+        if not await deliver_owed(context.bot, key):
+            if key in outbox_of(data):
+                jobs.start('outbox', retry_outbox(context.bot))
+            return 'approved_undelivered'
+    return 'approved'
+
+
+async def deliver_owed(bot, key: str) -> bool:
+    """Send the outbox entry *key* and drop it once it was delivered.
+
+    Failed attempts are counted in the entry. An entry Telegram refuses
+    for good, e.g. because the buyer blocked the bot, or one that failed
+    :data:`OUTBOX_MAX_ATTEMPTS` times is dropped and reported to the admin.
+    """
+    async with locks.hold(('outbox', key)):
+        # Checked under the lock: a concurrent delivery may have sent it
+        entry = outbox_of(data).get(key)
+        if entry is None:
+            return True
+        pid = entry['product_id']
+        product = data['products'].get(pid)
+        delivered = True
+        if product is not None:
+            text, kwargs = credential_message(product, pid, entry.get('lang') or 'en')
+            outcome = await delivery.deliver(bot, entry['user_id'], text, **kwargs)
+            if outcome != SENT:
+                delivered = False
+                entry['attempts'] = entry.get('attempts', 0) + 1
+                if outcome == FAILED and entry['attempts'] < OUTBOX_MAX_ATTEMPTS:
+                    storage.touch('outbox', key)
+                    await storage.save(data)
+                    return False
+                logger.warning("Dropping delivery %s after %d attempts", key, entry['attempts'])
+                report = tr('delivery_dropped', user_lang(ADMIN_ID))
+                await delivery.send(bot, ADMIN_ID, report.format(user_id=entry['user_id'], product_id=pid))
+        else:
+            logger.warning("Dropping delivery %s of deleted product", key)
+        # The entry may have been replaced while sending; it is settled either way
+        outbox_of(data).pop(key, None)
+        storage.touch('outbox', key)
+        await storage.save(data)
+    return delivered
+
+
+async def drain_outbox(bot) -> None:
+    """Try every entry left in the outbox once, oldest first."""
+    delivered = 0
+    for key in list(outbox_of(data)):
+        if await deliver_owed(bot, key):
+            delivered += 1
+    logger.info("Delivered %d owed messages, %d left", delivered, len(outbox_of(data)))
+
+
+async def retry_outbox(bot, delay: float = OUTBOX_RETRY_INTERVAL) -> None:
+    """Drain the outbox after *delay* seconds, then every
+    :data:`OUTBOX_RETRY_INTERVAL` seconds until it is empty.
+
+    Entries are only sent once the data is saved, so a buyer never gets
+    credentials for a purchase that could still be lost.
+    """
+    await asyncio.sleep(delay)
+    while True:
+        if await storage.save(data, wait=True):
+            await drain_outbox(bot)
+        if not outbox_of(data):
+            return
+        await asyncio.sleep(OUTBOX_RETRY_INTERVAL)
+
+
+async def send_review(message, lang: str) -> None:
+    """Reply with the pending-review message showing the first purchase."""
+    rendered = render_review(pending_of(data), lang)
+    if rendered is None:
+        await message.reply_text(tr('no_pending', lang))
+        return
+    entry, caption, markup = rendered
+    if entry.get('file_id'):
+        await message.reply_photo(entry['file_id'], caption=caption, reply_markup=markup)
+    else:
+        await message.reply_text(caption, reply_markup=markup)
+
+
+@log_command
+@admin_required
+async def review_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Page through pending purchases or decide one, editing the message in place."""
+    lang = context.user_data['lang']
+    query = update.callback_query
+    await query.answer()
+    parts = query.data.split(':', 2)
+    status = ''
+    try:
+        if parts[1] == 'page':
+            position = int(parts[2])
+        elif parts[1] in {'approve', 'reject'}:
+            uid, rest = parts[2].split(':', 1)
+            pid, position = rest.rsplit(':', 1)
+            user_id, position = int(uid), int(position)
+        else:
+            return
+    except (IndexError, ValueError):
+        return
+    if parts[1] != 'page':
+        outcome = await settle_purchase(context, user_id, pid, parts[1] == 'approve', lang)
+        status = tr(outcome or 'pending_not_found', lang)
+    rendered = render_review(pending_of(data), lang, position, status)
+    try:
+        if rendered is None:
+            text = '\n'.join(filter(None, [status, tr('no_pending', lang)]))
+            if query.message.photo:
+                await query.edit_message_caption(caption=text, reply_markup=None)
+            else:
+                await query.edit_message_text(text, reply_markup=None)
+            return
+        entry, caption, markup = rendered
+        if query.message.photo and entry.get('file_id'):
+            await query.edit_message_media(
+                InputMediaPhoto(entry['file_id'], caption=caption), reply_markup=markup
+            )
+        elif query.message.photo:
+            await query.edit_message_caption(caption=caption, reply_markup=markup)
+        else:
+            await query.edit_message_text(caption, reply_markup=markup)
+    except BadRequest as exc:
+        # Tapping the button of the entry already shown leaves nothing to edit
+        if 'not modified' not in str(exc).lower():
+            raise
+
+
 @log_command
 @admin_required
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -748,63 +1174,25 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     parts = query.data.split(':')
     action = parts[1]
     if action == 'pending':
-        if not data['pending']:
-            await query.message.reply_text(tr('no_pending', lang))
-            return
-        for p in data['pending']:
-            text = tr('pending_entry', lang).format(user_id=p['user_id'], product_id=p['product_id'])
-            buttons = [
-                InlineKeyboardButton(
-                    tr('approve_button', lang),
-                    callback_data=f"admin:approve:{p['user_id']}:{p['product_id']}"
-                ),
-                InlineKeyboardButton(
-                    tr('reject_button', lang),
-                    callback_data=f"admin:reject:{p['user_id']}:{p['product_id']}"
-                ),
-            ]
-            await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup([buttons]))
+        await send_review(query.message, lang)
     elif action in {'approve', 'reject'}:
         try:
             user_id = int(parts[2])
             pid = parts[3]
         except (IndexError, ValueError):
             return
-        for p in data['pending']:
-            if p['user_id'] == user_id and p['product_id'] == pid:
-                data['pending'].remove(p)
-                if action == 'approve':
-                    buyers = data['products'].setdefault(pid, {}).setdefault('buyers', [])
-                    if user_id not in buyers:
-                        buyers.append(user_id)
-                    await storage.save(data)
-                    creds = data['products'][pid]
-                    msg = tr('credentials_msg', lang).format(username=creds.get('username'), password=creds.get('password'))
-                    await context.bot.send_message(user_id, msg)
-                    await context.bot.send_message(
-                        user_id,
-                        tr('use_code_button', lang),
-                        reply_markup=code_keyboard(pid, lang),
-                    )
-                    await query.message.reply_text(tr('approved', lang))
-                else:
-                    await storage.save(data)
-                    await query.message.reply_text(tr('rejected', lang))
-                return
-        await query.message.reply_text(tr('pending_not_found', lang))
+        outcome = await settle_purchase(context, user_id, pid, action == 'approve', lang)
+        await query.message.reply_text(tr(outcome or 'pending_not_found', lang))
     elif action == 'deletebuyer':
         try:
             pid = parts[2]
             uid = int(parts[3])
         except (IndexError, ValueError):
             return
-        product = data['products'].get(pid)
-        if not product:
+        removed = await remove_buyers(pid, uid)
+        if removed is None:
             await query.message.reply_text(tr('product_not_found', lang))
-            return
-        if uid in product.get('buyers', []):
-            product['buyers'].remove(uid)
-            await storage.save(data)
+        elif removed:
             await query.message.reply_text(tr('buyer_removed', lang))
         else:
             await query.message.reply_text(tr('buyer_not_found', lang))
@@ -820,27 +1208,8 @@ async def approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except (IndexError, ValueError):
         await update.message.reply_text(tr('approve_usage', lang))
         return
-    for p in data['pending']:
-        if p['user_id'] == user_id and p['product_id'] == pid:
-            data['pending'].remove(p)
-            buyers = data['products'].setdefault(pid, {}).setdefault('buyers', [])
-            if user_id not in buyers:
-                buyers.append(user_id)
-            await storage.save(data)
-            creds = data['products'][pid]
-            msg = tr('credentials_msg', lang).format(
-                username=creds.get('username'),
-                password=creds.get('password'),
-            )
-            await context.bot.send_message(user_id, msg)
-            await context.bot.send_message(
-                user_id,
-                tr('use_code_button', lang),
-                reply_markup=code_keyboard(pid, lang),
-            )
-            await update.message.reply_text(tr('approved', lang))
-            return
-    await update.message.reply_text(tr('pending_not_found', lang))
+    outcome = await settle_purchase(context, user_id, pid, True, lang)
+    await update.message.reply_text(tr(outcome or 'pending_not_found', lang))
 
 
 @log_command
@@ -856,10 +1225,10 @@ async def code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not product:
         await update.message.reply_text(tr('product_not_found', lang))
         return
-    if update.message.from_user.id not in product.get('buyers', []):
+    if update.message.from_user.id not in buyers_of(product):
         await update.message.reply_text(tr('not_purchased', lang))
         return
-    secret = product.get('secret')
+    secret = credential(product, 'secret')
     if not secret:
         await update.message.reply_text(tr('no_secret', lang))
         return
@@ -892,10 +1261,12 @@ async def addproduct(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'username': username,
         'password': password,
         'secret': secret,
-        'buyers': []
+        'buyers': BuyerSet()
     }
     if name:
         data['products'][pid]['name'] = name
+    storage.touch('products', pid)
+    products_changed(pid)
     await storage.save(data)
     await update.message.reply_text(tr('product_added', lang))
 
@@ -911,16 +1282,16 @@ async def editproduct(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except IndexError:
         await update.message.reply_text(tr('editproduct_usage', lang))
         return
-    product = data['products'].get(pid)
-    if not product:
+    if pid not in data['products']:
         await update.message.reply_text(tr('product_not_found', lang))
         return
     if field not in {'price', 'username', 'password', 'secret', 'name'}:
         await update.message.reply_text(tr('invalid_field', lang))
         return
-    product[field] = value
-    await storage.save(data)
-    await update.message.reply_text(tr('product_updated', lang))
+    if await update_product(pid, field, value):
+        await update.message.reply_text(tr('product_updated', lang))
+    else:
+        await update.message.reply_text(tr('product_not_found', lang))
 
 
 @log_command
@@ -932,9 +1303,7 @@ async def deleteproduct(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except IndexError:
         await update.message.reply_text(tr('deleteproduct_usage', lang))
         return
-    if pid in data["products"]:
-        del data["products"][pid]
-        await storage.save(data)
+    if await remove_product(pid):
         await update.message.reply_text(tr('product_deleted', lang))
     else:
         await update.message.reply_text(tr('product_not_found', lang))
@@ -953,29 +1322,23 @@ async def resend(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not product:
         await update.message.reply_text(tr('product_not_found', lang))
         return
-    buyers = product.get('buyers', [])
-    if len(context.args) > 1:
-        try:
-            uid = int(context.args[1])
-        except ValueError:
-            await update.message.reply_text(tr('invalid_user_id', lang))
-            return
-        buyers = [uid] if uid in buyers else []
-    if not buyers:
+    buyers = buyers_of(product)
+    if len(context.args) == 1:
+        await start_resend(update.message, context.bot, pid, lang)
+        return
+    try:
+        uid = int(context.args[1])
+    except ValueError:
+        await update.message.reply_text(tr('invalid_user_id', lang))
+        return
+    if uid not in buyers:
         await update.message.reply_text(tr('no_buyers_send', lang))
         return
-    msg = tr('credentials_msg', lang).format(
-        username=product.get('username'),
-        password=product.get('password'),
-    )
-    for uid in buyers:
-        await context.bot.send_message(uid, msg)
-        await context.bot.send_message(
-            uid,
-            tr('use_code_button', lang),
-            reply_markup=code_keyboard(pid, lang),
-        )
-    await update.message.reply_text(tr('credentials_resent', lang))
+    text, kwargs = credential_message(product, pid, lang)
+    if await delivery.send(context.bot, uid, text, **kwargs):
+        await update.message.reply_text(tr('credentials_resent', lang))
+    else:
+        await update.message.reply_text(tr('delivery_failed', lang).format(user_id=uid))
 
 
 @log_command
@@ -1006,7 +1369,7 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all pending purchases for the admin."""
     lang = context.user_data['lang']
-    if not data['pending']:
+    if not pending_of(data):
         await update.message.reply_text(tr('no_pending', lang))
         return
     lines = [
@@ -1014,7 +1377,7 @@ async def pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_id=p['user_id'],
             product_id=p['product_id'],
         )
-        for p in data['pending']
+        for p in pending_of(data)
     ]
     await update.message.reply_text('\n'.join(lines))
 
@@ -1030,13 +1393,8 @@ async def reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except (IndexError, ValueError):
         await update.message.reply_text(tr('reject_usage', lang))
         return
-    for p in data['pending']:
-        if p['user_id'] == user_id and p['product_id'] == pid:
-            data['pending'].remove(p)
-            await storage.save(data)
-            await update.message.reply_text(tr('rejected', lang))
-            return
-    await update.message.reply_text(tr('pending_not_found', lang))
+    outcome = await settle_purchase(context, user_id, pid, False, lang)
+    await update.message.reply_text(tr(outcome or 'pending_not_found', lang))
 
 
 @log_command
@@ -1052,11 +1410,7 @@ async def buyers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not product:
         await update.message.reply_text(tr('product_not_found', lang))
         return
-    buyers_list = product.get('buyers', [])
-    if buyers_list:
-        await update.message.reply_text(tr('buyers_list', lang).format(list=', '.join(map(str, buyers_list))))
-    else:
-        await update.message.reply_text(tr('no_buyers', lang))
+    await send_buyers(update.message, product, pid, 'list', lang)
 
 
 @log_command
@@ -1069,13 +1423,10 @@ async def deletebuyer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except (IndexError, ValueError):
         await update.message.reply_text(tr('deletebuyer_usage', lang))
         return
-    product = data['products'].get(pid)
-    if not product:
+    removed = await remove_buyers(pid, uid)
+    if removed is None:
         await update.message.reply_text(tr('product_not_found', lang))
-        return
-    if uid in product.get('buyers', []):
-        product['buyers'].remove(uid)
-        await storage.save(data)
+    elif removed:
         await update.message.reply_text(tr('buyer_removed', lang))
     else:
         await update.message.reply_text(tr('buyer_not_found', lang))
@@ -1090,12 +1441,9 @@ async def clearbuyers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except IndexError:
         await update.message.reply_text(tr('clearbuyers_usage', lang))
         return
-    product = data['products'].get(pid)
-    if not product:
+    if await remove_buyers(pid) is None:
         await update.message.reply_text(tr('product_not_found', lang))
         return
-    product['buyers'] = []
-    await storage.save(data)
     await update.message.reply_text(tr('all_buyers_removed', lang))
 
 
@@ -1165,18 +1513,48 @@ def get_bot_token(token: str | None) -> str:
     return token
 
 
-def main(token: str | None = None):
-    token = get_bot_token(token)
-    app = Application.builder().token(token).build()
+async def shutdown(app: Application) -> None:
+    """Flush pending writes before the process exits."""
+    # Interrupted resends keep their checkpoint and resume on the next start
+    await jobs.cancel_all()
+    await prefs.close()
+    await storage.close()
+    logger.info(
+        "Keyboards: %d hits, %d built (%.0f%% hit rate)",
+        markups.hits, markups.misses, markups.hit_rate() * 100,
+    )
+
+
+def create_app(token: str, new_config: Config | None = None) -> Application:
+    """Build the application with every handler registered.
+
+    Nothing is read from disk here: the data is loaded by :func:`load_data`
+    once the application starts inside its event loop. Passing
+    *new_config* reconfigures the module before the handlers are wired.
+    """
+    if new_config is not None:
+        configure(new_config)
+    app = (
+        Application.builder()
+        .token(token)
+        .post_init(load_data)
+        .post_shutdown(shutdown)
+        .concurrent_updates(UserSerializer(locks, config.concurrent_updates))
+        .build()
+    )
     import bot_conversations
 
+    # Track activity first so idle users' user_data can be evicted
+    app.add_handler(TypeHandler(Update, sessions.handler), group=-1)
     app.add_handler(CommandHandler('start', start))
     app.add_handler(CommandHandler('contact', contact))
     app.add_handler(CommandHandler('products', products))
     app.add_handler(CommandHandler('setlang', setlang))
     app.add_handler(CallbackQueryHandler(language_menu_callback, pattern=r'^(menu:language$|language:)'))
     app.add_handler(CallbackQueryHandler(resend_callback, pattern=r'^adminresend:'))
+    app.add_handler(CallbackQueryHandler(resend_job_callback, pattern=r'^(adminresendall|resendcancel):'))
     app.add_handler(CallbackQueryHandler(menu_callback, pattern=r'^menu:(?!language$)'))
+    app.add_handler(CallbackQueryHandler(catalog_callback, pattern=r'^catalog:'))
     app.add_handler(CallbackQueryHandler(buy_callback, pattern=r'^buy:'))
     app.add_handler(CallbackQueryHandler(code_callback, pattern=r'^code:'))
     addproduct_conv = ConversationHandler(
@@ -1212,8 +1590,11 @@ def main(token: str | None = None):
     )
     app.add_handler(addproduct_conv)
     app.add_handler(CallbackQueryHandler(admin_menu_callback, pattern=r'^adminmenu:'))
+    app.add_handler(CallbackQueryHandler(picker_callback, pattern=r'^(pick|picksearch):'))
+    app.add_handler(CallbackQueryHandler(review_callback, pattern=r'^review:'))
     app.add_handler(CallbackQueryHandler(stats_callback, pattern=r'^adminstats:'))
     app.add_handler(CallbackQueryHandler(buyerlist_callback, pattern=r'^buyerlist:'))
+    app.add_handler(CallbackQueryHandler(buyers_page_callback, pattern=r'^(buyers|buyersexport):'))
     app.add_handler(CallbackQueryHandler(clearbuyers_callback, pattern=r'^adminclearbuyers:'))
     app.add_handler(CallbackQueryHandler(deleteprod_callback, pattern=r'^delprod:'))
     app.add_handler(CallbackQueryHandler(admin_callback, pattern=r'^admin:'))
@@ -1237,10 +1618,62 @@ def main(token: str | None = None):
     app.add_handler(MessageHandler(filters.COMMAND, unknown))
 
     app.add_error_handler(error_handler)
+    return app
+
+
+async def run_webhook(app: Application) -> None:
+    """Serve updates POSTed by Telegram to :class:`WebhookServer` until
+    SIGINT or SIGTERM, with the same startup and shutdown as polling.
+    """
+    secret = config.webhook_secret or secrets.token_urlsafe(32)
+    server = WebhookServer(
+        app,
+        config.webhook_listen,
+        config.webhook_port,
+        config.webhook_path,
+        secret,
+        config.webhook_max_connections,
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await app.initialize()
+    try:
+        await app.post_init(app)
+        await server.start()
+        try:
+            await app.bot.set_webhook(
+                config.webhook_url,
+                secret_token=secret,
+                max_connections=config.webhook_max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            await app.start()
+        except BaseException:
+            await server.stop()
+            raise
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await app.stop()
+    finally:
+        await app.shutdown()
+        await app.post_shutdown(app)
+
 
-    app.run_polling()
+def main(token: str | None = None):
+    app = create_app(get_bot_token(token))
+    if config.webhook_url:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
 
 
 if __name__ == '__main__':
+    # bot_conversations imports this module as 'bot'; make that name refer to
+    # the running script instead of loading a second copy with empty data
+    sys.modules.setdefault('bot', sys.modules[__name__])
     token_arg = sys.argv[1] if len(sys.argv) > 1 else None
     main(token_arg)
@@ -1,7 +1,9 @@
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ConversationHandler
 
-from bot import ADMIN_ID, data, storage, ensure_lang
+import bot
+from bot import data, ensure_lang
+from botlib.indexes import BuyerSet
 from botlib.translations import tr
 
 ASK_ID, ASK_PRICE, ASK_USERNAME, ASK_PASSWORD, ASK_SECRET, ASK_NAME = range(6)
@@ -15,7 +17,7 @@ async def addproduct_menu(update, context):
     if message is None:
         message = update.callback_query.message
         await update.callback_query.answer()
-    if update.effective_user.id != ADMIN_ID:
+    if update.effective_user.id != bot.ADMIN_ID:
         await message.reply_text(tr("unauthorized", lang))
         return ConversationHandler.END
     context.user_data["new_product"] = {}
@@ -28,94 +30,83 @@ async def addproduct_menu(update, context):
     return ASK_ID
 
 
-async def addproduct_id(update, context):
+async def _draft(update, context):
+    """Return the product being added, or ``None`` after telling the admin
+    to start over because it was lost.
+    """
+    ensure_lang(context, update.effective_user.id)
+    draft = context.user_data.get("new_product")
+    if draft is None:
+        await update.message.reply_text(
+            tr("addproduct_restart", context.user_data["lang"]),
+            reply_markup=ReplyKeyboardRemove(),
+        )
+    return draft
+
+
+def _cancelled(update, lang):
+    return update.message.text in (CANCEL_TEXT, tr("cancel_button", lang), tr("back_button", lang))
+
+
+async def _ask_next(update, context, field, prompt, state):
+    """Store the reply as *field* of the draft and ask for the next one."""
+    ensure_lang(context, update.effective_user.id)
     lang = context.user_data["lang"]
-    cancel_text = tr("cancel_button", lang)
-    if update.message.text in (CANCEL_TEXT, cancel_text, tr("back_button", lang)):
+    if _cancelled(update, lang):
         return await addproduct_cancel(update, context)
-    context.user_data["pid"] = update.message.text
-    context.user_data["new_product"]["pid"] = update.message.text
+    draft = await _draft(update, context)
+    if draft is None:
+        return ConversationHandler.END
+    draft[field] = update.message.text
     await update.message.reply_text(
-        tr("ask_product_price", lang),
-        reply_markup=ReplyKeyboardMarkup([[cancel_text]], one_time_keyboard=True),
+        tr(prompt, lang),
+        reply_markup=ReplyKeyboardMarkup([[tr("cancel_button", lang)]], one_time_keyboard=True),
     )
-    return ASK_PRICE
+    return state
+
+
+async def addproduct_id(update, context):
+    return await _ask_next(update, context, "pid", "ask_product_price", ASK_PRICE)
 
 
 async def addproduct_price(update, context):
-    lang = context.user_data["lang"]
-    cancel_text = tr("cancel_button", lang)
-    if update.message.text in (CANCEL_TEXT, cancel_text, tr("back_button", lang)):
-        return await addproduct_cancel(update, context)
-    context.user_data["price"] = update.message.text
-    context.user_data["new_product"]["price"] = update.message.text
-    await update.message.reply_text(
-        tr("ask_product_username", lang),
-        reply_markup=ReplyKeyboardMarkup([[cancel_text]], one_time_keyboard=True),
-    )
-    return ASK_USERNAME
+    return await _ask_next(update, context, "price", "ask_product_username", ASK_USERNAME)
 
 
 async def addproduct_username(update, context):
-    lang = context.user_data["lang"]
-    cancel_text = tr("cancel_button", lang)
-    if update.message.text in (CANCEL_TEXT, cancel_text, tr("back_button", lang)):
-        return await addproduct_cancel(update, context)
-    context.user_data["username"] = update.message.text
-    context.user_data["new_product"]["username"] = update.message.text
-    await update.message.reply_text(
-        tr("ask_product_password", lang),
-        reply_markup=ReplyKeyboardMarkup([[cancel_text]], one_time_keyboard=True),
-    )
-    return ASK_PASSWORD
+    return await _ask_next(update, context, "username", "ask_product_password", ASK_PASSWORD)
 
 
 async def addproduct_password(update, context):
-    lang = context.user_data["lang"]
-    cancel_text = tr("cancel_button", lang)
-    if update.message.text in (CANCEL_TEXT, cancel_text, tr("back_button", lang)):
-        return await addproduct_cancel(update, context)
-    context.user_data["password"] = update.message.text
-    context.user_data["new_product"]["password"] = update.message.text
-    await update.message.reply_text(
-        tr("ask_product_secret", lang),
-        reply_markup=ReplyKeyboardMarkup([[cancel_text]], one_time_keyboard=True),
-    )
-    return ASK_SECRET
+    return await _ask_next(update, context, "password", "ask_product_secret", ASK_SECRET)
 
 
 async def addproduct_secret(update, context):
-    lang = context.user_data["lang"]
-    cancel_text = tr("cancel_button", lang)
-    if update.message.text in (CANCEL_TEXT, cancel_text, tr("back_button", lang)):
-        return await addproduct_cancel(update, context)
-    context.user_data["secret"] = update.message.text
-    context.user_data["new_product"]["secret"] = update.message.text
-    await update.message.reply_text(
-        tr("ask_product_name", lang),
-        reply_markup=ReplyKeyboardMarkup([[cancel_text]], one_time_keyboard=True),
-    )
-    return ASK_NAME
+    return await _ask_next(update, context, "secret", "ask_product_name", ASK_NAME)
 
 
 async def addproduct_name(update, context):
+    ensure_lang(context, update.effective_user.id)
     lang = context.user_data["lang"]
-    cancel_text = tr("cancel_button", lang)
-    if update.message.text in (CANCEL_TEXT, cancel_text, tr("back_button", lang)):
+    if _cancelled(update, lang):
         return await addproduct_cancel(update, context)
-    name = update.message.text
-    pid = context.user_data["pid"]
+    draft = await _draft(update, context)
+    if draft is None:
+        return ConversationHandler.END
+    pid = draft["pid"]
     data["products"][pid] = {
-        "price": context.user_data["price"],
-        "username": context.user_data["username"],
-        "password": context.user_data["password"],
-        "secret": context.user_data["secret"],
-        "buyers": [],
+        "price": draft["price"],
+        "username": draft["username"],
+        "password": draft["password"],
+        "secret": draft["secret"],
+        "buyers": BuyerSet(),
     }
+    name = update.message.text
     if name and name != "-":
         data["products"][pid]["name"] = name
-        context.user_data["new_product"]["name"] = name
-    await storage.save(data)
+    bot.storage.touch("products", pid)
+    bot.products_changed(pid)
+    await bot.storage.save(data)
     context.user_data.pop("new_product", None)
     await update.message.reply_text(tr("product_added", lang), reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
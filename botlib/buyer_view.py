@@ -0,0 +1,101 @@
+"""Paged buyer listings and buyer list exports for the admin."""
+import tempfile
+from typing import IO, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .catalog import page_count
+from .indexes import BuyerSet
+from .translations import tr
+
+# Buyers listed on one page
+DEFAULT_PAGE_SIZE = 10
+
+# Ids written to an export per write call
+EXPORT_CHUNK = 1000
+
+# Exports larger than this are spooled to disk instead of kept in memory
+EXPORT_SPOOL_SIZE = 1 << 20
+
+# View mode -> callback prefix of the per-buyer button and its label key;
+# 'list' shows the ids in the text and has no per-buyer buttons
+BUYER_ACTIONS = {
+    'list': None,
+    'delete': ('admin:deletebuyer', 'delete_buyer_button'),
+    'resend': ('adminresend', 'resend_buyer_button'),
+}
+
+
+def render_buyers(
+    buyers: BuyerSet,
+    pid: str,
+    mode: str,
+    lang: str,
+    page: int = 0,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Tuple[str, InlineKeyboardMarkup]:
+    """Return ``(text, markup)`` for one page of the buyers of *pid*.
+
+    Only the ids of the requested page are read from *buyers*. Rows hold
+    one buyer each in the ``delete`` and ``resend`` modes, followed by
+    previous/next buttons (``buyers:<mode>:<page>:<pid>``), a button
+    resending to every buyer (``adminresendall:<pid>``) in the ``resend``
+    mode and an export button (``buyersexport:<pid>``).
+    """
+    pages = page_count(len(buyers), page_size)
+    page = min(max(page, 0), pages - 1)
+    ids = buyers.slice(page * page_size, (page + 1) * page_size)
+    lines = [tr('buyers_header', lang).format(product_id=pid, count=len(buyers))]
+    keyboard = []
+    action = BUYER_ACTIONS[mode]
+    if action is None:
+        lines.extend(map(str, ids))
+    else:
+        target, label = action
+        keyboard = [
+            [InlineKeyboardButton(
+                tr(label, lang).format(user_id=uid), callback_data=f'{target}:{pid}:{uid}'
+            )]
+            for uid in ids
+        ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(
+            tr('page_prev', lang), callback_data=f'buyers:{mode}:{page - 1}:{pid}'
+        ))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(
+            tr('page_next', lang), callback_data=f'buyers:{mode}:{page + 1}:{pid}'
+        ))
+    if nav:
+        keyboard.append(nav)
+    if mode == 'resend':
+        keyboard.append([InlineKeyboardButton(
+            tr('resend_all_button', lang), callback_data=f'adminresendall:{pid}'
+        )])
+    keyboard.append([InlineKeyboardButton(
+        tr('export_buyers_button', lang), callback_data=f'buyersexport:{pid}'
+    )])
+    if pages > 1:
+        lines.append(tr('catalog_page', lang).format(page=page + 1, pages=pages))
+    return '\n'.join(lines), InlineKeyboardMarkup(keyboard)
+
+
+def export_buyers(buyers: BuyerSet) -> IO[bytes]:
+    """Write one buyer id per line to a temporary file, rewound for reading.
+
+    Ids are encoded in chunks of :data:`EXPORT_CHUNK`, so the list is never
+    held as one string; large exports spill to disk. The caller closes the
+    returned file.
+    """
+    fh = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    chunk = []
+    for uid in buyers:
+        chunk.append(str(uid))
+        if len(chunk) >= EXPORT_CHUNK:
+            fh.write(('\n'.join(chunk) + '\n').encode())
+            chunk.clear()
+    if chunk:
+        fh.write(('\n'.join(chunk) + '\n').encode())
+    fh.seek(0)
+    return fh
@@ -0,0 +1,83 @@
+"""Paginated product catalog rendered as a single message."""
+from itertools import islice
+from typing import Any, Dict, List, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .translations import tr
+
+# Products shown on one catalog page
+DEFAULT_PAGE_SIZE = 8
+
+Page = Tuple[str, InlineKeyboardMarkup]
+
+
+def page_count(total: int, page_size: int) -> int:
+    """Return the number of pages needed for *total* items (at least 1)."""
+    return max(1, -(-total // page_size))
+
+
+class CatalogView:
+    """Render catalog pages and cache them per language and page.
+
+    A page lists its products as text with one buy button each, followed by
+    previous/next buttons (``catalog:<page>``) and a back button. Renders
+    are cached until :meth:`invalidate` bumps the catalog version, or a
+    different products dict is passed in.
+    """
+
+    def __init__(self, page_size: int = DEFAULT_PAGE_SIZE):
+        self.page_size = page_size
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._products: Any = None
+        self._cache: Dict[Tuple[str, int, int], Page] = {}
+
+    def invalidate(self) -> None:
+        """Mark every cached page stale after a product change."""
+        self.version += 1
+        self._cache.clear()
+
+    def render(self, products: Dict[str, Dict[str, Any]], lang: str, page: int = 0) -> Page:
+        """Return ``(text, markup)`` for *page*, clamped to the valid range."""
+        if products is not self._products:
+            self._products = products
+            self.invalidate()
+        pages = page_count(len(products), self.page_size)
+        page = min(max(page, 0), pages - 1)
+        key = (lang, page, self.version)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        rendered = self._render(products, lang, page, pages)
+        self._cache[key] = rendered
+        return rendered
+
+    def _render(
+        self, products: Dict[str, Dict[str, Any]], lang: str, page: int, pages: int
+    ) -> Page:
+        start = page * self.page_size
+        lines: List[str] = []
+        keyboard: List[List[InlineKeyboardButton]] = []
+        for pid, info in islice(products.items(), start, start + self.page_size):
+            line = f"{pid}: {info.get('price')}"
+            name = info.get('name')
+            if name:
+                line += f"\n{name}"
+            lines.append(line)
+            keyboard.append([
+                InlineKeyboardButton(f"{tr('buy_button', lang)} {pid}", callback_data=f'buy:{pid}')
+            ])
+        if pages > 1:
+            lines.append(tr('catalog_page', lang).format(page=page + 1, pages=pages))
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton(tr('page_prev', lang), callback_data=f'catalog:{page - 1}'))
+            if page < pages - 1:
+                nav.append(InlineKeyboardButton(tr('page_next', lang), callback_data=f'catalog:{page + 1}'))
+            keyboard.append(nav)
+        keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='menu:main')])
+        return "\n\n".join(lines), InlineKeyboardMarkup(keyboard)
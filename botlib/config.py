@@ -0,0 +1,150 @@
+"""Runtime configuration read from environment variables."""
+import logging
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Mapping, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Directory holding bot.py, where data files are kept by default
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def _fail(message: str) -> SystemExit:
+    logger.error(message)
+    return SystemExit(message)
+
+
+def _flag(environ: Mapping[str, str], name: str) -> bool:
+    """Return True if *name* is set to a truthy value in *environ*."""
+    return environ.get(name, '').lower() in {'1', 'true', 'yes', 'on'}
+
+
+@dataclass(frozen=True)
+class Config:
+    """Settings needed to build the bot's storage and handlers."""
+
+    admin_id: int
+    admin_phone: str
+    fernet_key: str
+    data_backend: str = 'json'
+    data_file: Optional[Path] = None
+    data_journal: bool = False
+    data_fsync: bool = False
+    save_delay_ms: int = 0
+    prefs_file: Optional[Path] = None
+    prefs_delay_ms: int = 1000
+    session_max_users: int = 10000
+    session_ttl: float = 3600.0
+    send_rate: float = 25.0
+    send_retries: int = 3
+    concurrent_updates: int = 64
+    webhook_url: Optional[str] = None
+    webhook_listen: str = '0.0.0.0'
+    webhook_port: int = 8443
+    webhook_path: Optional[str] = None
+    webhook_secret: Optional[str] = None
+    webhook_max_connections: int = 40
+
+    def __post_init__(self) -> None:
+        if self.data_file is None:
+            name = 'data.db' if self.data_backend == 'sqlite' else 'data.json'
+            object.__setattr__(self, 'data_file', BASE_DIR / name)
+        if self.prefs_file is None:
+            object.__setattr__(self, 'prefs_file', self.data_file.with_name('prefs.json'))
+        if self.webhook_url and self.webhook_path is None:
+            object.__setattr__(self, 'webhook_path', urlparse(self.webhook_url).path or '/')
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "Config":
+        """Read the configuration, exiting with a message if it is invalid."""
+        env = os.environ if environ is None else environ
+
+        # Storage backend: 'json' (default) or 'sqlite'
+        backend = env.get('DATA_BACKEND', 'json').lower()
+        if backend not in {'json', 'sqlite'}:
+            raise _fail("DATA_BACKEND must be 'json' or 'sqlite'")
+        try:
+            admin_id = int(env["ADMIN_ID"])
+        except KeyError:
+            raise _fail("ADMIN_ID environment variable not set")
+        except ValueError as e:
+            raise _fail("ADMIN_ID must be an integer") from e
+        admin_phone = env.get("ADMIN_PHONE")  # manager contact number
+        if not admin_phone:
+            raise _fail("ADMIN_PHONE environment variable not set")
+        fernet_key = env.get("FERNET_KEY")
+        if not fernet_key:
+            raise _fail("FERNET_KEY environment variable not set")
+        # Coalesce saves made within this many milliseconds into one write (0 = off)
+        try:
+            save_delay_ms = int(env.get('SAVE_DELAY_MS', '0'))
+        except ValueError as e:
+            raise _fail("SAVE_DELAY_MS must be an integer") from e
+        try:
+            prefs_delay_ms = int(env.get('PREFS_DELAY_MS', '1000'))
+        except ValueError as e:
+            raise _fail("PREFS_DELAY_MS must be an integer") from e
+        # Forget idle users' user_data after this many seconds or beyond this many users
+        try:
+            session_max_users = int(env.get('SESSION_MAX_USERS', '10000'))
+            session_ttl = float(env.get('SESSION_TTL', '3600'))
+        except ValueError as e:
+            raise _fail("SESSION_MAX_USERS and SESSION_TTL must be numbers") from e
+        # Outgoing messages per second and retries of failed sends
+        try:
+            send_rate = float(env.get('SEND_RATE', '25'))
+            send_retries = int(env.get('SEND_RETRIES', '3'))
+        except ValueError as e:
+            raise _fail("SEND_RATE and SEND_RETRIES must be numbers") from e
+        if send_rate <= 0:
+            raise _fail("SEND_RATE must be positive")
+        try:
+            concurrent_updates = int(env.get('CONCURRENT_UPDATES', '64'))
+        except ValueError as e:
+            raise _fail("CONCURRENT_UPDATES must be an integer") from e
+        if concurrent_updates < 1:
+            raise _fail("CONCURRENT_UPDATES must be at least 1")
+        # Receive updates through a webhook at this public URL instead of polling
+        webhook_url = env.get('WEBHOOK_URL') or None
+        if webhook_url and not webhook_url.startswith('https://'):
+            raise _fail("WEBHOOK_URL must be an https:// URL")
+        try:
+            webhook_port = int(env.get('WEBHOOK_PORT', '8443'))
+            webhook_max_connections = int(env.get('WEBHOOK_MAX_CONNECTIONS', '40'))
+        except ValueError as e:
+            raise _fail("WEBHOOK_PORT and WEBHOOK_MAX_CONNECTIONS must be integers") from e
+        if not 1 <= webhook_max_connections <= 100:
+            raise _fail("WEBHOOK_MAX_CONNECTIONS must be between 1 and 100")
+        webhook_secret = env.get('WEBHOOK_SECRET') or None
+        if webhook_secret and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', webhook_secret):
+            raise _fail("WEBHOOK_SECRET may only contain A-Z, a-z, 0-9, _ and -")
+        data_file = env.get('DATA_FILE')
+        prefs_file = env.get('PREFS_FILE')
+        return cls(
+            admin_id=admin_id,
+            admin_phone=admin_phone,
+            fernet_key=fernet_key,
+            data_backend=backend,
+            data_file=Path(data_file) if data_file else None,
+            # Append per-change records to a journal instead of rewriting the data file
+            data_journal=_flag(env, 'DATA_JOURNAL'),
+            data_fsync=_flag(env, 'DATA_FSYNC'),
+            save_delay_ms=save_delay_ms,
+            prefs_file=Path(prefs_file) if prefs_file else None,
+            prefs_delay_ms=prefs_delay_ms,
+            session_max_users=session_max_users,
+            session_ttl=session_ttl,
+            send_rate=send_rate,
+            send_retries=send_retries,
+            concurrent_updates=concurrent_updates,
+            webhook_url=webhook_url,
+            webhook_listen=env.get('WEBHOOK_LISTEN', '0.0.0.0'),
+            webhook_port=webhook_port,
+            webhook_path=env.get('WEBHOOK_PATH') or None,
+            webhook_secret=webhook_secret,
+            webhook_max_connections=webhook_max_connections,
+        )
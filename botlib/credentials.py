@@ -0,0 +1,70 @@
+"""Rendering of the message that delivers a product's credentials."""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .translations import tr
+
+# Templates and keyboards kept, one per (product, language)
+DEFAULT_CACHE_SIZE = 256
+
+
+def code_keyboard(pid: str, lang: str) -> InlineKeyboardMarkup:
+    """Return the markup with the button asking for a product's TOTP code."""
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(tr('code_button', lang), callback_data=f'code:{pid}')]]
+    )
+
+
+class CredentialView:
+    """Render credentials and the code button as one message.
+
+    Only the message template and markup of a ``(product, language)`` pair
+    are cached; the credentials are revealed on every render, so plaintext
+    is never kept here beyond the expiring cache of ``reveal``. The cache
+    is bounded.
+    """
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[str, InlineKeyboardMarkup]]" = OrderedDict()
+
+    def invalidate(self, pid: Any = None) -> None:
+        """Forget the messages of *pid*, or of every product."""
+        if pid is None:
+            self._cache.clear()
+            return
+        for key in [key for key in self._cache if key[0] == pid]:
+            del self._cache[key]
+
+    def _layout(self, pid: str, lang: str) -> Tuple[str, InlineKeyboardMarkup]:
+        key = (pid, lang)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return cached
+        self.misses += 1
+        template = tr('credentials_msg', lang) + '\n\n' + tr('use_code_button', lang)
+        cached = self._cache[key] = (template, code_keyboard(pid, lang))
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return cached
+
+    def render(
+        self,
+        product: Dict[str, Any],
+        pid: str,
+        lang: str,
+        reveal: Callable[[Any], Any],
+    ) -> Tuple[str, InlineKeyboardMarkup]:
+        """Return ``(text, markup)`` delivering *product* to a buyer."""
+        template, markup = self._layout(pid, lang)
+        text = template.format(
+            username=reveal(product.get('username')),
+            password=reveal(product.get('password')),
+        )
+        return text, markup
@@ -0,0 +1,205 @@
+"""Rate-limited delivery of outgoing messages with retries."""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Bot API limits: about 30 messages per second overall and one per second
+# to the same chat, with short bursts tolerated
+DEFAULT_RATE = 25.0
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+DEFAULT_WORKERS = 8
+
+# Per-chat buckets kept before idle ones are dropped
+MAX_CHAT_BUCKETS = 4096
+
+# A message is ``(text, send_message keyword arguments)``
+Message = Tuple[str, Dict[str, Any]]
+
+# Outcomes of :meth:`Delivery.deliver`: sent, refused by Telegram for good
+# (blocked bot, unknown chat), or given up on for now
+SENT = "sent"
+REFUSED = "refused"
+FAILED = "failed"
+
+
+class TokenBucket:
+    """Token bucket handing out reservations instead of blocking.
+
+    :meth:`reserve` takes a token and returns how long the caller has to
+    wait before using it. The balance may go negative, so callers that
+    reserve concurrently are spaced out in the order they asked.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "_clock")
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self.stamp = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self) -> float:
+        """Take one token; return the seconds to wait before it is valid."""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        """Return True if the bucket is full and can be dropped."""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class DeliveryReport:
+    """Outcome of a batch of deliveries."""
+
+    sent: int = 0
+    failed: List[int] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.sent + len(self.failed)
+
+
+def _retry_after(exc: RetryAfter) -> float:
+    delay = exc.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+class Delivery:
+    """Send messages within the Bot API rate limits.
+
+    Every message first takes a token from a global bucket and from the
+    bucket of its chat. A ``RetryAfter`` pauses all sends for the time
+    Telegram asks for and the message is tried again; network errors are
+    retried up to ``retries`` times with exponential backoff. Messages to
+    a chat that blocked the bot or does not exist fail at once.
+
+    No asyncio primitives are kept between calls, so one instance can be
+    shared by applications running in different event loops.
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        workers: int = DEFAULT_WORKERS,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = workers
+        self._clock = clock
+        self._sleep = sleep
+        self._global = TokenBucket(rate, max(1.0, rate), clock)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST, self._clock)
+        return bucket
+
+    async def _wait_turn(self, chat_id: int) -> None:
+        pause = self._paused_until - self._clock()
+        if pause > 0:
+            await self._sleep(pause)
+        delay = max(self._global.reserve(), self._chat_bucket(chat_id).reserve())
+        if delay > 0:
+            await self._sleep(delay)
+
+    async def send(self, bot: Any, chat_id: int, text: str, **kwargs: Any) -> bool:
+        """Send one message; return False if it could not be delivered."""
+        return await self.deliver(bot, chat_id, text, **kwargs) == SENT
+
+    async def deliver(self, bot: Any, chat_id: int, text: str, **kwargs: Any) -> str:
+        """Send one message and return :data:`SENT`, :data:`REFUSED` or :data:`FAILED`."""
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id)
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+                return SENT
+            except RetryAfter as exc:
+                delay = _retry_after(exc)
+                logger.warning("Flood limit hit, pausing sends for %.1fs", delay)
+                self._paused_until = max(self._paused_until, self._clock() + delay)
+            except (Forbidden, BadRequest) as exc:
+                logger.warning("Cannot deliver to %s: %s", chat_id, exc)
+                return REFUSED
+            except NetworkError as exc:
+                if attempt >= self.retries:
+                    logger.error("Giving up on %s after %d attempts: %s", chat_id, attempt + 1, exc)
+                    return FAILED
+                await self._sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+            if attempt > self.retries + 1:
+                logger.error("Giving up on %s after repeated flood limits", chat_id)
+                return FAILED
+
+    async def send_all(self, bot: Any, chat_id: int, messages: Sequence[Message]) -> bool:
+        """Send *messages* to one chat in order, stopping at the first failure."""
+        for text, kwargs in messages:
+            if not await self.send(bot, chat_id, text, **kwargs):
+                return False
+        return True
+
+    async def broadcast(
+        self,
+        bot: Any,
+        chat_ids: Iterable[int],
+        messages: Sequence[Message],
+    ) -> DeliveryReport:
+        """Send *messages* to every chat in *chat_ids* and report the outcome.
+
+        Chats are served by ``workers`` concurrent tasks, so the global rate
+        is reached even though each chat is limited to one message a second.
+        """
+        report = DeliveryReport()
+        queue: "asyncio.Queue[int]" = asyncio.Queue(maxsize=self.workers * 2)
+
+        async def worker() -> None:
+            while True:
+                chat_id = await queue.get()
+                try:
+                    delivered = await self.send_all(bot, chat_id, messages)
+                except Exception:
+                    logger.exception("Delivery to %s failed", chat_id)
+                    delivered = False
+                if delivered:
+                    report.sent += 1
+                else:
+                    report.failed.append(chat_id)
+                queue.task_done()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            for chat_id in chat_ids:
+                await queue.put(chat_id)
+            await queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return report
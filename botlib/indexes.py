@@ -0,0 +1,168 @@
+from array import array
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+class BuyerSet:
+    """Insertion-ordered set of buyer ids.
+
+    Membership, :meth:`append` and :meth:`remove` are O(1) instead of the
+    linear scans of a plain list, while iteration keeps purchase order for
+    admin listings. The list methods used by the handlers are kept so a
+    ``BuyerSet`` can stand in wherever a buyers list was expected, and it
+    compares equal to a list holding the same ids in the same order.
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._ids: Dict[int, None] = dict.fromkeys(ids)
+
+    def __contains__(self, uid: object) -> bool:
+        return uid in self._ids
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, BuyerSet):
+            return list(self._ids) == list(other._ids)
+        if isinstance(other, (list, array)):
+            return list(self._ids) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"BuyerSet({list(self._ids)!r})"
+
+    def append(self, uid: int) -> None:
+        """Add *uid* unless it is already a buyer."""
+        self._ids[uid] = None
+
+    def remove(self, uid: int) -> None:
+        """Remove *uid*, raising :class:`ValueError` like ``list.remove``."""
+        try:
+            del self._ids[uid]
+        except KeyError:
+            raise ValueError(f"{uid!r} is not a buyer") from None
+
+    def discard(self, uid: int) -> bool:
+        """Remove *uid* if present and return whether it was."""
+        return self._ids.pop(uid, False) is None
+
+    def clear(self) -> None:
+        self._ids.clear()
+
+    def slice(self, start: int, stop: int) -> List[int]:
+        """Return the ids from *start* to *stop* in insertion order."""
+        return list(islice(self._ids, start, stop))
+
+    def to_array(self) -> Union["array[int]", List[Any]]:
+        """Return the ids as a compact ``array('q')`` in insertion order.
+
+        Ids that do not fit a signed 64-bit integer are returned as a list.
+        """
+        try:
+            return array("q", self._ids)
+        except (TypeError, OverflowError):
+            return list(self._ids)
+
+
+def buyers_of(product: Dict[str, Any]) -> BuyerSet:
+    """Return the :class:`BuyerSet` of *product*, upgrading a plain list."""
+    buyers = product.get("buyers")
+    if not isinstance(buyers, BuyerSet):
+        buyers = BuyerSet(buyers or ())
+        product["buyers"] = buyers
+    return buyers
+
+
+PendingKey = Tuple[int, str]
+
+
+class PendingQueue:
+    """Pending purchases keyed by ``(user_id, product_id)``.
+
+    Entries are the same dicts that were kept in the ``pending`` list and
+    iterate in submission order, but lookups and removals by key are O(1).
+    Further proofs for a purchase that is already pending are merged into
+    its entry: ``file_id`` keeps the first proof and ``file_ids`` lists
+    all of them.
+    """
+
+    __slots__ = ("_entries",)
+
+    def __init__(self, entries: Iterable[Dict[str, Any]] = ()):
+        self._entries: Dict[PendingKey, Dict[str, Any]] = {}
+        for entry in entries:
+            self._merge(dict(entry))
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PendingQueue):
+            return list(self) == list(other)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"PendingQueue({list(self)!r})"
+
+    def _merge(self, entry: Dict[str, Any]) -> bool:
+        key = (entry["user_id"], entry["product_id"])
+        current = self._entries.get(key)
+        if current is None:
+            self._entries[key] = entry
+            return True
+        file_ids = current.setdefault("file_ids", [current.get("file_id")])
+        for file_id in entry.get("file_ids", [entry.get("file_id")]):
+            if file_id not in file_ids:
+                file_ids.append(file_id)
+        return False
+
+    def add(self, user_id: int, product_id: str, file_id: Optional[str]) -> bool:
+        """Record a payment proof; return False if it joined an existing entry."""
+        return self._merge({"user_id": user_id, "product_id": product_id, "file_id": file_id})
+
+    def put(self, entry: Dict[str, Any]) -> None:
+        """Store *entry* as is, replacing the entry of the same purchase."""
+        self._entries[(entry["user_id"], entry["product_id"])] = entry
+
+    def get(self, user_id: int, product_id: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get((user_id, product_id))
+
+    def at(self, position: int) -> Optional[Dict[str, Any]]:
+        """Return the entry at *position* in submission order, or ``None``."""
+        if position < 0:
+            return None
+        return next(islice(self._entries.values(), position, None), None)
+
+    def pop(self, user_id: int, product_id: str) -> Optional[Dict[str, Any]]:
+        """Remove and return the entry for the purchase, or ``None``."""
+        return self._entries.pop((user_id, product_id), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+def pending_of(data: Dict[str, Any]) -> PendingQueue:
+    """Return the :class:`PendingQueue` of *data*, upgrading a plain list."""
+    pending = data.get("pending")
+    if not isinstance(pending, PendingQueue):
+        pending = PendingQueue(pending or ())
+        data["pending"] = pending
+    return pending
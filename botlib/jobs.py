@@ -0,0 +1,63 @@
+"""Named background jobs running in the bot's event loop."""
+import asyncio
+import logging
+from typing import Any, Coroutine, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobRegistry:
+    """Run at most one background task per key.
+
+    Tasks are created in the running loop when started, so nothing here is
+    tied to a particular event loop between jobs. Finished tasks remove
+    themselves; exceptions are logged instead of being lost.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def __contains__(self, key: object) -> bool:
+        task = self._tasks.get(key)  # type: ignore[arg-type]
+        return task is not None and not task.done()
+
+    def __len__(self) -> int:
+        return sum(1 for task in self._tasks.values() if not task.done())
+
+    def start(self, key: str, coro: Coroutine[Any, Any, Any]) -> Optional[asyncio.Task]:
+        """Run *coro* as the job *key*; return ``None`` if it already runs."""
+        if key in self:
+            coro.close()
+            return None
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return task
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Job %s failed", key, exc_info=task.exception())
+
+    async def cancel(self, key: str) -> bool:
+        """Cancel the job *key* and wait for it; return False if none ran."""
+        task = self._tasks.get(key)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def join(self, key: str) -> None:
+        """Wait until the job *key*, if any, has finished."""
+        task = self._tasks.get(key)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def cancel_all(self) -> None:
+        """Cancel every running job, e.g. on shutdown."""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
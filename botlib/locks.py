@@ -0,0 +1,98 @@
+"""Keyed locks and concurrent update processing serialized per user."""
+import asyncio
+import sys
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Hashable, List
+
+from telegram.ext import BaseUpdateProcessor
+
+# Updates processed at once when concurrent processing is enabled
+DEFAULT_CONCURRENT_UPDATES = 64
+
+# Limit handed to BaseUpdateProcessor, whose semaphore is taken before
+# do_process_update; the real limit is applied after the user lock
+UNLIMITED = sys.maxsize
+
+
+class LockManager:
+    """Hand out one :class:`asyncio.Lock` per key, created on demand.
+
+    Keys are tuples naming a resource, e.g. ``('product', pid)`` or
+    ``('pending', user_id, pid)``. A lock is forgotten as soon as nobody
+    holds or waits for it, so the table only grows with the number of
+    resources in use at the same time.
+    """
+
+    def __init__(self):
+        # key -> [lock, holders and waiters]
+        self._locks: Dict[Hashable, List[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    @asynccontextmanager
+    async def hold(self, *keys: Hashable) -> AsyncIterator[None]:
+        """Hold the locks of every key in *keys* for the ``async with`` body.
+
+        Keys are acquired in a fixed order, so callers holding several
+        locks at once cannot deadlock each other.
+        """
+        ordered = sorted(set(keys), key=repr)
+        entries = []
+        for key in ordered:
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            entries.append((key, entry))
+        acquired = []
+        try:
+            for _, entry in entries:
+                await entry[0].acquire()
+                acquired.append(entry[0])
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+
+class UserSerializer(BaseUpdateProcessor):
+    """Process updates concurrently, those of one user one at a time.
+
+    Handlers keep conversational state in ``context.user_data``; running
+    a user's updates in arrival order keeps that state consistent while
+    other users' updates proceed in parallel. Updates without a user are
+    not serialized.
+
+    At most ``max_concurrent_updates`` updates run at once. A slot is only
+    taken once the update holds its user's lock, so updates queued behind
+    one busy user never keep other users' updates waiting.
+    """
+
+    def __init__(self, locks: LockManager, max_concurrent_updates: int = DEFAULT_CONCURRENT_UPDATES):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(UNLIMITED)
+        self.locks = locks
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            async with self._slots:
+                await coroutine
+            return
+        async with self.locks.hold(('user', user.id)), self._slots:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
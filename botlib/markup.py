@@ -0,0 +1,85 @@
+"""Memoized inline keyboards shared between users."""
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Set, Tuple
+
+from telegram import InlineKeyboardMarkup
+
+# Keyboards kept; menus need a handful per language, products one per field set
+DEFAULT_CACHE_SIZE = 1024
+
+Builder = Callable[..., InlineKeyboardMarkup]
+
+
+class MarkupCache:
+    """Build each keyboard once per set of arguments.
+
+    Markups are immutable, so the same object is safely sent to every user
+    asking for the same menu. Functions decorated with :meth:`memoize` must
+    depend only on their (hashable) arguments; those decorated with
+    :meth:`memoize_product` take a product id first and are dropped by
+    :meth:`invalidate` when that product changes. The least recently used
+    entries are evicted beyond ``cache_size``.
+    """
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple[Hashable, ...], InlineKeyboardMarkup]" = OrderedDict()
+        self._by_product: Dict[Any, Set[Tuple[Hashable, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def memoize(self, func: Builder) -> Builder:
+        """Cache the markups returned by *func* per argument tuple."""
+        return self._wrap(func, product=False)
+
+    def memoize_product(self, func: Builder) -> Builder:
+        """Like :meth:`memoize` for *func(pid, ...)* depending on a product."""
+        return self._wrap(func, product=True)
+
+    def _wrap(self, func: Builder, product: bool) -> Builder:
+        name = func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args: Hashable) -> InlineKeyboardMarkup:
+            key = (name, *args)
+            markup = self._cache.get(key)
+            if markup is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return markup
+            self.misses += 1
+            markup = func(*args)
+            self._cache[key] = markup
+            if product:
+                self._by_product.setdefault(args[0], set()).add(key)
+            if len(self._cache) > self.cache_size:
+                self._forget(next(iter(self._cache)))
+            return markup
+
+        return wrapper
+
+    def _forget(self, key: Tuple[Hashable, ...]) -> None:
+        del self._cache[key]
+        # Product keys are (name, pid, ...)
+        keys = self._by_product.get(key[1]) if len(key) > 1 else None
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_product[key[1]]
+
+    def invalidate(self, pid: Any = None) -> None:
+        """Forget the keyboards of *pid*, or every keyboard."""
+        if pid is None:
+            self._cache.clear()
+            self._by_product.clear()
+            return
+        for key in self._by_product.pop(pid, ()):
+            self._cache.pop(key, None)
@@ -0,0 +1,33 @@
+"""Deliveries owed to buyers, kept in the data until they succeed."""
+from typing import Any, Dict
+
+# Event recorded when a purchase is approved
+CREDENTIALS = "credentials"
+
+
+def outbox_key(user_id: int, product_id: str, event: str) -> str:
+    """Return the key of a delivery; one entry is kept per key."""
+    return f"{user_id}:{product_id}:{event}"
+
+
+def outbox_of(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the ``outbox`` dict of *data*, adding an empty one if missing."""
+    return data.setdefault("outbox", {})
+
+
+def owe(data: Dict[str, Any], user_id: int, product_id: str, event: str, lang: str) -> str:
+    """Record a delivery owed to *user_id* and return its key.
+
+    Recording the same ``(user_id, product_id, event)`` again replaces the
+    entry, so a retried approval never queues a second delivery. The caller
+    touches ``("outbox", key)`` and saves it together with the change that
+    made the delivery due.
+    """
+    key = outbox_key(user_id, product_id, event)
+    outbox_of(data)[key] = {
+        "user_id": user_id,
+        "product_id": product_id,
+        "event": event,
+        "lang": lang,
+    }
+    return key
@@ -0,0 +1,110 @@
+"""Paginated, searchable product pickers for the admin menu."""
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .catalog import page_count
+from .translations import tr
+
+# Products listed on one picker page
+DEFAULT_PAGE_SIZE = 8
+
+# Telegram allows 64 bytes of callback data, which holds the search prefix
+MAX_CALLBACK_DATA = 64
+
+# Picker action -> (callback prefix of the chosen product, prompt key)
+PICKER_ACTIONS: Dict[str, Tuple[str, str]] = {
+    'edit': ('editprod', 'select_product_edit'),
+    'delete': ('delprod', 'select_product_delete'),
+    'stats': ('adminstats', 'select_product_stats'),
+    'buyers': ('buyerlist', 'select_product_buyers'),
+    'clearbuyers': ('adminclearbuyers', 'select_product_clearbuyers'),
+    'resend': ('adminresend', 'select_product_buyers'),
+}
+
+
+def _fit_bytes(text: str, limit: int) -> str:
+    """Return the longest start of *text* whose UTF-8 encoding fits *limit* bytes."""
+    return text.encode()[:max(limit, 0)].decode('utf-8', 'ignore')
+
+
+class ProductIndex:
+    """Product ids kept sorted for paging and prefix search.
+
+    The sorted list is rebuilt only after :meth:`invalidate` or when a
+    different products dict is passed in; a page is then a bisect and a
+    slice, independent of the catalog size.
+    """
+
+    def __init__(self):
+        self._products: Any = None
+        self._ids: List[str] = []
+        self._stale = True
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def ids(self, products: Dict[str, Any]) -> List[str]:
+        """Return the sorted ids of *products*, rebuilding them if stale."""
+        if self._stale or products is not self._products:
+            self._products = products
+            self._ids = sorted(products)
+            self._stale = False
+        return self._ids
+
+    def span(self, products: Dict[str, Any], prefix: str = '') -> Tuple[int, int]:
+        """Return the ``[start, end)`` range of ids starting with *prefix*."""
+        ids = self.ids(products)
+        if not prefix:
+            return 0, len(ids)
+        start = bisect_left(ids, prefix)
+        end = bisect_left(ids, prefix + '\U0010ffff', start)
+        return start, end
+
+
+def render_picker(
+    index: ProductIndex,
+    products: Dict[str, Any],
+    action: str,
+    lang: str,
+    page: int = 0,
+    prefix: str = '',
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """Return ``(text, markup)`` for one picker page, or ``None`` if empty.
+
+    Rows hold one product each, followed by previous/next buttons
+    (``pick:<action>:<page>:<prefix>``), a search button
+    (``picksearch:<action>``) and the back button as the last row.
+    """
+    target, prompt = PICKER_ACTIONS[action]
+    # There are never more pages than products
+    prefix = _fit_bytes(prefix, MAX_CALLBACK_DATA - len(f'pick:{action}:{len(products)}:'))
+    start, end = index.span(products, prefix)
+    if start == end:
+        return None
+    pages = page_count(end - start, page_size)
+    page = min(max(page, 0), pages - 1)
+    first = start + page * page_size
+    ids = index.ids(products)[first:min(first + page_size, end)]
+    keyboard = [[InlineKeyboardButton(pid, callback_data=f'{target}:{pid}')] for pid in ids]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(
+            tr('page_prev', lang), callback_data=f'pick:{action}:{page - 1}:{prefix}'
+        ))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(
+            tr('page_next', lang), callback_data=f'pick:{action}:{page + 1}:{prefix}'
+        ))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton(tr('search_button', lang), callback_data=f'picksearch:{action}')])
+    keyboard.append([InlineKeyboardButton(tr('menu_back', lang), callback_data='adminmenu:manage')])
+    text = tr(prompt, lang)
+    if prefix:
+        text += '\n' + tr('search_prefix', lang).format(prefix=prefix)
+    if pages > 1:
+        text += '\n' + tr('catalog_page', lang).format(page=page + 1, pages=pages)
+    return text, InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,290 @@
+"""Per-user preferences stored apart from the product catalog."""
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before writing preference changes
+DEFAULT_PREFS_DELAY = 1.0
+
+# New users are merged into the sorted arrays once the overlay holds this
+# many entries or an eighth of the map, whichever is larger
+MIN_OVERLAY = 1024
+
+
+def _le_bytes(values: array) -> bytes:
+    """Return the items of *values* as little-endian bytes."""
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le_bytes(typecode: str, raw: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+
+class LanguageMap:
+    """Language code per integer user id, about 9 bytes per user.
+
+    Ids live in a sorted ``array('q')`` with a parallel ``array('B')`` of
+    indexes into a small table of language codes. Lookups bisect the ids,
+    so no string key is built per call. Changing a known user rewrites a
+    single byte; new users go to a dict overlay that is merged into the
+    arrays once it grows past :data:`MIN_OVERLAY` or an eighth of the map.
+    """
+
+    __slots__ = ("codes", "_code_index", "_ids", "_langs", "_overlay")
+
+    def __init__(self, items: Optional[Mapping[int, str]] = None):
+        self.codes: List[str] = []
+        self._code_index: Dict[str, int] = {}
+        self._ids = array("q")
+        self._langs = array("B")
+        self._overlay: Dict[int, int] = {}
+        if items:
+            pairs = sorted(items.items())
+            self._ids = array("q", [uid for uid, _ in pairs])
+            self._langs = array("B", [self._code(lang) for _, lang in pairs])
+
+    def _code(self, lang: str) -> int:
+        index = self._code_index.get(lang)
+        if index is None:
+            if len(self.codes) > 255:
+                raise ValueError("Too many distinct language codes")
+            index = self._code_index[lang] = len(self.codes)
+            self.codes.append(lang)
+        return index
+
+    def _find(self, uid: int) -> int:
+        """Return the array position of *uid*, or -1."""
+        i = bisect_left(self._ids, uid)
+        if i < len(self._ids) and self._ids[i] == uid:
+            return i
+        return -1
+
+    def get(self, uid: int, default: Optional[str] = None) -> Optional[str]:
+        index = self._overlay.get(uid)
+        if index is None:
+            i = self._find(uid)
+            if i < 0:
+                return default
+            index = self._langs[i]
+        return self.codes[index]
+
+    def __contains__(self, uid: object) -> bool:
+        if not isinstance(uid, int):
+            return False
+        return uid in self._overlay or self._find(uid) >= 0
+
+    def __setitem__(self, uid: int, lang: str) -> None:
+        index = self._code(lang)
+        i = self._find(uid)
+        if i >= 0:
+            self._langs[i] = index
+            return
+        self._overlay[uid] = index
+        if len(self._overlay) >= max(MIN_OVERLAY, len(self._ids) // 8):
+            self.compact()
+
+    def setdefault(self, uid: int, lang: str) -> str:
+        current = self.get(uid)
+        if current is None:
+            self[uid] = lang
+            return lang
+        return current
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._overlay)
+
+    def items(self) -> Iterator[Tuple[int, str]]:
+        """Yield ``(user_id, lang)`` pairs in id order."""
+        self.compact()
+        codes = self.codes
+        for uid, index in zip(self._ids, self._langs):
+            yield uid, codes[index]
+
+    def clear(self) -> None:
+        self._ids = array("q")
+        self._langs = array("B")
+        self._overlay.clear()
+
+    def compact(self) -> None:
+        """Merge the overlay of new users into the sorted arrays."""
+        if not self._overlay:
+            return
+        ids = array("q")
+        langs = array("B")
+        start = 0
+        for uid in sorted(self._overlay):
+            end = bisect_left(self._ids, uid, start)
+            ids += self._ids[start:end]
+            langs += self._langs[start:end]
+            ids.append(uid)
+            langs.append(self._overlay[uid])
+            start = end
+        ids += self._ids[start:]
+        langs += self._langs[start:]
+        self._ids, self._langs = ids, langs
+        self._overlay.clear()
+
+    def dump(self) -> Dict[str, Any]:
+        """Return a snapshot with the arrays as little-endian bytes.
+
+        Copying the two arrays is a memcpy, cheap enough for the event loop;
+        encoding and writing the snapshot is left to the caller's thread.
+        """
+        self.compact()
+        return {
+            "codes": list(self.codes),
+            "ids": _le_bytes(self._ids),
+            "langs": self._langs.tobytes(),
+        }
+
+    @classmethod
+    def load(cls, stored: Mapping[str, Any]) -> "LanguageMap":
+        """Rebuild a map from a decoded :meth:`dump` snapshot."""
+        result = cls()
+        for code in stored["codes"]:
+            result._code(code)
+        result._ids = _from_le_bytes("q", stored["ids"])
+        result._langs = _from_le_bytes("B", stored["langs"])
+        if len(result._ids) != len(result._langs):
+            raise ValueError("Language map arrays differ in length")
+        return result
+
+
+class PreferenceStore:
+    """Language preferences in a small plain JSON file.
+
+    Preferences hold nothing sensitive, so they are neither encrypted nor
+    part of the catalog: changing a language never rewrites products or
+    runs Fernet. Changes are coalesced and written ``delay`` seconds after
+    the first one, or immediately when ``delay`` is 0.
+
+    The file holds the :class:`LanguageMap` arrays base64 encoded::
+
+        {"codes": ["en", "fa"], "ids": "<int64 LE>", "langs": "<uint8>"}
+
+    Files in the earlier ``{"languages": {"<uid>": "<lang>"}}`` layout are
+    still read.
+    """
+
+    def __init__(self, path: Path, delay: float = DEFAULT_PREFS_DELAY):
+        self.path = path
+        self.delay = delay
+        self.languages = LanguageMap()
+        self.flushes = 0
+        self._dirty = False
+        self._timer: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefs")
+
+    def get_lang(self, user_id: int, default: str = 'en') -> str:
+        """Return the language chosen by *user_id*, or *default*."""
+        lang = self.languages.get(user_id)
+        return default if lang is None else lang
+
+    async def set_lang(self, user_id: int, lang: str) -> None:
+        """Remember *lang* for *user_id* and schedule a flush."""
+        self.languages[user_id] = lang
+        await self._changed()
+
+    async def update(self, languages: Mapping[str, str]) -> None:
+        """Merge *languages* without overriding choices already stored."""
+        for uid, lang in languages.items():
+            self.languages.setdefault(int(uid), lang)
+        await self._changed()
+
+    def clear(self) -> None:
+        """Forget every preference; written out with the next flush."""
+        self.languages.clear()
+        self._dirty = True
+
+    async def _changed(self) -> None:
+        self._dirty = True
+        if self.delay <= 0:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.delay)
+        # Changes arriving during the flush schedule the next one
+        self._timer = None
+        await self.flush()
+
+    def _read(self) -> LanguageMap:
+        try:
+            with open(self.path, "r") as fh:
+                stored = json.load(fh)
+            if "languages" in stored:
+                return LanguageMap({int(uid): lang for uid, lang in stored["languages"].items()})
+            stored["ids"] = base64.b64decode(stored["ids"])
+            stored["langs"] = base64.b64decode(stored["langs"])
+            return LanguageMap.load(stored)
+        except FileNotFoundError:
+            return LanguageMap()
+        except (OSError, ValueError, KeyError) as exc:
+            logger.error("Failed to load %s: %s", self.path, exc)
+            return LanguageMap()
+
+    def _write(self, snapshot: Dict[str, Any]) -> None:
+        encoded = {
+            "codes": snapshot["codes"],
+            "ids": base64.b64encode(snapshot["ids"]).decode(),
+            "langs": base64.b64encode(snapshot["langs"]).decode(),
+        }
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            with open(tmp, "w") as fh:
+                json.dump(encoded, fh)
+            os.replace(tmp, self.path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    async def load(self) -> None:
+        """Read the preferences file, starting empty if it is missing."""
+        loop = asyncio.get_running_loop()
+        self.languages = await loop.run_in_executor(self._executor, self._read)
+        self._dirty = False
+
+    async def flush(self) -> bool:
+        """Write pending changes now and return whether nothing is left
+        pending.
+        """
+        if not self._dirty:
+            return True
+        self._dirty = False
+        snapshot = self.languages.dump()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, snapshot)
+            self.flushes += 1
+        except OSError as exc:
+            logger.error("Failed to save %s: %s", self.path, exc)
+            # Keep the changes pending so the next flush retries them
+            self._dirty = True
+            return False
+        return True
+
+    async def close(self) -> None:
+        """Flush pending changes and stop the worker thread."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
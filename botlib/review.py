@@ -0,0 +1,60 @@
+"""Single-message review of pending purchases for the admin."""
+from typing import Any, Dict, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .indexes import PendingQueue
+from .translations import tr
+
+
+def render_review(
+    queue: PendingQueue,
+    lang: str,
+    position: int = 0,
+    status: str = '',
+) -> Optional[Tuple[Dict[str, Any], str, InlineKeyboardMarkup]]:
+    """Return ``(entry, caption, markup)`` for one pending purchase.
+
+    *position* is clamped to the queue, so after a decision the entry that
+    took the decided one's place is shown. *status*, such as the outcome of
+    that decision, heads the caption. ``None`` is returned when the queue
+    is empty.
+
+    Buttons carry the position they were shown at:
+    ``review:approve|reject:<user_id>:<product_id>:<position>`` and
+    ``review:page:<position>`` for previous/next.
+    """
+    total = len(queue)
+    if not total:
+        return None
+    position = min(max(position, 0), total - 1)
+    entry = queue.at(position)
+    user_id, pid = entry['user_id'], entry['product_id']
+    lines = [status] if status else []
+    lines.append(tr('pending_entry', lang).format(user_id=user_id, product_id=pid))
+    proofs = len(entry.get('file_ids', ()))
+    if proofs > 1:
+        lines.append(tr('review_proofs', lang).format(count=proofs))
+    lines.append(tr('review_position', lang).format(index=position + 1, total=total))
+    keyboard = [[
+        InlineKeyboardButton(
+            tr('approve_button', lang),
+            callback_data=f'review:approve:{user_id}:{pid}:{position}',
+        ),
+        InlineKeyboardButton(
+            tr('reject_button', lang),
+            callback_data=f'review:reject:{user_id}:{pid}:{position}',
+        ),
+    ]]
+    nav = []
+    if position > 0:
+        nav.append(InlineKeyboardButton(
+            tr('page_prev', lang), callback_data=f'review:page:{position - 1}'
+        ))
+    if position < total - 1:
+        nav.append(InlineKeyboardButton(
+            tr('page_next', lang), callback_data=f'review:page:{position + 1}'
+        ))
+    if nav:
+        keyboard.append(nav)
+    return entry, '\n'.join(lines), InlineKeyboardMarkup(keyboard)
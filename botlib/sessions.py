@@ -0,0 +1,88 @@
+"""Eviction of idle per-user ``user_data`` entries."""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Defaults for SESSION_MAX_USERS and SESSION_TTL
+DEFAULT_MAX_USERS = 10000
+DEFAULT_TTL = 3600.0
+
+
+class SessionEvictor:
+    """Drop ``user_data`` of users idle past ``ttl`` or beyond ``max_users``.
+
+    :meth:`touch` is called for every update, through :meth:`handler`
+    registered ahead of the other handlers. Users are kept in LRU order;
+    each touch drops those not seen for ``ttl`` seconds and, if more than
+    ``max_users`` remain, the least recently seen ones. Whatever a handler
+    needs again, such as ``lang``, is rebuilt from storage on the next
+    interaction. A value of 0 disables the corresponding limit.
+
+    Users whose ``user_data`` satisfies *keep*, e.g. because they are in
+    the middle of a conversation whose state lives elsewhere, are skipped
+    and stay in their place in the LRU order.
+    """
+
+    def __init__(
+        self,
+        max_users: int = DEFAULT_MAX_USERS,
+        ttl: float = DEFAULT_TTL,
+        clock: Callable[[], float] = time.monotonic,
+        keep: Optional[Callable[[Mapping[str, Any]], bool]] = None,
+    ):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.keep = keep
+        self.evicted = 0
+        self._clock = clock
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    @property
+    def resident(self) -> int:
+        """Number of users whose ``user_data`` is being tracked."""
+        return len(self._seen)
+
+    def stats(self) -> Dict[str, int]:
+        return {"resident": self.resident, "evicted": self.evicted}
+
+    def touch(self, application: Any, user_id: Optional[int]) -> None:
+        """Record activity of *user_id* and evict stale entries."""
+        now = self._clock()
+        if user_id is not None:
+            self._seen[user_id] = now
+            self._seen.move_to_end(user_id)
+        self.evict(application, now)
+
+    def evict(self, application: Any, now: Optional[float] = None) -> int:
+        """Drop expired and surplus entries; return how many were dropped."""
+        if now is None:
+            now = self._clock()
+        dropped = 0
+        kept = []
+        while self._seen:
+            user_id, last_seen = next(iter(self._seen.items()))
+            expired = self.ttl > 0 and now - last_seen > self.ttl
+            surplus = self.max_users > 0 and len(self._seen) + len(kept) > self.max_users
+            if not (expired or surplus):
+                break
+            self._seen.popitem(last=False)
+            if self.keep is not None and self.keep(application.user_data.get(user_id, {})):
+                kept.append((user_id, last_seen))
+                continue
+            application.drop_user_data(user_id)
+            dropped += 1
+        for user_id, last_seen in reversed(kept):
+            self._seen[user_id] = last_seen
+            self._seen.move_to_end(user_id, last=False)
+        if dropped:
+            self.evicted += dropped
+            logger.debug("Evicted user_data of %d users, %d resident", dropped, self.resident)
+        return dropped
+
+    async def handler(self, update: Any, context: Any) -> None:
+        """Update callback recording the sender before other handlers run."""
+        user = getattr(update, "effective_user", None)
+        self.touch(context.application, user.id if user else None)
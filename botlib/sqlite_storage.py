@@ -0,0 +1,400 @@
+"""SQLite storage backend with the same interface as :class:`JSONStorage`."""
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .indexes import BuyerSet, PendingQueue, pending_of
+from .storage import DEFAULT_DATA, SENSITIVE_FIELDS, FieldCipher, JSONStorage, KeyPath, _lookup
+
+logger = logging.getLogger(__name__)
+
+# Product fields with their own column; anything else goes to ``extra``
+PRODUCT_COLUMNS = ("price", "name") + SENSITIVE_FIELDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    pid TEXT PRIMARY KEY,
+    price TEXT,
+    name TEXT,
+    username TEXT,
+    password TEXT,
+    secret TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS buyers (
+    pid TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    UNIQUE (pid, user_id)
+);
+CREATE INDEX IF NOT EXISTS buyers_user ON buyers (user_id);
+CREATE TABLE IF NOT EXISTS pending (
+    user_id INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    file_id TEXT
+);
+CREATE INDEX IF NOT EXISTS pending_key ON pending (user_id, product_id);
+CREATE TABLE IF NOT EXISTS languages (
+    user_id INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    lang TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS resends (
+    pid TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+"""
+
+UPSERT_PRODUCT = (
+    "INSERT OR REPLACE INTO products (pid, price, name, username, password, secret, extra)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_BUYER = "INSERT OR IGNORE INTO buyers (pid, user_id) VALUES (?, ?)"
+DELETE_BUYER = "DELETE FROM buyers WHERE pid = ? AND user_id = ?"
+# Adds the proofs of a pending purchase that are not stored yet, keeping
+# the rowid, and so the queue position, of the ones that are
+INSERT_PROOF = (
+    "INSERT INTO pending (user_id, product_id, file_id) SELECT ?, ?, ?"
+    " WHERE NOT EXISTS (SELECT 1 FROM pending"
+    " WHERE user_id = ? AND product_id = ? AND file_id IS ?)"
+)
+DELETE_PENDING = "DELETE FROM pending WHERE user_id = ? AND product_id = ?"
+UPSERT_LANGUAGE = "INSERT OR REPLACE INTO languages (user_id, lang) VALUES (?, ?)"
+UPSERT_OUTBOX = (
+    "INSERT OR REPLACE INTO outbox (key, user_id, product_id, event, lang, attempts)"
+    " VALUES (?, ?, ?, ?, ?, ?)"
+)
+UPSERT_RESEND = "INSERT OR REPLACE INTO resends (pid, state) VALUES (?, ?)"
+SELECT_PRODUCT = "SELECT pid, price, name, username, password, secret, extra FROM products"
+
+Statement = Tuple[str, Any]
+
+
+def _outbox_row(key: str, entry: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        key, entry["user_id"], entry["product_id"], entry["event"], entry.get("lang"),
+        entry.get("attempts", 0),
+    )
+
+
+class SQLiteStorage:
+    """SQLite storage in WAL mode, run on a dedicated worker thread.
+
+    :meth:`load` and :meth:`save` mirror :class:`JSONStorage`. A save only
+    rewrites the rows behind the paths marked with :meth:`touch`; a single
+    buyer or pending purchase is inserted or deleted on its own.
+    """
+
+    def __init__(self, path: Path, key: bytes):
+        self.path = path
+        self.lock = asyncio.Lock()
+        self.cipher = FieldCipher(key)
+        # Ordered so single buyers and purchases are written as touched
+        self._touched: Dict[KeyPath, None] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        # A single thread owns the connection
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def touch(self, *path: str) -> None:
+        """Mark the nested key *path* as changed for the next :meth:`save`."""
+        self._touched[tuple(path)] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            # Databases created before delivery attempts were counted
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connect()))
+
+    def _product_row(self, pid: str, product: Dict[str, Any]) -> Tuple[Any, ...]:
+        extra = {k: v for k, v in product.items() if k not in PRODUCT_COLUMNS and k != "buyers"}
+        values = [product.get(col) for col in PRODUCT_COLUMNS]
+        return (pid, *values, json.dumps(extra) if extra else None)
+
+    def _product_statements(self, pid: str, product: Any, buyers: bool = True) -> List[Statement]:
+        """Return statements that replace (or delete) one product row."""
+        if product is None:
+            return [
+                ("DELETE FROM products WHERE pid = ?", [(pid,)]),
+                ("DELETE FROM buyers WHERE pid = ?", [(pid,)]),
+            ]
+        stmts: List[Statement] = [(UPSERT_PRODUCT, [self._product_row(pid, product)])]
+        if buyers:
+            stmts += self._buyer_statements(pid, product.get("buyers", []))
+        return stmts
+
+    def _buyer_statements(self, pid: str, buyers: Any) -> List[Statement]:
+        return [
+            ("DELETE FROM buyers WHERE pid = ?", [(pid,)]),
+            (INSERT_BUYER, [(pid, uid) for uid in buyers]),
+        ]
+
+    def _pending_statements(self, pending: Any) -> List[Statement]:
+        # Merged proofs are stored one row each and merged again on load
+        rows = [
+            (p["user_id"], p["product_id"], file_id)
+            for p in pending or []
+            for file_id in p.get("file_ids", [p.get("file_id")])
+        ]
+        return [
+            ("DELETE FROM pending", [()]),
+            ("INSERT INTO pending (user_id, product_id, file_id) VALUES (?, ?, ?)", rows),
+        ]
+
+    def _proof_statements(self, data: Dict[str, Any], user_id: int, product_id: str) -> List[Statement]:
+        """Return statements storing or deleting one pending purchase."""
+        entry = pending_of(data).get(user_id, product_id)
+        if entry is None:
+            return [(DELETE_PENDING, [(user_id, product_id)])]
+        rows = [
+            (user_id, product_id, file_id) * 2
+            for file_id in entry.get("file_ids", [entry.get("file_id")])
+        ]
+        return [(INSERT_PROOF, rows)]
+
+    def _language_statements(self, languages: Any) -> List[Statement]:
+        rows = [(int(uid), lang) for uid, lang in (languages or {}).items()]
+        return [
+            ("DELETE FROM languages", [()]),
+            ("INSERT INTO languages (user_id, lang) VALUES (?, ?)", rows),
+        ]
+
+    def _outbox_statements(self, outbox: Any) -> List[Statement]:
+        return [
+            ("DELETE FROM outbox", [()]),
+            (UPSERT_OUTBOX, [_outbox_row(key, entry) for key, entry in (outbox or {}).items()]),
+        ]
+
+    def _resend_statements(self, resends: Any) -> List[Statement]:
+        return [
+            ("DELETE FROM resends", [()]),
+            (UPSERT_RESEND, [(pid, json.dumps(state)) for pid, state in (resends or {}).items()]),
+        ]
+
+    def _full_statements(self, data: Dict[str, Any]) -> List[Statement]:
+        products = data.get("products", {})
+        stmts: List[Statement] = [
+            ("DELETE FROM products", [()]),
+            ("DELETE FROM buyers", [()]),
+            (UPSERT_PRODUCT, [self._product_row(pid, p) for pid, p in products.items()]),
+            (INSERT_BUYER, [(pid, uid) for pid, p in products.items() for uid in p.get("buyers", [])]),
+        ]
+        stmts += self._pending_statements(data.get("pending"))
+        stmts += self._language_statements(data.get("languages"))
+        stmts += self._outbox_statements(data.get("outbox"))
+        stmts += self._resend_statements(data.get("resends"))
+        return stmts
+
+    def _path_statements(self, data: Dict[str, Any], path: KeyPath) -> Optional[List[Statement]]:
+        """Return statements persisting *path*, or ``None`` if unsupported."""
+        found, value = _lookup(data, path)
+        head = path[0]
+        if head == "languages" and len(path) == 2:
+            if not found:
+                return [("DELETE FROM languages WHERE user_id = ?", [(int(path[1]),)])]
+            return [(UPSERT_LANGUAGE, [(int(path[1]), value)])]
+        if head == "languages" and len(path) == 1:
+            return self._language_statements(value)
+        if head == "pending" and len(path) == 1:
+            return self._pending_statements(value)
+        if head == "pending" and len(path) == 3:
+            return self._proof_statements(data, path[1], path[2])
+        if head == "outbox" and len(path) == 2:
+            if not found:
+                return [("DELETE FROM outbox WHERE key = ?", [(path[1],)])]
+            return [(UPSERT_OUTBOX, [_outbox_row(path[1], value)])]
+        if head == "outbox" and len(path) == 1:
+            return self._outbox_statements(value)
+        if head == "resends" and len(path) == 2:
+            if not found:
+                return [("DELETE FROM resends WHERE pid = ?", [(path[1],)])]
+            return [(UPSERT_RESEND, [(path[1], json.dumps(value))])]
+        if head == "resends" and len(path) == 1:
+            return self._resend_statements(value)
+        if head == "products" and len(path) == 2:
+            return self._product_statements(path[1], value if found else None)
+        if head == "products" and len(path) == 3:
+            found, product = _lookup(data, path[:2])
+            if not found:
+                return self._product_statements(path[1], None)
+            if path[2] == "buyers":
+                stmts = self._product_statements(path[1], product, buyers=False)
+                return stmts + self._buyer_statements(path[1], product.get("buyers", []))
+            return self._product_statements(path[1], product, buyers=False)
+        if head == "products" and len(path) == 4 and path[2] == "buyers":
+            found, product = _lookup(data, path[:2])
+            if not found:
+                return self._product_statements(path[1], None)
+            stmt = INSERT_BUYER if path[3] in product.get("buyers", ()) else DELETE_BUYER
+            return [(stmt, [(path[1], path[3])])]
+        return None
+
+    def _execute(self, conn: sqlite3.Connection, stmts: List[Statement]) -> None:
+        with conn:
+            for sql, rows in stmts:
+                if sql is UPSERT_PRODUCT:
+                    # Encrypt here so Fernet work stays off the event loop
+                    rows = [self._encrypt_row(row) for row in rows]
+                conn.executemany(sql, rows)
+
+    def _encrypt_row(self, row: Tuple[Any, ...]) -> Tuple[Any, ...]:
+        # Columns 3..5 hold username, password and secret
+        pid = row[0]
+        encrypted = tuple(
+            self.cipher.encrypt(pid, field, value)
+            for field, value in zip(SENSITIVE_FIELDS, row[3:6])
+        )
+        return row[:3] + encrypted + row[6:]
+
+    def _read_all(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        data = copy.deepcopy(DEFAULT_DATA)
+        products = data["products"]
+        for row in conn.execute(SELECT_PRODUCT):
+            products[row[0]] = self._row_to_product(row)
+        for pid, uid in conn.execute("SELECT pid, user_id FROM buyers ORDER BY rowid"):
+            if pid in products:
+                products[pid]["buyers"].append(uid)
+        pending = data["pending"] = PendingQueue()
+        for uid, pid, file_id in conn.execute(
+            "SELECT user_id, product_id, file_id FROM pending ORDER BY rowid"
+        ):
+            pending.add(uid, pid, file_id)
+        # Language preferences now live in their own store; rows are only
+        # left over from before the split and are migrated by the bot
+        languages = {
+            str(uid): lang for uid, lang in conn.execute("SELECT user_id, lang FROM languages")
+        }
+        if languages:
+            data["languages"] = languages
+        outbox = {}
+        for key, uid, pid, event, lang, attempts in conn.execute(
+            "SELECT key, user_id, product_id, event, lang, attempts FROM outbox ORDER BY rowid"
+        ):
+            entry = outbox[key] = {"user_id": uid, "product_id": pid, "event": event, "lang": lang}
+            if attempts:
+                entry["attempts"] = attempts
+        if outbox:
+            data["outbox"] = outbox
+        resends = {
+            pid: json.loads(state)
+            for pid, state in conn.execute("SELECT pid, state FROM resends")
+        }
+        if resends:
+            data["resends"] = resends
+        return data
+
+    def _row_to_product(self, row: Tuple[Any, ...]) -> Dict[str, Any]:
+        product: Dict[str, Any] = {}
+        for col, value in zip(PRODUCT_COLUMNS, row[1:6]):
+            if value is not None:
+                product[col] = value
+        if row[6]:
+            product.update(json.loads(row[6]))
+        product["buyers"] = BuyerSet()
+        return self.cipher.seal_product(product)
+
+    async def load(self) -> Dict[str, Any]:
+        """Load every table into the dict layout used by :class:`JSONStorage`."""
+        async with self.lock:
+            try:
+                return await self._run(self._read_all)
+            except sqlite3.Error as exc:
+                logger.error("Failed to load %s: %s", self.path, exc)
+                return copy.deepcopy(DEFAULT_DATA)
+
+    async def save(self, data: Dict[str, Any], wait: bool = True) -> bool:
+        """Persist the rows behind the touched paths, or everything if none,
+        and return whether the transaction committed.
+
+        The transaction has finished when this returns; *wait* is accepted
+        for interface compatibility with :class:`WriteBehindStorage`.
+        """
+        async with self.lock:
+            touched, self._touched = self._touched, {}
+            stmts: List[Statement] = []
+            # Shorter paths first, so a product row exists before its buyers
+            for path in sorted(touched, key=len):
+                path_stmts = self._path_statements(data, path)
+                if path_stmts is None:
+                    stmts = self._full_statements(data)
+                    break
+                stmts += path_stmts
+            if not touched:
+                stmts = self._full_statements(data)
+            try:
+                await self._run(lambda conn: self._execute(conn, stmts))
+            except sqlite3.Error as exc:
+                logger.error("Failed to save %s: %s", self.path, exc)
+                self._touched = {**touched, **self._touched}
+                return False
+            return True
+
+    async def close(self) -> None:
+        """Close the connection and stop the worker thread."""
+        def close(conn: sqlite3.Connection) -> None:
+            conn.close()
+        if self._conn is not None:
+            await self._run(close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+async def import_json(json_path: Path, db_path: Path, key: bytes) -> Dict[str, int]:
+    """Copy the contents of an encrypted ``data.json`` into a SQLite database."""
+    data = await JSONStorage(json_path, key).load()
+    target = SQLiteStorage(db_path, key)
+    try:
+        await target.save(data)
+    finally:
+        await target.close()
+    return {
+        "products": len(data.get("products", {})),
+        "pending": len(data.get("pending", [])),
+        "languages": len(data.get("languages", {})),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Import data.json into a SQLite database")
+    parser.add_argument("json_path", type=Path)
+    parser.add_argument("db_path", type=Path)
+    args = parser.parse_args(argv)
+    key = os.environ.get("FERNET_KEY")
+    if not key:
+        raise SystemExit("FERNET_KEY environment variable not set")
+    if not args.json_path.exists():
+        raise SystemExit(f"{args.json_path} does not exist")
+    counts = asyncio.run(import_json(args.json_path, args.db_path, key.encode()))
+    print(
+        f"Imported {counts['products']} products, {counts['pending']} pending "
+        f"purchases and {counts['languages']} language preferences",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,592 @@
 import asyncio
 import json
+from array import array
 import logging
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict
+from typing import IO, Any, Dict, Iterable, List, Optional, Set, Tuple
 import copy
 from cryptography.fernet import Fernet, InvalidToken
 
+from .indexes import BuyerSet, PendingQueue, buyers_of, pending_of
+
 logger = logging.getLogger(__name__)
 
-DEFAULT_DATA = {"products": {}, "pending": [], "languages": {}}
+DEFAULT_DATA = {"products": {}, "pending": []}
+
+# Product fields stored encrypted on disk
+SENSITIVE_FIELDS = ("username", "password", "secret")
+
+# Number of journal records after which a full snapshot is written
+DEFAULT_COMPACT_EVERY = 1000
+
+KeyPath = Tuple[str, ...]
+
+
+def _lookup(data: Dict[str, Any], path: KeyPath) -> Tuple[bool, Any]:
+    """Return ``(found, value)`` for the nested key *path* in *data*."""
+    node: Any = data
+    for key in path:
+        if not isinstance(node, dict) or key not in node:
+            return False, None
+        node = node[key]
+    return True, node
+
+
+def _json_default(value: Any) -> Any:
+    """Encode the in-memory indexes and their snapshots as JSON lists."""
+    if isinstance(value, (BuyerSet, PendingQueue, array)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _snapshot(value: Any) -> Any:
+    """Copy the containers of *value* for hand-off to the worker thread.
+
+    Handlers keep mutating dicts and lists while a save runs, so the worker
+    gets its own containers. Strings and numbers are immutable and shared.
+    """
+    if isinstance(value, dict):
+        copied = dict(value)
+        for key, item in copied.items():
+            if isinstance(item, (dict, list, BuyerSet)):
+                copied[key] = _snapshot(item)
+        return copied
+    if isinstance(value, list):
+        copied = list(value)
+        for i, item in enumerate(copied):
+            if isinstance(item, (dict, list, BuyerSet)):
+                copied[i] = _snapshot(item)
+        return copied
+    if isinstance(value, BuyerSet):
+        return value.to_array()
+    if isinstance(value, PendingQueue):
+        return _snapshot(list(value))
+    return value
+
+
+class _Encoded(str):
+    """JSON text of a product kept from the previous snapshot."""
+
+
+def _snapshot_data(data: Dict[str, Any], encoded: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Like :func:`_snapshot` but using the known layout of *data*.
+
+    Products found in *encoded* are unchanged since the last snapshot and
+    are passed on as their :class:`_Encoded` JSON instead of being copied.
+    The languages map and the buyers lists hold only leaf values, so they
+    are copied wholesale instead of being walked item by item. Buyer
+    indexes are snapshotted as compact int arrays.
+    """
+    encoded = encoded or {}
+    snap: Dict[str, Any] = {}
+    for key, value in data.items():
+        if key == "products":
+            products: Dict[str, Any] = {}
+            for pid, product in value.items():
+                if pid in encoded:
+                    products[pid] = _Encoded(encoded[pid])
+                    continue
+                copied = dict(product)
+                for field, item in copied.items():
+                    if field == "buyers":
+                        copied[field] = _snapshot(item) if isinstance(item, BuyerSet) else list(item)
+                    elif isinstance(item, (dict, list)):
+                        copied[field] = _snapshot(item)
+                products[pid] = copied
+            snap[key] = products
+        elif key == "languages":
+            snap[key] = dict(value)
+        else:
+            snap[key] = _snapshot(value)
+    return snap
+
+
+def _apply_item(data: Dict[str, Any], record: Dict[str, Any]) -> None:
+    """Replay a journal record adding or removing a single buyer or
+    pending purchase."""
+    path = tuple(record["path"])
+    if path == ("pending",):
+        pending = pending_of(data)
+        if "put" in record:
+            pending.put(record["put"])
+        else:
+            pending.pop(*record["pop"])
+        return
+    found, product = _lookup(data, path[:2])
+    if not found:
+        # The product was deleted by a later record
+        return
+    if "add" in record:
+        buyers_of(product).append(record["add"])
+    else:
+        buyers_of(product).discard(record["remove"])
+
+
+def _apply(data: Dict[str, Any], path: KeyPath, found: bool, value: Any = None) -> None:
+    """Set or delete the nested key *path* in *data*."""
+    node = data
+    for key in path[:-1]:
+        if not found and key not in node:
+            return
+        node = node.setdefault(key, {})
+    if found:
+        node[path[-1]] = value
+    else:
+        node.pop(path[-1], None)
+
+
+class Sealed:
+    """A credential still in its encrypted form.
+
+    Loading keeps credentials sealed; :meth:`FieldCipher.reveal` decrypts
+    them when a handler actually needs the plaintext.
+    """
+
+    __slots__ = ("token",)
+
+    def __init__(self, token: str):
+        self.token = token
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Sealed) and other.token == self.token
+
+    def __hash__(self) -> int:
+        return hash(self.token)
+
+    def __repr__(self) -> str:
+        return "Sealed(...)"
+
+
+class FieldCipher:
+    """Fernet encryption of the sensitive fields of a product.
+
+    Fernet output changes on every call, so the last ciphertext of each
+    ``(pid, field)`` is cached together with its plaintext and reused until
+    the value changes. ``hits`` and ``misses`` count cache lookups.
+
+    Revealed plaintexts are kept in a small LRU for ``reveal_ttl`` seconds;
+    ``reveal_cache_size=0`` disables it.
+    """
+
+    def __init__(self, key: bytes, reveal_cache_size: int = 256, reveal_ttl: float = 300.0):
+        self.fernet = Fernet(key)
+        self._cache: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.reveal_cache_size = reveal_cache_size
+        self.reveal_ttl = reveal_ttl
+        self._revealed: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def encrypt(self, pid: str, field: str, value: Any) -> Any:
+        if value is None:
+            return None
+        if isinstance(value, Sealed):
+            return value.token
+        cached = self._cache.get((pid, field))
+        if cached is not None and cached[0] == value:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        token = self.fernet.encrypt(value.encode()).decode()
+        self._cache[(pid, field)] = (value, token)
+        return token
+
+    def reveal(self, value: Any) -> Any:
+        """Return the plaintext of *value*, decrypting it if it is sealed."""
+        if not isinstance(value, Sealed):
+            return value
+        now = time.monotonic()
+        cached = self._revealed.get(value.token)
+        if cached is not None and cached[1] > now:
+            self._revealed.move_to_end(value.token)
+            return cached[0]
+        try:
+            plain = self.fernet.decrypt(value.token.encode()).decode()
+        except InvalidToken:
+            logger.error("Failed to decrypt credential")
+            return ""
+        if self.reveal_cache_size > 0:
+            self._revealed[value.token] = (plain, now + self.reveal_ttl)
+            self._revealed.move_to_end(value.token)
+            while len(self._revealed) > self.reveal_cache_size:
+                self._revealed.popitem(last=False)
+        return plain
+
+    def invalidate(self, pid: str, field: Optional[str] = None) -> None:
+        """Drop cached ciphertexts of *pid*, or only of its *field*."""
+        fields = (field,) if field else SENSITIVE_FIELDS
+        for name in fields:
+            self._cache.pop((pid, name), None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache hit and miss counters."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "revealed": len(self._revealed),
+        }
+
+    def encrypt_product(self, pid: str, product: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a copy of *product* with its credentials encrypted."""
+        encrypted = dict(product)
+        for field in SENSITIVE_FIELDS:
+            if encrypted.get(field) is not None:
+                encrypted[field] = self.encrypt(pid, field, encrypted[field])
+        return encrypted
+
+    def seal_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        """Wrap the encrypted credentials of *product* in place."""
+        for field in SENSITIVE_FIELDS:
+            if product.get(field) is not None:
+                product[field] = Sealed(product[field])
+        return product
 
 
 class JSONStorage:
-    """Simple JSON file storage with an async lock and Fernet encryption."""
+    """Simple JSON file storage with an async lock and Fernet encryption.
+
+    Encryption, serialization and file I/O run on a dedicated worker thread
+    so the event loop keeps serving updates during a save. Loaded
+    credentials stay :class:`Sealed` until revealed through ``cipher``.
 
-    def __init__(self, path: Path, key: bytes):
+    With ``journal=True`` a save only appends the key paths marked via
+    :meth:`touch` to a journal file next to the data file. The journal is
+    replayed on :meth:`load` and folded into a full snapshot every
+    ``compact_every`` records. Touching ``('products', pid, 'buyers', uid)``
+    or ``('pending', user_id, pid)`` journals just that buyer or pending
+    purchase instead of the whole list.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        key: bytes,
+        journal: bool = False,
+        compact_every: int = DEFAULT_COMPACT_EVERY,
+        fsync: bool = False,
+    ):
         self.path = path
+        self.journal_path = path.with_suffix(".journal")
         self.lock = asyncio.Lock()
-        self.fernet = Fernet(key)
+        self.cipher = FieldCipher(key)
+        self.journal = journal
+        self.compact_every = compact_every
+        self.fsync = fsync
+        # Ordered, so buyers added in one save are replayed in that order
+        self._touched: Dict[KeyPath, None] = {}
+        # JSON of each product in the last snapshot, and the products
+        # touched since (None: all of them)
+        self._encoded: Dict[str, str] = {}
+        self._dirty: Set[Optional[str]] = set()
+        self._journal_records = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
 
-    def _encrypt_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        encrypted = copy.deepcopy(data)
-        for product in encrypted.get("products", {}).values():
-            for field in ("username", "password", "secret"):
-                value = product.get(field)
-                if value is not None:
-                    product[field] = self.fernet.encrypt(value.encode()).decode()
-        return encrypted
+    def touch(self, *path: str) -> None:
+        """Mark the nested key *path* as changed for the next :meth:`save`."""
+        self._touched[tuple(path)] = None
+        if path[0] == "products":
+            self._dirty.add(path[1] if len(path) > 1 else None)
+
+    def _dump_encrypted(self, data: Dict[str, Any], fh: IO[str]) -> Dict[str, str]:
+        """Write *data* to *fh* as JSON, encrypting credentials inline.
+
+        Products are encoded one at a time, so only a single product is
+        ever copied; everything else is streamed straight from *data*.
+        :class:`_Encoded` products are written as they are. Returns the
+        JSON written for each product.
+        """
+        encoded: Dict[str, str] = {}
+        fh.write("{")
+        for i, (key, value) in enumerate(data.items()):
+            if i:
+                fh.write(",\n")
+            fh.write(json.dumps(key) + ": ")
+            if key != "products":
+                json.dump(value, fh, default=_json_default)
+                continue
+            fh.write("{")
+            for j, (pid, product) in enumerate(value.items()):
+                if j:
+                    fh.write(",\n")
+                fh.write(json.dumps(pid) + ": ")
+                if not isinstance(product, _Encoded):
+                    product = json.dumps(self.cipher.encrypt_product(pid, product), default=_json_default)
+                encoded[pid] = product
+                fh.write(product)
+            fh.write("}")
+        fh.write("}\n")
+        return encoded
 
-    def _decrypt_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _seal_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         for product in data.get("products", {}).values():
-            for field in ("username", "password", "secret"):
-                value = product.get(field)
-                if value is not None:
-                    try:
-                        product[field] = self.fernet.decrypt(value.encode()).decode()
-                    except InvalidToken:
-                        logger.error("Failed to decrypt %s", field)
-                        product[field] = ""
+            self._seal_product(product)
+        if "pending" in data:
+            pending_of(data)
+        return data
+
+    def _seal_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        """Seal the credentials of a loaded *product* and index its buyers."""
+        buyers_of(product)
+        return self.cipher.seal_product(product)
+
+    def _encrypt_value(self, path: KeyPath, value: Any) -> Any:
+        """Encrypt the credentials contained in *value* stored at *path*."""
+        if path[0] != "products":
+            return value
+        if len(path) == 1:
+            return {pid: self.cipher.encrypt_product(pid, p) for pid, p in value.items()}
+        if len(path) == 2:
+            return self.cipher.encrypt_product(path[1], value)
+        if len(path) == 3 and path[2] in SENSITIVE_FIELDS:
+            return self.cipher.encrypt(path[1], path[2], value)
+        return value
+
+    def _seal_value(self, path: KeyPath, value: Any) -> Any:
+        if path == ("pending",):
+            return PendingQueue(value or ())
+        if path[0] != "products":
+            return value
+        if len(path) == 1:
+            return {pid: self._seal_product(p) for pid, p in value.items()}
+        if len(path) == 2:
+            return self._seal_product(value)
+        if len(path) == 3 and path[2] in SENSITIVE_FIELDS and value is not None:
+            return Sealed(value)
+        if len(path) == 3 and path[2] == "buyers":
+            return BuyerSet(value)
+        return value
+
+    def _replay_journal(self, data: Dict[str, Any]) -> int:
+        """Apply journal records on top of *data* and return their count."""
+        count = 0
+        try:
+            fh = open(self.journal_path, "r")
+        except FileNotFoundError:
+            return 0
+        with fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-append
+                    logger.warning("Ignoring truncated record in %s", self.journal_path)
+                    break
+                if record.keys() & {"add", "remove", "put", "pop"}:
+                    _apply_item(data, record)
+                    count += 1
+                    continue
+                path = tuple(record["path"])
+                found = "value" in record
+                value = self._seal_value(path, record["value"]) if found else None
+                _apply(data, path, found, value)
+                count += 1
+        return count
+
+    @staticmethod
+    def _change(data: Dict[str, Any], path: KeyPath) -> Dict[str, Any]:
+        """Return the journal record of the touched *path*.
+
+        Values are copied but not yet encrypted. Single buyers and pending
+        purchases become add/remove and put/pop records.
+        """
+        if path[0] == "pending" and len(path) == 3:
+            entry = pending_of(data).get(path[1], path[2])
+            if entry is None:
+                return {"path": ["pending"], "pop": [path[1], path[2]]}
+            return {"path": ["pending"], "put": _snapshot(entry)}
+        if path[0] == "products" and len(path) == 4 and path[2] == "buyers":
+            found, buyers = _lookup(data, path[:3])
+            op = "add" if found and path[3] in buyers else "remove"
+            return {"path": list(path[:3]), op: path[3]}
+        found, value = _lookup(data, path)
+        record: Dict[str, Any] = {"path": list(path)}
+        if found:
+            record["value"] = _snapshot(value)
+        return record
+
+    def _append_journal(self, records: Iterable[Dict[str, Any]]) -> None:
+        lines = []
+        for record in records:
+            if "value" in record:
+                record["value"] = self._encrypt_value(tuple(record["path"]), record["value"])
+            lines.append(json.dumps(record, default=_json_default))
+        with open(self.journal_path, "a") as fh:
+            fh.write("\n".join(lines) + "\n")
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+        self._journal_records += len(lines)
+
+    def _write_snapshot(self, data: Dict[str, Any]) -> Dict[str, str]:
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            with open(tmp, "w") as fh:
+                encoded = self._dump_encrypted(data, fh)
+                if self.fsync:
+                    fh.flush()
+                    os.fsync(fh.fileno())
+            os.replace(tmp, self.path)
+        except OSError:
+            # Cleanup temp file on error
+            try:
+                tmp.unlink(missing_ok=True)
+            except Exception:  # pragma: no cover - best effort cleanup
+                pass
+            raise
+        # The snapshot now contains every journaled change
+        self.journal_path.unlink(missing_ok=True)
+        self._journal_records = 0
+        return encoded
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r") as fh:
+                data = self._seal_data(json.load(fh))
+        except FileNotFoundError:
+            data = copy.deepcopy(DEFAULT_DATA)
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.error("Failed to load %s: %s", self.path, exc)
+            return copy.deepcopy(DEFAULT_DATA)
+        try:
+            self._journal_records = self._replay_journal(data)
+        except (OSError, KeyError, TypeError) as exc:
+            logger.error("Failed to replay %s: %s", self.journal_path, exc)
         return data
 
     async def load(self) -> Dict[str, Any]:
-        """Load data from the JSON file, returning defaults on error."""
+        """Load data from the JSON file, returning defaults on error.
+
+        Journal records written since the last snapshot are replayed on top.
+        """
         async with self.lock:
-            try:
-                with open(self.path, "r") as fh:
-                    data = json.load(fh)
-                return self._decrypt_data(data)
-            except FileNotFoundError:
-                return DEFAULT_DATA.copy()
-            except (OSError, json.JSONDecodeError) as exc:
-                logger.error("Failed to load %s: %s", self.path, exc)
-                return DEFAULT_DATA.copy()
-
-    async def save(self, data: Dict[str, Any]) -> None:
-        """Write *data* atomically to the JSON file."""
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._load)
+
+    async def save(self, data: Dict[str, Any], wait: bool = True) -> bool:
+        """Persist *data* and return whether it was written.
+
+        In journal mode the paths marked with :meth:`touch` are appended to
+        the journal; otherwise *data* is written atomically as a snapshot,
+        copying only the products touched since the previous one. A save
+        with nothing touched copies everything. A failed write is logged
+        and its changes are retried by the next save.
+        The write has always completed when this returns, so *wait* is
+        accepted only for interface compatibility with
+        :class:`WriteBehindStorage`.
+        """
         async with self.lock:
-            tmp = self.path.with_suffix(".tmp")
+            loop = asyncio.get_running_loop()
+            touched, self._touched = self._touched, {}
+            dirty: Set[Optional[str]] = set()
+            saved = False
             try:
-                enc = self._encrypt_data(data)
-                with open(tmp, "w") as fh:
-                    json.dump(enc, fh, indent=2)
-                os.replace(tmp, self.path)
+                pending = self._journal_records + len(touched)
+                if self.journal and touched and pending < self.compact_every:
+                    # Shorter paths first: parents are replayed before their
+                    # children, items keep the order they were touched in
+                    changes = [self._change(data, path) for path in sorted(touched, key=len)]
+                    await loop.run_in_executor(self._executor, self._append_journal, changes)
+                else:
+                    dirty, self._dirty = self._dirty, set()
+                    clean = {}
+                    if touched and None not in dirty:
+                        clean = {pid: text for pid, text in self._encoded.items() if pid not in dirty}
+                    snapshot = _snapshot_data(data, clean)
+                    self._encoded = await loop.run_in_executor(
+                        self._executor, self._write_snapshot, snapshot
+                    )
+                saved = True
+                logger.debug("Saved %s, cipher cache %s", self.path, self.cipher.stats())
             except OSError as exc:
                 logger.error("Failed to save %s: %s", self.path, exc)
-                # Cleanup temp file on error
-                try:
-                    tmp.unlink(missing_ok=True)
-                except Exception:  # pragma: no cover - best effort cleanup
-                    pass
+            finally:
+                if not saved:
+                    # Keep the changes pending so the next save retries them,
+                    # also when cancelled while the worker was writing
+                    self._touched = {**touched, **self._touched}
+                    self._dirty |= dirty
+            return saved
+
+    async def close(self) -> None:
+        """Stop the worker thread; every save is already on disk."""
+        self._executor.shutdown(wait=True)
+
+
+class WriteBehindStorage:
+    """Coalesce saves of another storage into delayed flushes.
+
+    :meth:`save` only marks the store dirty; every save made within
+    ``delay`` seconds of the first one is written by a single flush of the
+    wrapped storage. Callers that need durability pass ``wait=True`` and
+    get the result of that flush. Other attributes (``touch``, ``path``, ``cipher``...) are delegated.
+    """
+
+    def __init__(self, storage: Any, delay: float):
+        self.storage = storage
+        self.delay = delay
+        self.flushes = 0
+        self._data: Optional[Dict[str, Any]] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._waiters: List[asyncio.Future] = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.storage, name)
+
+    async def load(self) -> Dict[str, Any]:
+        return await self.storage.load()
+
+    async def save(self, data: Dict[str, Any], wait: bool = False) -> bool:
+        """Schedule *data* to be written, optionally waiting for the flush.
+
+        Return whether the flush wrote the data, or True when not waiting.
+        """
+        loop = asyncio.get_running_loop()
+        self._data = data
+        if self._timer is None:
+            self._timer = loop.create_task(self._flush_later())
+        if not wait:
+            return True
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        return await waiter
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.delay)
+        # Saves arriving during the flush schedule the next one
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> bool:
+        """Write pending changes now and return whether they were written."""
+        data, self._data = self._data, None
+        waiters, self._waiters = self._waiters, []
+        error: Optional[BaseException] = None
+        written = True
+        if data is not None:
+            try:
+                written = await self.storage.save(data)
+                self.flushes += 1
+            except Exception as exc:
+                logger.error("Write-behind flush of %s failed: %s", self.storage.path, exc)
+                error = exc
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if error is None:
+                waiter.set_result(written)
+            else:
+                waiter.set_exception(error)
+        return written and error is None
+
+    async def close(self) -> None:
+        """Flush pending changes and close the wrapped storage."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        await self.storage.close()
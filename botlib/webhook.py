@@ -0,0 +1,313 @@
+"""Built-in HTTP server receiving updates from Telegram's webhook."""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Header carrying the secret token registered with setWebhook
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+# Updates are small; anything larger is refused
+MAX_BODY = 1 << 20
+
+# Telegram sends a handful of short headers; more than this is refused
+MAX_HEADERS = 64
+MAX_HEADER_BYTES = 16 << 10
+
+# Seconds an idle keep-alive connection is kept open
+IDLE_TIMEOUT = 60.0
+
+# Seconds a client has to send the headers and body once a request started
+REQUEST_TIMEOUT = 10.0
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+}
+
+
+class WebhookServer:
+    """Minimal HTTP/1.1 server feeding webhook updates to an application.
+
+    Only ``POST`` requests to ``path`` carrying the ``secret_token`` header
+    are accepted; each body is decoded into an :class:`Update` and put on
+    ``app.update_queue``, where the application's handlers pick it up as
+    they would with polling. Connections are kept alive and at most
+    ``max_connections`` are served at once.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        listen: str,
+        port: int,
+        path: str,
+        secret_token: str,
+        max_connections: int = 40,
+    ):
+        self.app = app
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token.encode()
+        self.max_connections = max_connections
+        self.received = 0
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def bound_port(self) -> int:
+        """Port actually listened on, useful when ``port`` is 0."""
+        return self._server.sockets[0].getsockname()[1] if self._server else self.port
+
+    async def start(self) -> None:
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port)
+        logger.info("Webhook listening on %s:%d%s", self.listen, self.bound_port, self.path)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async with self._slots:
+            try:
+                while await self._handle_one(reader, writer):
+                    pass
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+    async def _handle_one(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Serve one request; return True to keep the connection open.
+
+        A client that does not finish its request within
+        :data:`REQUEST_TIMEOUT` is disconnected, so stalled connections
+        cannot hold the slots for long.
+        """
+        try:
+            line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        except ValueError:
+            # A request line longer than the stream's buffer limit
+            await self._respond(writer, 400, False)
+            return False
+        if not line:
+            return False
+        deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            await self._respond(writer, 400, False)
+            return False
+        headers = await asyncio.wait_for(self._read_headers(reader), REQUEST_TIMEOUT)
+        if headers is None:
+            await self._respond(writer, 431, False)
+            return False
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            await self._respond(writer, 413 if length > MAX_BODY else 400, False)
+            return False
+        remaining = deadline - asyncio.get_running_loop().time()
+        body = await asyncio.wait_for(reader.readexactly(length), max(remaining, 0))
+        status = await self._dispatch(method, target, headers, body)
+        await self._respond(writer, status, keep_alive)
+        return keep_alive
+
+    async def _read_headers(self, reader: asyncio.StreamReader) -> Optional[Dict[str, str]]:
+        """Read the request headers, or return ``None`` if there are too
+        many or they are too large."""
+        headers: Dict[str, str] = {}
+        size = 0
+        while True:
+            try:
+                header = await reader.readline()
+            except ValueError:
+                # A single line longer than the stream's buffer limit
+                return None
+            if header in (b"\r\n", b"\n", b""):
+                return headers
+            size += len(header)
+            if len(headers) >= MAX_HEADERS or size > MAX_HEADER_BYTES:
+                return None
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> int:
+        if target.split("?", 1)[0] != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        token = headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(token, self.secret_token):
+            return 403
+        try:
+            payload = json.loads(body)
+            # de_json returns None for anything but an object
+            update = Update.de_json(payload, self.app.bot) if isinstance(payload, dict) else None
+        except Exception as exc:
+            # de_json raises all sorts of errors on unexpected field types
+            logger.warning("Ignoring malformed update: %s", exc)
+            return 400
+        if update is None:
+            logger.warning("Ignoring update that is not a JSON object")
+            return 400
+        await self.app.update_queue.put(update)
+        self.received += 1
+        return 200
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, keep_alive: bool) -> None:
+        connection = "keep-alive" if keep_alive else "close"
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Length: 0\r\nConnection: {connection}\r\n\r\n".encode()
+        )
+        await writer.drain()
+
+
+# -- Benchmark harness -------------------------------------------------------
+
+
+def sample_updates(count: int) -> List[Dict[str, Any]]:
+    """Return *count* ``/start`` message updates from distinct users."""
+    return [
+        {
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": 0,
+                "chat": {"id": 1000 + i, "type": "private"},
+                "from": {"id": 1000 + i, "is_bot": False, "first_name": "bench"},
+                "text": "/start",
+            },
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def load_updates(path: Path) -> List[Dict[str, Any]]:
+    """Read recorded updates, one JSON object per line."""
+    with open(path, "r") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+class _Sink:
+    """Stand-in application timing updates as they leave the queue."""
+
+    bot = None
+
+    def __init__(self):
+        self.update_queue: "asyncio.Queue[Update]" = asyncio.Queue()
+
+
+async def _post_all(port: int, path: str, secret: str, payloads: List[bytes], sent: Dict[int, float]) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for payload in payloads:
+            update_id = json.loads(payload)["update_id"]
+            sent[update_id] = time.perf_counter()
+            head = (
+                f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                f"{SECRET_HEADER}: {secret}\r\nContent-Length: {len(payload)}\r\n\r\n"
+            )
+            writer.write(head.encode() + payload)
+            await writer.drain()
+            status = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            if b" 200 " not in status:
+                raise RuntimeError(f"Webhook refused update {update_id}: {status!r}")
+    finally:
+        writer.close()
+
+
+async def bench(updates: List[Dict[str, Any]], connections: int = 4) -> Dict[str, float]:
+    """POST *updates* at a local :class:`WebhookServer` and time them.
+
+    Returns the throughput and the latency percentiles, in milliseconds,
+    from writing a request to the update leaving the application's queue,
+    which is where a handler would start. The ``direct`` figures time the
+    same updates put on the queue without HTTP, the floor polling gets
+    after its long-poll round trip to Telegram.
+    """
+    sink = _Sink()
+    secret = "bench"
+    server = WebhookServer(sink, "127.0.0.1", 0, "/bench", secret, max_connections=connections)
+    await server.start()
+    sent: Dict[int, float] = {}
+    latencies: List[float] = []
+
+    async def consume(total: int, timings: Dict[int, float], out: List[float]) -> None:
+        for _ in range(total):
+            update = await sink.update_queue.get()
+            out.append(time.perf_counter() - timings[update.update_id])
+
+    payloads = [json.dumps(u).encode() for u in updates]
+    chunks = [payloads[i::connections] for i in range(connections)]
+    started = time.perf_counter()
+    consumer = asyncio.ensure_future(consume(len(payloads), sent, latencies))
+    await asyncio.gather(*(_post_all(server.bound_port, "/bench", secret, c, sent) for c in chunks))
+    await consumer
+    elapsed = time.perf_counter() - started
+    await server.stop()
+
+    direct: List[float] = []
+    for raw in updates:
+        queued = time.perf_counter()
+        await sink.update_queue.put(Update.de_json(raw, None))
+        await sink.update_queue.get()
+        direct.append(time.perf_counter() - queued)
+
+    return {
+        "updates": len(updates),
+        "per_second": len(updates) / elapsed,
+        **_percentiles("webhook", latencies),
+        **_percentiles("direct", direct),
+    }
+
+
+def _percentiles(name: str, samples: List[float]) -> Dict[str, float]:
+    cuts = statistics.quantiles([s * 1000 for s in samples], n=100)
+    return {f"{name}_p50_ms": cuts[49], f"{name}_p99_ms": cuts[98]}
+
+
+def _parse_args(argv: Optional[List[str]]) -> Tuple[argparse.Namespace, List[Dict[str, Any]]]:
+    parser = argparse.ArgumentParser(description="Measure webhook update ingestion locally")
+    parser.add_argument("updates", nargs="?", type=Path, help="JSON lines file of recorded updates")
+    parser.add_argument("--count", type=int, default=2000, help="synthetic updates if no file is given")
+    parser.add_argument("--connections", type=int, default=4)
+    args = parser.parse_args(argv)
+    updates = load_updates(args.updates) if args.updates else sample_updates(args.count)
+    return args, updates
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args, updates = _parse_args(argv)
+    result = asyncio.run(bench(updates, args.connections))
+    for key, value in result.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import pytest
 
 DEFAULT_ENV = {
@@ -16,3 +17,17 @@ def bot_environment(monkeypatch):
     for key, value in DEFAULT_ENV.items():
         monkeypatch.setenv(key, value)
     yield
+
+
+async def _no_sleep(delay):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def unpaced_delivery(monkeypatch):
+    """Send without waiting for rate limits in handler tests."""
+    bot = sys.modules.get("bot")
+    if bot is not None:
+        from botlib.delivery import Delivery
+        monkeypatch.setattr(bot, "delivery", Delivery(sleep=_no_sleep))
+    yield
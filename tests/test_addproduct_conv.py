@@ -12,6 +12,7 @@ from bot_conversations import (
     addproduct_username,
     addproduct_password,
     addproduct_secret,
+    addproduct_name,
     ASK_ID,
     ASK_PRICE,
     ASK_USERNAME,
@@ -115,3 +116,18 @@ def test_back_button_cancels_midway(step, handler):
     assert state == ConversationHandler.END
     assert "new_product" not in context.user_data
     assert update.replies[-1] == tr("operation_cancelled", lang)
+
+
+@pytest.mark.parametrize("handler", [addproduct_price, addproduct_name])
+def test_lost_draft_asks_to_start_over(handler):
+    context = DummyContext()
+    update = DummyUpdate(ADMIN_ID)
+    asyncio.run(addproduct_menu(update, context))
+    update.message.text = "p1"
+    asyncio.run(addproduct_id(update, context))
+    # Session eviction dropped user_data while the conversation went on
+    context.user_data.clear()
+    update.message.text = "1"
+    state = asyncio.run(handler(update, context))
+    assert state == ConversationHandler.END
+    assert update.replies[-1] == tr("addproduct_restart", "en")
@@ -8,7 +8,9 @@ import pytest
 pytest.importorskip("telegram")
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
-from bot import approve, deleteproduct, resend, unknown, data, ADMIN_ID  # noqa: E402
+import bot  # noqa: E402
+from bot import approve, deleteproduct, handle_photo, resend, unknown, data, ADMIN_ID  # noqa: E402
+from botlib.translations import tr  # noqa: E402
 
 
 class DummyBot:
@@ -18,6 +20,9 @@ class DummyBot:
     async def send_message(self, uid, text, *args, **kwargs):
         self.sent.append((uid, text))
 
+    async def send_photo(self, uid, photo, *args, **kwargs):
+        self.sent.append((uid, photo))
+
 
 class DummyUpdate:
     def __init__(self, user_id, text="/cmd"):
@@ -29,7 +34,7 @@ class DummyUpdate:
         self.effective_user = self.message.from_user
         self.replies = []
 
-    async def _reply(self, text):
+    async def _reply(self, text, reply_markup=None):
         self.replies.append(text)
 
 
@@ -48,7 +53,116 @@ def test_approve_moves_pending():
     asyncio.run(approve(update, context))
     assert data['pending'] == []
     assert 2 in data['products']['p1']['buyers']
-    assert len(context.bot.sent) == 2
+    assert len(context.bot.sent) == 1
+
+
+def test_approve_keeps_purchase_when_delivery_fails():
+    from telegram.error import NetworkError
+
+    class OfflineBot(DummyBot):
+        async def send_message(self, uid, text, *args, **kwargs):
+            raise NetworkError('connection reset')
+
+    data['pending'] = [{'user_id': 2, 'product_id': 'p1', 'file_id': 'f'}]
+    data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': []}}
+    update = DummyUpdate(ADMIN_ID)
+    context = DummyContext(['2', 'p1'])
+    context.bot = OfflineBot()
+    asyncio.run(approve(update, context))
+    assert data['pending'] == []
+    assert 2 in data['products']['p1']['buyers']
+    assert update.replies == [tr('approved_undelivered', 'en')]
+    assert data['outbox']['2:p1:credentials']['attempts'] == 1
+
+    context.bot = DummyBot()
+    asyncio.run(bot.drain_outbox(context.bot))
+    assert data['outbox'] == {}
+    assert [uid for uid, _ in context.bot.sent] == [2]
+
+
+def test_approve_sends_nothing_until_saved(monkeypatch):
+    saves = []
+
+    async def failing_save(_data, wait=False):
+        saves.append(wait)
+        return False
+
+    started = []
+    monkeypatch.setattr(bot.storage, 'save', failing_save)
+    monkeypatch.setattr(bot.jobs, 'start', lambda name, coro: started.append(name) or coro.close())
+    data['pending'] = [{'user_id': 2, 'product_id': 'p1', 'file_id': 'f'}]
+    data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': []}}
+    update = DummyUpdate(ADMIN_ID)
+    context = DummyContext(['2', 'p1'])
+    asyncio.run(approve(update, context))
+    assert saves == [True]
+    assert context.bot.sent == []
+    assert update.replies == [tr('approved_undelivered', 'en')]
+    assert '2:p1:credentials' in data['outbox']
+    assert started == ['outbox']
+
+
+def test_undeliverable_outbox_entries_reported_to_admin():
+    from telegram.error import Forbidden, NetworkError
+
+    class FailingBot(DummyBot):
+        async def send_message(self, uid, text, *args, **kwargs):
+            if uid == 2:
+                raise Forbidden('bot was blocked by the user')
+            if uid == 3:
+                raise NetworkError('connection reset')
+            self.sent.append((uid, text))
+
+    data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': [2, 3]}}
+    data['outbox'] = {
+        f'{uid}:p1:credentials': {'user_id': uid, 'product_id': 'p1', 'event': 'credentials', 'lang': 'en'}
+        for uid in (2, 3)
+    }
+    fake = FailingBot()
+    asyncio.run(bot.drain_outbox(fake))
+    # A blocked buyer is given up on at once, a network failure is retried
+    assert list(data['outbox']) == ['3:p1:credentials']
+    assert fake.sent == [(ADMIN_ID, tr('delivery_dropped', 'en').format(user_id=2, product_id='p1'))]
+
+    for _ in range(bot.OUTBOX_MAX_ATTEMPTS - 1):
+        asyncio.run(bot.drain_outbox(fake))
+    assert data['outbox'] == {}
+    assert fake.sent[-1] == (ADMIN_ID, tr('delivery_dropped', 'en').format(user_id=3, product_id='p1'))
+
+
+def test_outbox_retried_until_delivered(monkeypatch):
+    from telegram.error import NetworkError
+
+    class FlakyBot(DummyBot):
+        failures = 1
+
+        async def send_message(self, uid, text, *args, **kwargs):
+            if self.failures:
+                self.failures -= 1
+                raise NetworkError('connection reset')
+            self.sent.append((uid, text))
+
+    monkeypatch.setattr(bot, 'OUTBOX_RETRY_INTERVAL', 0)
+    monkeypatch.setattr(bot.delivery, 'retries', 0)
+    data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': [2]}}
+    data['outbox'] = {'2:p1:credentials': {'user_id': 2, 'product_id': 'p1', 'event': 'credentials', 'lang': 'en'}}
+    fake = FlakyBot()
+    asyncio.run(bot.retry_outbox(fake, delay=0))
+    assert data['outbox'] == {}
+    assert [uid for uid, _ in fake.sent] == [2]
+
+
+def test_repeated_payment_proofs_merge():
+    data['pending'] = []
+    context = DummyContext([])
+    for file_id in ('f1', 'f2', 'f1'):
+        update = DummyUpdate(2)
+        update.message.photo = [types.SimpleNamespace(file_id=file_id)]
+        context.user_data['buy_pid'] = 'p1'
+        asyncio.run(handle_photo(update, context))
+    assert data['pending'] == [
+        {'user_id': 2, 'product_id': 'p1', 'file_id': 'f1', 'file_ids': ['f1', 'f2']}
+    ]
 
 
 def test_deleteproduct_removes_entry():
@@ -63,8 +177,15 @@ def test_resend_sends_credentials():
     data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': [2]}}
     update = DummyUpdate(ADMIN_ID)
     context = DummyContext(['p1'])
-    asyncio.run(resend(update, context))
-    assert len(context.bot.sent) == 2
+
+    async def run_resend():
+        await resend(update, context)
+        await bot.jobs.join('resend:p1')
+
+    asyncio.run(run_resend())
+    assert len(context.bot.sent) == 1
+    assert update.replies == ['Resending p1: 0 sent, 0 failed, 1 left']
+    assert 'p1' not in data['resends']
     assert context.bot.sent[0][0] == 2
 
 
@@ -11,7 +11,9 @@ sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 from bot import (  # noqa: E402
     admin_callback,
     admin_menu_callback,
+    review_callback,
     buyerlist_callback,
+    buyers_page_callback,
     editprod_callback,
     deleteprod_callback,
     resend_callback,
@@ -33,18 +35,41 @@ class DummyBot:
 
 
 class DummyCallbackUpdate:
-    def __init__(self, user_id, data):
+    def __init__(self, user_id, data, photo=None):
         self.replies = []
+        self.photos = []
+        self.edits = []
+        self.documents = []
 
         async def reply(text, reply_markup=None):
             self.replies.append((text, reply_markup))
 
+        async def reply_photo(photo, caption=None, reply_markup=None):
+            self.photos.append((photo, caption, reply_markup))
+
+        async def edit_media(media, reply_markup=None):
+            self.edits.append((media.media, media.caption, reply_markup))
+
+        async def edit_caption(caption=None, reply_markup=None):
+            self.edits.append((None, caption, reply_markup))
+
+        async def reply_document(document, filename=None):
+            self.documents.append((document.read(), filename))
+
+        async def edit_text(text, reply_markup=None):
+            self.edits.append((text, reply_markup))
+
         async def answer():
             pass
 
         self.callback_query = types.SimpleNamespace(
             data=data,
-            message=types.SimpleNamespace(reply_text=reply),
+            message=types.SimpleNamespace(
+                reply_text=reply, reply_photo=reply_photo, reply_document=reply_document, photo=photo
+            ),
+            edit_message_text=edit_text,
+            edit_message_media=edit_media,
+            edit_message_caption=edit_caption,
             from_user=types.SimpleNamespace(id=user_id),
             answer=answer,
         )
@@ -78,11 +103,51 @@ def test_admin_pending_list():
     update = DummyCallbackUpdate(ADMIN_ID, 'admin:pending')
     context = DummyContext()
     asyncio.run(admin_callback(update, context))
-    text, markup = update.replies[0]
-    assert tr('pending_entry', 'en').format(user_id=2, product_id='p1') == text
+    assert update.replies == []
+    photo, caption, markup = update.photos[0]
+    assert photo == 'f'
+    assert caption.startswith(tr('pending_entry', 'en').format(user_id=2, product_id='p1'))
     assert markup.inline_keyboard[0][0].text == tr('approve_button', 'en')
 
 
+def test_pending_review_is_one_message():
+    data['pending'] = [
+        {'user_id': uid, 'product_id': 'p1', 'file_id': f'f{uid}'} for uid in range(2, 302)
+    ]
+    update = DummyCallbackUpdate(ADMIN_ID, 'admin:pending')
+    asyncio.run(admin_callback(update, DummyContext()))
+    assert len(update.photos) == 1
+    _, caption, markup = update.photos[0]
+    assert caption.endswith('Purchase 1/300')
+    callbacks = [btn.callback_data for row in markup.inline_keyboard for btn in row]
+    assert callbacks == ['review:approve:2:p1:0', 'review:reject:2:p1:0', 'review:page:1']
+
+
+def test_review_decision_edits_in_place():
+    data['pending'] = [
+        {'user_id': 2, 'product_id': 'p1', 'file_id': 'f2'},
+        {'user_id': 3, 'product_id': 'p1', 'file_id': 'f3'},
+    ]
+    data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': []}}
+    context = DummyContext()
+    update = DummyCallbackUpdate(ADMIN_ID, 'review:approve:2:p1:0', photo=['f2'])
+    asyncio.run(review_callback(update, context))
+    assert update.replies == [] and update.photos == []
+    photo, caption, markup = update.edits[0]
+    assert photo == 'f3'
+    assert caption.startswith(tr('approved', 'en'))
+    assert caption.endswith('Purchase 1/1')
+    assert 2 in data['products']['p1']['buyers']
+    assert context.bot.sent[0][0] == 2
+
+    update = DummyCallbackUpdate(ADMIN_ID, 'review:reject:3:p1:0', photo=['f3'])
+    asyncio.run(review_callback(update, context))
+    assert data['pending'] == []
+    _, caption, markup = update.edits[0]
+    assert caption == tr('rejected', 'en') + '\n' + tr('no_pending', 'en')
+    assert markup is None
+
+
 def test_admin_callback_approve():
     data['pending'] = [{'user_id': 2, 'product_id': 'p1', 'file_id': 'f'}]
     data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': []}}
@@ -130,8 +195,8 @@ def test_adminmenu_pending_list():
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:pending')
     context = DummyContext()
     asyncio.run(admin_menu_callback(update, context))
-    text, markup = update.replies[0]
-    assert tr('pending_entry', 'en').format(user_id=2, product_id='p1') == text
+    _, caption, markup = update.photos[0]
+    assert caption.startswith(tr('pending_entry', 'en').format(user_id=2, product_id='p1'))
     assert markup.inline_keyboard[0][0].text == tr('approve_button', 'en')
 
 
@@ -211,8 +276,9 @@ def test_buyerlist_callback_delete_button():
     context = DummyContext()
     asyncio.run(buyerlist_callback(update, context))
     text, markup = update.replies[0]
-    assert text == '2'
-    assert markup.inline_keyboard[0][0].text == tr('delete_button', 'en')
+    assert text == tr('buyers_header', 'en').format(product_id='p1', count=1)
+    assert markup.inline_keyboard[0][0].text == tr('delete_buyer_button', 'en').format(user_id=2)
+    assert markup.inline_keyboard[0][0].callback_data == 'admin:deletebuyer:p1:2'
 
 
 def test_resend_callback_list_buttons():
@@ -221,8 +287,47 @@ def test_resend_callback_list_buttons():
     context = DummyContext()
     asyncio.run(resend_callback(update, context))
     text, markup = update.replies[0]
-    assert text == '2'
+    assert len(update.replies) == 1
     assert markup.inline_keyboard[0][0].callback_data == 'adminresend:p1:2'
+    assert markup.inline_keyboard[-1][0].callback_data == 'buyersexport:p1'
+
+
+def test_buyer_view_pages_in_place():
+    data['products'] = {'p1': {'price': '1', 'buyers': list(range(100, 125))}}
+    update = DummyCallbackUpdate(ADMIN_ID, 'buyerlist:p1')
+    asyncio.run(buyerlist_callback(update, DummyContext()))
+    assert len(update.replies) == 1
+    text, markup = update.replies[0]
+    assert text.endswith('Page 1/3')
+    assert [row[0].callback_data for row in markup.inline_keyboard[:10]] == [
+        f'admin:deletebuyer:p1:{uid}' for uid in range(100, 110)
+    ]
+    assert markup.inline_keyboard[10][0].callback_data == 'buyers:delete:1:p1'
+
+    update = DummyCallbackUpdate(ADMIN_ID, 'buyers:delete:2:p1')
+    asyncio.run(buyers_page_callback(update, DummyContext()))
+    text, markup = update.edits[0]
+    assert text.endswith('Page 3/3')
+    assert [row[0].callback_data for row in markup.inline_keyboard[:5]] == [
+        f'admin:deletebuyer:p1:{uid}' for uid in range(120, 125)
+    ]
+
+
+def test_buyer_export_sends_document():
+    data['products'] = {'p1': {'price': '1', 'buyers': list(range(100, 2600))}}
+    update = DummyCallbackUpdate(ADMIN_ID, 'buyersexport:p1')
+    asyncio.run(buyers_page_callback(update, DummyContext()))
+    content, filename = update.documents[0]
+    assert filename == 'p1-buyers.txt'
+    assert content.decode().splitlines() == [str(uid) for uid in range(100, 2600)]
+
+
+def test_buyer_export_without_buyers_says_so():
+    data['products'] = {'p1': {'price': '1', 'buyers': []}}
+    update = DummyCallbackUpdate(ADMIN_ID, 'buyersexport:p1')
+    asyncio.run(buyers_page_callback(update, DummyContext()))
+    assert update.documents == []
+    assert update.replies == [(tr('no_buyers', 'en'), None)]
 
 
 def test_deleteprod_flow():
@@ -0,0 +1,100 @@
+import sys
+from pathlib import Path
+import types
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bot import catalog_callback, products, data, prefs  # noqa: E402
+from botlib.catalog import CatalogView  # noqa: E402
+
+
+class DummyCallbackUpdate:
+    def __init__(self, user_id, data_str):
+        self.edits = []
+
+        async def edit(text, reply_markup=None):
+            self.edits.append((text, reply_markup))
+
+        async def answer():
+            pass
+
+        self.callback_query = types.SimpleNamespace(
+            data=data_str,
+            edit_message_text=edit,
+            from_user=types.SimpleNamespace(id=user_id),
+            answer=answer,
+        )
+        self.effective_user = self.callback_query.from_user
+        self.message = None
+
+
+class DummyUpdate:
+    def __init__(self, user_id):
+        self.replies = []
+        self.message = types.SimpleNamespace(
+            from_user=types.SimpleNamespace(id=user_id),
+            reply_text=self._reply,
+            text='/products',
+        )
+        self.effective_user = self.message.from_user
+
+    async def _reply(self, text, reply_markup=None):
+        self.replies.append((text, reply_markup))
+
+
+class DummyContext:
+    def __init__(self):
+        self.args = []
+        self.user_data = {}
+
+
+def callbacks(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+def catalog_of(count):
+    return {f'p{i}': {'price': str(i)} for i in range(count)}
+
+
+def test_products_command_sends_one_page():
+    prefs.clear()
+    data['products'] = catalog_of(20)
+    update = DummyUpdate(42)
+    asyncio.run(products(update, DummyContext()))
+    assert len(update.replies) == 1
+    text, markup = update.replies[0]
+    buttons = callbacks(markup)
+    assert buttons[:8] == [f'buy:p{i}' for i in range(8)]
+    assert buttons[8:] == ['catalog:1', 'menu:main']
+    assert 'p8:' not in text
+    assert text.endswith('Page 1/3')
+
+
+def test_catalog_callback_edits_page_in_place():
+    prefs.clear()
+    data['products'] = catalog_of(20)
+    update = DummyCallbackUpdate(42, 'catalog:2')
+    asyncio.run(catalog_callback(update, DummyContext()))
+    text, markup = update.edits[0]
+    assert text.startswith('p16: 16')
+    assert callbacks(markup) == [f'buy:p{i}' for i in range(16, 20)] + ['catalog:1', 'menu:main']
+
+
+def test_catalog_render_cache():
+    view = CatalogView(page_size=2)
+    items = catalog_of(3)
+    first = view.render(items, 'en', 0)
+    assert view.render(items, 'en', 0) is first
+    assert view.render(items, 'fa', 0) is not first
+    # Out of range pages clamp to the last page
+    assert view.render(items, 'en', 9) is view.render(items, 'en', 1)
+    assert view.hits == 2 and view.misses == 3
+
+    items['p0']['price'] = '5'
+    view.invalidate()
+    assert view.render(items, 'en', 0)[0].startswith('p0: 5')
+    # A different products dict is never served from the old renders
+    assert view.render(catalog_of(1), 'en', 0)[0] == 'p0: 0'
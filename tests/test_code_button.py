@@ -10,7 +10,8 @@ import pyotp
 pytest.importorskip("telegram")
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
-from bot import resend, code_callback, data, ADMIN_ID  # noqa: E402
+import bot  # noqa: E402
+from bot import resend, code_callback, data, prefs, ADMIN_ID  # noqa: E402
 from botlib.translations import tr  # noqa: E402
 
 
@@ -32,7 +33,7 @@ class DummyUpdate:
         self.effective_user = self.message.from_user
         self.replies = []
 
-    async def _reply(self, text):
+    async def _reply(self, text, reply_markup=None):
         self.replies.append(text)
 
 
@@ -65,7 +66,7 @@ class DummyCallbackUpdate:
 
 def test_code_button_flow(monkeypatch):
     # Prepare product data and buyer
-    data["languages"] = {}
+    prefs.clear()
     data["products"] = {
         "p1": {
             "price": "1",
@@ -78,12 +79,17 @@ def test_code_button_flow(monkeypatch):
     # Admin resends credentials
     update = DummyUpdate(ADMIN_ID)
     context = DummyContext(["p1"])
-    asyncio.run(resend(update, context))
 
-    # Second sent message should contain code button
-    assert len(context.bot.sent) == 2
-    _, text, markup = context.bot.sent[1]
-    assert text == tr("use_code_button", "en")
+    async def run_resend():
+        await resend(update, context)
+        await bot.jobs.join("resend:p1")
+
+    asyncio.run(run_resend())
+
+    # Credentials and the code button arrive in one message
+    assert len(context.bot.sent) == 1
+    _, text, markup = context.bot.sent[0]
+    assert text.endswith(tr("use_code_button", "en"))
     assert markup.inline_keyboard[0][0].callback_data == "code:p1"
 
     # Simulate pressing the code button
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("telegram")
+
+from botlib.credentials import CredentialView  # noqa: E402
+
+
+def test_credential_view_caches_layout_not_credentials():
+    revealed = []
+
+    def reveal(value):
+        revealed.append(value)
+        return value
+
+    view = CredentialView()
+    product = {"username": "alice", "password": "s3cret"}
+    text, markup = view.render(product, "p1", "en", reveal)
+    assert text.startswith("Username: alice\nPassword: s3cret\n\n")
+    assert markup.inline_keyboard[0][0].callback_data == "code:p1"
+    again, same_markup = view.render(product, "p1", "en", reveal)
+    assert again == text
+    assert same_markup is markup
+    assert (view.hits, view.misses) == (1, 1)
+    # Credentials are revealed on every render, never cached as text
+    assert revealed == ["alice", "s3cret", "alice", "s3cret"]
+    assert all("s3cret" not in cached[0] for cached in view._cache.values())
+
+    product["password"] = "q"
+    assert "Password: q" in view.render(product, "p1", "en", reveal)[0]
+    view.invalidate("p1")
+    assert view.render(product, "p1", "en", reveal)[1] is not markup
+
+
+def test_credential_view_is_bounded():
+    view = CredentialView(cache_size=2)
+    product = {}
+    for pid in ("a", "b", "c"):
+        view.render(product, pid, "en", str)
+    view.render(product, "c", "en", str)
+    view.render(product, "a", "en", str)
+    assert (view.hits, view.misses) == (1, 4)
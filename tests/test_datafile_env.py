@@ -1,20 +1,160 @@
+import asyncio
+import json
+import runpy
 import sys
+import types
 from pathlib import Path
-import importlib
-import os
 import pytest
 
 
 pytest.importorskip("telegram")
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bot  # noqa: E402
+from botlib.config import Config  # noqa: E402
+from telegram.ext import Application, TypeHandler  # noqa: E402
+
+
+@pytest.fixture
+def restore_bot(monkeypatch):
+    """Restore the module globals other tests imported from bot."""
+    for name in ("config", "ADMIN_ID", "ADMIN_PHONE", "storage", "prefs", "sessions", "delivery", "jobs"):
+        monkeypatch.setattr(bot, name, getattr(bot, name))
 
 
 def test_data_file_env(monkeypatch, tmp_path):
     custom = tmp_path / "custom.json"
     monkeypatch.setenv("DATA_FILE", str(custom))
-    if "bot" in sys.modules:
-        del sys.modules["bot"]
-    bot = importlib.import_module("bot")
-    assert bot.DATA_FILE == custom
-    assert bot.storage.path == custom
+    config = Config.from_env()
+    assert config.data_file == custom
+    assert bot.create_storage(config).path == custom
+
+
+def test_default_data_file_follows_backend(monkeypatch):
+    monkeypatch.delenv("DATA_FILE", raising=False)
+    monkeypatch.setenv("DATA_BACKEND", "sqlite")
+    assert Config.from_env().data_file.name == "data.db"
+
+
+def test_invalid_config_exits(monkeypatch):
+    monkeypatch.setenv("SAVE_DELAY_MS", "soon")
+    with pytest.raises(SystemExit):
+        Config.from_env()
+
+
+def test_webhook_config(monkeypatch):
+    monkeypatch.setenv("WEBHOOK_URL", "https://bot.example/hook/abc")
+    monkeypatch.setenv("WEBHOOK_SECRET", "s3cret_token")
+    config = Config.from_env()
+    assert config.webhook_path == "/hook/abc"
+    assert config.webhook_secret == "s3cret_token"
+    assert config.webhook_max_connections == 40
+    monkeypatch.setenv("WEBHOOK_SECRET", "not allowed!")
+    with pytest.raises(SystemExit):
+        Config.from_env()
+
+
+def test_create_app_loads_data_in_running_loop(monkeypatch, tmp_path, restore_bot):
+    path = tmp_path / "data.json"
+    path.write_text('{"products": {"p1": {"price": "1", "buyers": [2]}}, "pending": [], "languages": {}}')
+    monkeypatch.setenv("DATA_FILE", str(path))
+
+    app = bot.create_app("123:abc", Config.from_env())
+    assert bot.storage.path == path
+    assert bot.data["products"] == {}
+    assert any(isinstance(h, TypeHandler) for h in app.handlers[-1])
+    asyncio.run(app.post_init(app))
+    assert bot.data["products"]["p1"]["buyers"] == [2]
+    assert "languages" not in bot.data
+
+
+def test_script_shares_data_with_conversations(monkeypatch, tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text('{"products": {"old": {"price": "1", "buyers": []}}, "pending": []}')
+    monkeypatch.setenv("DATA_FILE", str(path))
+    monkeypatch.setattr(sys, "argv", ["bot.py", "123:abc"])
+    monkeypatch.setattr(Application, "run_polling", lambda self, *args, **kwargs: None)
+    # Run bot.py the way `python bot.py` does, without the imported copies
+    monkeypatch.delitem(sys.modules, "bot")
+    monkeypatch.delitem(sys.modules, "bot_conversations", raising=False)
+    script = types.SimpleNamespace(**runpy.run_path(str(Path(bot.__file__)), run_name="__main__"))
+    import bot_conversations
+    assert bot_conversations.data is script.data
+
+    async def add():
+        await script.load_data()
+        replies = []
+
+        async def reply(text, reply_markup=None):
+            replies.append(text)
+
+        update = types.SimpleNamespace(
+            message=types.SimpleNamespace(text="-", reply_text=reply),
+            effective_user=types.SimpleNamespace(id=1),
+        )
+        draft = {"pid": "new", "price": "2", "username": "u", "password": "p", "secret": "s"}
+        user_data = {"lang": "en", "new_product": draft}
+        await bot_conversations.addproduct_name(update, types.SimpleNamespace(user_data=user_data))
+        await script.storage.close()
+
+    asyncio.run(add())
+    assert sorted(json.loads(path.read_text())["products"]) == ["new", "old"]
+    assert sorted(script.data["products"]) == ["new", "old"]
+
+
+def test_languages_move_out_of_catalog(monkeypatch, tmp_path, restore_bot):
+    path = tmp_path / "data.json"
+    path.write_text('{"products": {}, "pending": [], "languages": {"7": "fa"}}')
+    monkeypatch.setenv("DATA_FILE", str(path))
+
+    bot.configure(Config.from_env())
+    asyncio.run(bot.load_data())
+    assert bot.user_lang(7) == "fa"
+    assert "languages" not in json.loads(path.read_text())
+    reloaded = bot.create_prefs(bot.config)
+    asyncio.run(reloaded.load())
+    assert reloaded.get_lang(7) == "fa"
+
+
+def test_languages_stay_in_catalog_until_prefs_written(monkeypatch, tmp_path, restore_bot):
+    path = tmp_path / "data.json"
+    path.write_text('{"products": {}, "pending": [], "languages": {"7": "fa"}}')
+    monkeypatch.setenv("DATA_FILE", str(path))
+
+    def unwritable(snapshot):
+        raise OSError("disk full")
+
+    bot.configure(Config.from_env())
+    monkeypatch.setattr(bot.prefs, "_write", unwritable)
+    asyncio.run(bot.load_data())
+    assert bot.data["languages"] == {"7": "fa"}
+    assert json.loads(path.read_text())["languages"] == {"7": "fa"}
+
+
+def test_outbox_drained_after_restart(monkeypatch, tmp_path, restore_bot):
+    path = tmp_path / "data.json"
+    monkeypatch.setenv("DATA_FILE", str(path))
+    bot.configure(Config.from_env())
+    bot.data["products"]["p1"] = {"price": "1", "username": "u", "password": "p", "buyers": [2]}
+    bot.data["outbox"] = {
+        "2:p1:credentials": {"user_id": 2, "product_id": "p1", "event": "credentials", "lang": "en"}
+    }
+    asyncio.run(bot.storage.save(bot.data))
+
+    class DummyBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, uid, text, **kwargs):
+            self.sent.append((uid, text))
+
+    async def restart(app):
+        await bot.load_data(app)
+        await bot.jobs.join("outbox")
+
+    bot.configure(Config.from_env())
+    app = types.SimpleNamespace(bot=DummyBot())
+    asyncio.run(restart(app))
+    assert [uid for uid, _ in app.bot.sent] == [2]
+    assert bot.data["outbox"] == {}
+    assert json.loads(path.read_text())["outbox"] == {}
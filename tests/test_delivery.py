@@ -0,0 +1,94 @@
+import sys
+from pathlib import Path
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from telegram.error import Forbidden, NetworkError, RetryAfter  # noqa: E402
+from botlib.delivery import Delivery, TokenBucket  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class FlakyBot:
+    def __init__(self, clock, errors=()):
+        self.clock = clock
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((self.clock.now, chat_id, text))
+
+
+def make_delivery(clock, **kwargs):
+    return Delivery(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket_spaces_reservations():
+    clock = FakeClock()
+    bucket = TokenBucket(2.0, 2, clock)
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    clock.now = 10
+    assert bucket.idle()
+
+
+def test_one_chat_is_limited_to_one_message_per_second():
+    clock = FakeClock()
+    bot = FlakyBot(clock)
+    delivery = make_delivery(clock)
+    messages = [(str(i), {}) for i in range(6)]
+    assert asyncio.run(delivery.send_all(bot, 7, messages))
+    times = [t for t, _, _ in bot.sent]
+    # A burst of three, then one per second
+    assert times == [0.0, 0.0, 0.0, 1.0, 2.0, 3.0]
+
+
+def test_retry_after_pauses_and_retries():
+    clock = FakeClock()
+    bot = FlakyBot(clock, [RetryAfter(5)])
+    delivery = make_delivery(clock)
+    assert asyncio.run(delivery.send(bot, 7, 'hi'))
+    assert bot.sent == [(5.0, 7, 'hi')]
+
+
+def test_network_errors_back_off_then_give_up():
+    clock = FakeClock()
+    bot = FlakyBot(clock, [NetworkError('down')] * 5)
+    delivery = make_delivery(clock, retries=2, backoff=1.0)
+    assert not asyncio.run(delivery.send(bot, 7, 'hi'))
+    assert 1.0 in clock.sleeps and 2.0 in clock.sleeps
+    assert len(bot.errors) == 2
+
+
+def test_broadcast_reports_failures():
+    clock = FakeClock()
+
+    class BlockedBot(FlakyBot):
+        async def send_message(self, chat_id, text, **kwargs):
+            if chat_id % 10 == 0:
+                raise Forbidden('blocked')
+            await super().send_message(chat_id, text, **kwargs)
+
+    bot = BlockedBot(clock)
+    delivery = make_delivery(clock, rate=25.0)
+    report = asyncio.run(delivery.broadcast(bot, range(1, 101), [('a', {}), ('b', {})]))
+    assert report.sent == 90
+    assert sorted(report.failed) == list(range(10, 101, 10))
+    assert len(bot.sent) == 180
+    # 190 attempts at 25 per second after the initial burst
+    assert clock.now == pytest.approx((190 - 25) / 25, abs=0.1)
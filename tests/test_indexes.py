@@ -0,0 +1,78 @@
+from array import array
+
+import pytest
+
+from botlib.indexes import BuyerSet, PendingQueue, buyers_of, pending_of
+
+
+def test_buyer_set_keeps_insertion_order():
+    buyers = BuyerSet([5, 3])
+    buyers.append(9)
+    buyers.append(3)
+    assert list(buyers) == [5, 3, 9]
+    assert buyers == [5, 3, 9]
+    assert 9 in buyers and 4 not in buyers
+    assert len(buyers) == 3
+
+
+def test_buyer_set_remove_and_discard():
+    buyers = BuyerSet([1, 2])
+    buyers.remove(1)
+    with pytest.raises(ValueError):
+        buyers.remove(1)
+    assert buyers.discard(2)
+    assert not buyers.discard(2)
+    assert buyers == []
+    assert not buyers
+
+
+def test_buyer_set_to_array():
+    assert BuyerSet([2, 1]).to_array() == array("q", [2, 1])
+    # Ids outside int64 fall back to a list
+    assert BuyerSet([2 ** 70]).to_array() == [2 ** 70]
+
+
+def test_buyers_of_upgrades_list_in_place():
+    product = {"buyers": [4, 2]}
+    buyers = buyers_of(product)
+    assert isinstance(product["buyers"], BuyerSet)
+    assert buyers_of(product) is buyers
+    assert buyers == [4, 2]
+
+    product = {}
+    buyers_of(product).append(1)
+    assert product == {"buyers": [1]}
+
+
+def test_pending_queue_keyed_lookup():
+    pending = PendingQueue([
+        {"user_id": 1, "product_id": "p1", "file_id": "a"},
+        {"user_id": 2, "product_id": "p1", "file_id": "b"},
+    ])
+    assert pending.add(3, "p2", "c")
+    assert (2, "p1") in pending
+    assert pending.pop(2, "p1")["file_id"] == "b"
+    assert pending.pop(2, "p1") is None
+    assert [p["user_id"] for p in pending] == [1, 3]
+    assert pending.at(1)["user_id"] == 3
+    assert pending.at(2) is None and pending.at(-1) is None
+
+
+def test_pending_queue_merges_duplicate_proofs():
+    pending = PendingQueue([
+        {"user_id": 1, "product_id": "p1", "file_id": "a"},
+        {"user_id": 1, "product_id": "p1", "file_id": "b"},
+    ])
+    assert not pending.add(1, "p1", "c")
+    assert len(pending) == 1
+    assert pending.get(1, "p1") == {
+        "user_id": 1, "product_id": "p1", "file_id": "a", "file_ids": ["a", "b", "c"]
+    }
+
+
+def test_pending_of_upgrades_list_in_place():
+    data = {"pending": [{"user_id": 1, "product_id": "p1", "file_id": "a"}]}
+    pending = pending_of(data)
+    assert isinstance(data["pending"], PendingQueue)
+    assert pending_of(data) is pending
+    assert pending == [{"user_id": 1, "product_id": "p1", "file_id": "a"}]
@@ -0,0 +1,158 @@
+import asyncio
+import sys
+import types
+from pathlib import Path
+import pytest
+
+pytest.importorskip("telegram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bot  # noqa: E402
+from bot import data  # noqa: E402
+from botlib.locks import LockManager, UserSerializer  # noqa: E402
+
+
+def test_same_key_serializes_and_is_forgotten():
+    locks = LockManager()
+    events = []
+
+    async def worker(name, key):
+        async with locks.hold(key):
+            events.append(f"{name} in")
+            await asyncio.sleep(0)
+            events.append(f"{name} out")
+
+    async def run():
+        await asyncio.gather(worker("a", ("product", "p1")), worker("b", ("product", "p1")))
+        assert len(locks) == 0
+        await asyncio.gather(worker("c", ("product", "p1")), worker("d", ("product", "p2")))
+
+    asyncio.run(run())
+    assert events[:4] == ["a in", "a out", "b in", "b out"]
+    assert events[4:6] == ["c in", "d in"]
+
+
+def test_several_keys_do_not_deadlock():
+    locks = LockManager()
+    order = []
+
+    async def worker(name, *keys):
+        for _ in range(20):
+            async with locks.hold(*keys):
+                await asyncio.sleep(0)
+        order.append(name)
+
+    async def run():
+        await asyncio.wait_for(
+            asyncio.gather(worker("a", "x", "y"), worker("b", "y", "x")), timeout=5
+        )
+
+    asyncio.run(run())
+    assert sorted(order) == ["a", "b"]
+
+
+def test_updates_of_one_user_run_in_order():
+    processor = UserSerializer(LockManager(), max_concurrent_updates=8)
+    running = {1: 0, 2: 0}
+    overlap = []
+
+    async def handle(uid):
+        running[uid] += 1
+        overlap.append(sum(running.values()))
+        assert running[uid] == 1
+        await asyncio.sleep(0.01)
+        running[uid] -= 1
+
+    def update(uid):
+        return types.SimpleNamespace(effective_user=types.SimpleNamespace(id=uid))
+
+    async def run():
+        await asyncio.gather(*(
+            processor.process_update(update(uid), handle(uid)) for uid in (1, 2, 1, 2, 1, 2)
+        ))
+
+    asyncio.run(run())
+    # The other user's update ran alongside, never a second one of the same user
+    assert max(overlap) == 2
+
+
+def test_queued_updates_of_one_user_hold_no_slot():
+    processor = UserSerializer(LockManager(), max_concurrent_updates=2)
+    finished = []
+
+    async def handle(uid, n, delay):
+        await asyncio.sleep(delay)
+        finished.append((uid, n))
+
+    def update(uid):
+        return types.SimpleNamespace(effective_user=types.SimpleNamespace(id=uid))
+
+    async def run():
+        busy = [
+            asyncio.ensure_future(processor.process_update(update(1), handle(1, n, 0.05)))
+            for n in range(4)
+        ]
+        await asyncio.sleep(0)
+        await processor.process_update(update(2), handle(2, 0, 0))
+        assert finished == [(2, 0)]
+        await asyncio.gather(*busy)
+
+    asyncio.run(run())
+    assert finished[1:] == [(1, n) for n in range(4)]
+
+
+class SlowBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, uid, text, *args, **kwargs):
+        await asyncio.sleep(0)
+        self.sent.append(uid)
+
+
+def test_concurrent_decisions_never_double_apply():
+    users = list(range(100, 130))
+    data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': []}}
+    data['pending'] = [{'user_id': uid, 'product_id': 'p1', 'file_id': 'f'} for uid in users]
+    data['outbox'] = {}
+    context = types.SimpleNamespace(bot=SlowBot())
+    decisions = [(uid, approve_it) for uid in users for approve_it in (True, False, True, True)]
+
+    async def run():
+        settled = asyncio.gather(*(
+            bot.settle_purchase(context, uid, 'p1', approve_it, 'en') for uid, approve_it in decisions
+        ))
+        # Drains racing the approvals must not send an entry a second time
+        drains = asyncio.gather(*(bot.drain_outbox(context.bot) for _ in range(3)))
+        return await settled, await drains
+
+    outcomes, _ = asyncio.run(run())
+    by_user = {}
+    for (uid, _), outcome in zip(decisions, outcomes):
+        by_user.setdefault(uid, []).append(outcome)
+    buyers = list(data['products']['p1']['buyers'])
+    assert data['pending'] == []
+    assert data['outbox'] == {}
+    assert len(buyers) == len(set(buyers))
+    for uid, results in by_user.items():
+        decided = [r for r in results if r is not None]
+        assert len(decided) == 1
+        approved = decided[0] == 'approved'
+        assert (uid in buyers) == approved
+        assert context.bot.sent.count(uid) == (1 if approved else 0)
+    assert len(bot.locks) == 0
+
+
+def test_admin_edits_wait_for_product_lock():
+    data['products'] = {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's', 'buyers': [5]}}
+
+    async def run():
+        async with bot.locks.hold(('product', 'p1')):
+            removal = asyncio.ensure_future(bot.remove_buyers('p1', 5))
+            await asyncio.sleep(0)
+            assert not removal.done()
+            assert 5 in data['products']['p1']['buyers']
+        return await removal
+
+    assert asyncio.run(run()) is True
+    assert 5 not in data['products']['p1']['buyers']
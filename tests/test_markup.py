@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+import pytest
+
+pytest.importorskip("telegram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bot  # noqa: E402
+from botlib.markup import MarkupCache  # noqa: E402
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+
+def make_cache(size=16):
+    cache = MarkupCache(size)
+    built = []
+
+    @cache.memoize
+    def menu(lang):
+        built.append(lang)
+        return InlineKeyboardMarkup([[InlineKeyboardButton(lang, callback_data='menu:main')]])
+
+    @cache.memoize_product
+    def product_menu(pid, lang):
+        built.append((pid, lang))
+        return InlineKeyboardMarkup([[InlineKeyboardButton(pid, callback_data=f'buy:{pid}')]])
+
+    return cache, built, menu, product_menu
+
+
+def test_markup_built_once_per_arguments():
+    cache, built, menu, _ = make_cache()
+    first = menu('en')
+    assert menu('en') is first
+    assert menu('fa') is not first
+    assert built == ['en', 'fa']
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.hit_rate() == pytest.approx(1 / 3)
+
+
+def test_product_change_drops_only_its_markups():
+    cache, built, menu, product_menu = make_cache()
+    menu('en')
+    product_menu('p1', 'en')
+    product_menu('p1', 'fa')
+    product_menu('p2', 'en')
+    cache.invalidate('p1')
+    assert len(cache) == 2
+    menu('en')
+    product_menu('p2', 'en')
+    product_menu('p1', 'en')
+    assert built[-1] == ('p1', 'en')
+    assert built.count(('p1', 'en')) == 2
+    assert built.count('en') == 1
+
+
+def test_least_recently_used_markup_evicted():
+    cache, built, menu, product_menu = make_cache(size=2)
+    product_menu('p1', 'en')
+    menu('en')
+    menu('fa')
+    assert len(cache) == 2
+    cache.invalidate('p1')
+    assert len(cache) == 2
+    product_menu('p1', 'en')
+    assert built.count(('p1', 'en')) == 2
+
+
+def test_menus_shared_and_invalidated_with_catalog():
+    assert bot.build_main_menu('en', True) is bot.build_main_menu('en', True)
+    assert bot.build_main_menu('en', False) is not bot.build_main_menu('en', True)
+    hits = bot.markups.hits
+    bot.build_back_menu('fa')
+    bot.build_back_menu('fa')
+    assert bot.markups.hits >= hits + 1
+    fields = bot.build_field_menu('p9')
+    menu = bot.build_admin_menu('en')
+    bot.products_changed('p9')
+    assert bot.build_field_menu('p9') is not fields
+    assert bot.build_admin_menu('en') is menu
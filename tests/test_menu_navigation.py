@@ -14,6 +14,7 @@ from bot import (  # noqa: E402
     admin_menu_callback,
     language_menu_callback,
     data,
+    prefs,
     ADMIN_ID,
 )
 import bot_conversations  # noqa: E402
@@ -56,25 +57,26 @@ class DummyContext:
 
 
 def test_products_submenu():
-    data['languages'] = {}
+    prefs.clear()
     data['products'] = {
         'p1': {'price': '1', 'username': 'u', 'password': 'p', 'secret': 's'}
     }
     update = DummyCallbackUpdate(42, 'menu:products')
     context = DummyContext()
     asyncio.run(menu_callback(update, context))
-    # First reply should contain product info with buy button
+    # A single catalog message with a buy button per product
+    assert len(update.replies) == 1
     text, markup = update.replies[0]
     assert text.startswith('p1: 1')
     assert markup.inline_keyboard[0][0].callback_data == 'buy:p1'
-    # Last reply is back button
-    back_text, back_markup = update.replies[-1]
-    assert back_text == tr('menu_back', 'en')
-    assert back_markup.inline_keyboard[0][0].callback_data == 'menu:main'
+    # The last row is the back button
+    back = markup.inline_keyboard[-1][0]
+    assert back.text == tr('menu_back', 'en')
+    assert back.callback_data == 'menu:main'
 
 
 def test_contact_submenu():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'menu:contact')
     context = DummyContext()
     asyncio.run(menu_callback(update, context))
@@ -84,7 +86,7 @@ def test_contact_submenu():
 
 
 def test_help_submenu():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'menu:help')
     context = DummyContext()
     asyncio.run(menu_callback(update, context))
@@ -94,7 +96,7 @@ def test_help_submenu():
 
 
 def test_back_to_main_menu():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'menu:main')
     context = DummyContext()
     asyncio.run(menu_callback(update, context))
@@ -109,7 +111,7 @@ def test_back_to_main_menu():
 
 
 def test_language_menu_buttons():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'menu:language')
     context = DummyContext()
     asyncio.run(language_menu_callback(update, context))
@@ -122,12 +124,12 @@ def test_language_menu_buttons():
 
 
 def test_language_selection_changes_data():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'language:fa')
     context = DummyContext()
     asyncio.run(language_menu_callback(update, context))
     assert context.user_data['lang'] == 'fa'
-    assert data['languages']['42'] == 'fa'
+    assert prefs.get_lang(42) == 'fa'
     text, markup = update.replies[0]
     assert text == tr('language_set', 'fa')
     buttons = [btn.callback_data for row in markup.inline_keyboard for btn in row]
@@ -135,7 +137,7 @@ def test_language_selection_changes_data():
 
 
 def test_admin_menu_requires_admin():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'menu:admin')
     context = DummyContext()
     asyncio.run(menu_callback(update, context))
@@ -145,7 +147,7 @@ def test_admin_menu_requires_admin():
 
 
 def test_admin_menu_for_admin():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(ADMIN_ID, 'menu:admin')
     context = DummyContext()
     asyncio.run(menu_callback(update, context))
@@ -158,7 +160,7 @@ def test_admin_menu_for_admin():
 
 
 def test_manage_products_submenu():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:manage')
     context = DummyContext()
     asyncio.run(admin_menu_callback(update, context))
@@ -178,7 +180,7 @@ def test_manage_products_submenu():
 
 
 def test_adminmenu_addproduct_starts_conversation():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:addproduct')
     context = DummyContext()
     state = asyncio.run(bot_conversations.addproduct_menu(update, context))
@@ -188,7 +190,7 @@ def test_adminmenu_addproduct_starts_conversation():
 
 
 def test_adminmenu_editproduct_usage():
-    data['languages'] = {}
+    prefs.clear()
     data['products'] = {'p1': {'price': '1'}}
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:editproduct')
     context = DummyContext()
@@ -206,7 +208,7 @@ def test_adminmenu_editproduct_usage():
 
 
 def test_adminmenu_deleteproduct_buttons():
-    data['languages'] = {}
+    prefs.clear()
     data['products'] = {'p1': {'price': '1'}}
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:deleteproduct')
     context = DummyContext()
@@ -225,7 +227,7 @@ def test_adminmenu_deleteproduct_buttons():
 
 
 def test_adminmenu_stats_usage():
-    data['languages'] = {}
+    prefs.clear()
     data['products'] = {'p1': {'price': '1'}}
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:stats')
     context = DummyContext()
@@ -243,7 +245,7 @@ def test_adminmenu_stats_usage():
 
 
 def test_adminmenu_buyers_usage():
-    data['languages'] = {}
+    prefs.clear()
     data['products'] = {'p1': {'price': '1'}}
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:buyers')
     context = DummyContext()
@@ -262,7 +264,7 @@ def test_adminmenu_buyers_usage():
 
 
 def test_adminmenu_clearbuyers_usage():
-    data['languages'] = {}
+    prefs.clear()
     data['products'] = {'p1': {'price': '1'}}
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:clearbuyers')
     context = DummyContext()
@@ -280,7 +282,7 @@ def test_adminmenu_clearbuyers_usage():
 
 
 def test_adminmenu_resend_usage():
-    data['languages'] = {}
+    prefs.clear()
     data['products'] = {'p1': {'price': '1'}}
     update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:resend')
     context = DummyContext()
@@ -299,7 +301,7 @@ def test_adminmenu_resend_usage():
 
 
 def test_adminmenu_resend_requires_admin():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'adminmenu:resend')
     context = DummyContext()
     asyncio.run(admin_menu_callback(update, context))
@@ -308,7 +310,7 @@ def test_adminmenu_resend_requires_admin():
 
 
 def test_adminmenu_deleteproduct_requires_admin():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'adminmenu:deleteproduct')
     context = DummyContext()
     asyncio.run(admin_menu_callback(update, context))
@@ -317,10 +319,10 @@ def test_adminmenu_deleteproduct_requires_admin():
 
 
 def test_language_menu_invalid_selection():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyCallbackUpdate(42, 'language:zz')
     context = DummyContext()
     asyncio.run(language_menu_callback(update, context))
     assert context.user_data['lang'] == 'en'
-    assert '42' not in data.get('languages', {})
+    assert 42 not in prefs.languages
     assert update.replies == []
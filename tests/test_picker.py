@@ -0,0 +1,145 @@
+import sys
+from pathlib import Path
+import types
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bot import (  # noqa: E402
+    admin_menu_callback,
+    handle_edit_value,
+    picker_callback,
+    data,
+    prefs,
+    ADMIN_ID,
+)
+from botlib.picker import ProductIndex, render_picker  # noqa: E402
+
+
+class DummyCallbackUpdate:
+    def __init__(self, user_id, data_str):
+        self.replies = []
+        self.edits = []
+
+        async def reply(text, reply_markup=None):
+            self.replies.append((text, reply_markup))
+
+        async def edit(text, reply_markup=None):
+            self.edits.append((text, reply_markup))
+
+        async def answer():
+            pass
+
+        self.callback_query = types.SimpleNamespace(
+            data=data_str,
+            message=types.SimpleNamespace(reply_text=reply),
+            edit_message_text=edit,
+            from_user=types.SimpleNamespace(id=user_id),
+            answer=answer,
+        )
+        self.effective_user = self.callback_query.from_user
+        self.message = None
+
+
+class DummyUpdate:
+    def __init__(self, user_id, text):
+        self.replies = []
+        self.message = types.SimpleNamespace(
+            from_user=types.SimpleNamespace(id=user_id),
+            reply_text=self._reply,
+            text=text,
+        )
+        self.effective_user = self.message.from_user
+
+    async def _reply(self, text, reply_markup=None):
+        self.replies.append((text, reply_markup))
+
+
+class DummyContext:
+    def __init__(self):
+        self.args = []
+        self.user_data = {}
+
+
+def callbacks(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+def catalog_of(count):
+    return {f'p{i:02d}': {'price': str(i)} for i in range(count)}
+
+
+def test_picker_pages_sorted_ids():
+    prefs.clear()
+    data['products'] = catalog_of(20)
+    update = DummyCallbackUpdate(ADMIN_ID, 'adminmenu:deleteproduct')
+    asyncio.run(admin_menu_callback(update, DummyContext()))
+    text, markup = update.replies[0]
+    buttons = callbacks(markup)
+    assert buttons[:8] == [f'delprod:p{i:02d}' for i in range(8)]
+    assert buttons[8:] == ['pick:delete:1:', 'picksearch:delete', 'adminmenu:manage']
+    assert text.endswith('Page 1/3')
+
+    update = DummyCallbackUpdate(ADMIN_ID, 'pick:delete:2:')
+    asyncio.run(picker_callback(update, DummyContext()))
+    assert update.replies == []
+    text, markup = update.edits[0]
+    buttons = callbacks(markup)
+    assert buttons[:4] == [f'delprod:p{i:02d}' for i in range(16, 20)]
+    assert buttons[4:] == ['pick:delete:1:', 'picksearch:delete', 'adminmenu:manage']
+    assert text.endswith('Page 3/3')
+
+
+def test_picker_prefix_search():
+    prefs.clear()
+    data['products'] = catalog_of(20)
+    context = DummyContext()
+    update = DummyCallbackUpdate(ADMIN_ID, 'picksearch:buyers')
+    asyncio.run(picker_callback(update, context))
+    assert context.user_data['pick_search'] == 'buyers'
+
+    update = DummyUpdate(ADMIN_ID, 'p1')
+    asyncio.run(handle_edit_value(update, context))
+    assert 'pick_search' not in context.user_data
+    text, markup = update.replies[0]
+    buttons = callbacks(markup)
+    assert buttons[:8] == [f'buyerlist:p{i}' for i in range(10, 18)]
+    assert buttons[8:] == ['pick:buyers:1:p1', 'picksearch:buyers', 'adminmenu:manage']
+    assert 'p1' in text
+
+    update = DummyUpdate(ADMIN_ID, 'zz')
+    context.user_data['pick_search'] = 'buyers'
+    asyncio.run(handle_edit_value(update, context))
+    assert callbacks(update.replies[0][1]) == ['adminmenu:manage']
+
+
+def test_picker_rejects_non_admin():
+    data['products'] = catalog_of(3)
+    update = DummyCallbackUpdate(ADMIN_ID + 1, 'pick:delete:0:')
+    asyncio.run(picker_callback(update, DummyContext()))
+    assert update.edits == []
+
+
+def test_product_index_rebuilds_only_when_invalidated():
+    products = catalog_of(3)
+    index = ProductIndex()
+    ids = index.ids(products)
+    products['a'] = {'price': '1'}
+    assert index.ids(products) is ids
+    index.invalidate()
+    assert index.ids(products)[0] == 'a'
+    assert index.span(products, 'p0') == (1, 4)
+    assert render_picker(index, products, 'edit', 'en', prefix='x') is None
+
+
+def test_long_multibyte_prefix_fits_callback_data():
+    prefix = '\U0001f511' * 20
+    products = {prefix + str(i): {'price': '1'} for i in range(20)}
+    text, markup = render_picker(ProductIndex(), products, 'clearbuyers', 'en', prefix=prefix)
+    callbacks = [button.callback_data for row in markup.inline_keyboard for button in row]
+    nav = [data for data in callbacks if data.startswith('pick:')]
+    assert nav
+    assert all(len(data.encode()) <= 64 for data in nav)
+    assert all(prefix.startswith(data.split(':', 3)[3]) for data in nav)
@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from botlib.prefs import MIN_OVERLAY, LanguageMap, PreferenceStore
+
+
+def test_language_changes_coalesce_into_one_write(tmp_path):
+    path = tmp_path / "prefs.json"
+    prefs = PreferenceStore(path, delay=0.05)
+
+    async def run():
+        await prefs.load()
+        for uid in range(5):
+            await prefs.set_lang(uid, "fa")
+        assert not path.exists()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert prefs.flushes == 1
+    assert set(json.loads(path.read_text())) == {"codes", "ids", "langs"}
+
+
+def test_preferences_reload_and_keep_newer_choices(tmp_path):
+    path = tmp_path / "prefs.json"
+
+    async def run():
+        prefs = PreferenceStore(path, delay=0)
+        await prefs.set_lang(1, "fa")
+        await prefs.update({"1": "en", "2": "en"})
+        await prefs.close()
+        reloaded = PreferenceStore(path)
+        await reloaded.load()
+        return reloaded
+
+    reloaded = asyncio.run(run())
+    assert reloaded.get_lang(1) == "fa"
+    assert reloaded.get_lang(2) == "en"
+    assert reloaded.get_lang(3) == "en"
+    assert reloaded.get_lang(3, "fa") == "fa"
+
+
+def test_legacy_preferences_file_is_read(tmp_path):
+    path = tmp_path / "prefs.json"
+    path.write_text('{"languages": {"5": "fa", "3": "en"}}')
+    prefs = PreferenceStore(path)
+    asyncio.run(prefs.load())
+    assert prefs.get_lang(5) == "fa"
+    assert list(prefs.languages.items()) == [(3, "en"), (5, "fa")]
+
+
+def test_language_map_overlay_merges_in_order():
+    languages = LanguageMap()
+    for uid in range(MIN_OVERLAY * 3, 0, -1):
+        languages[uid] = "fa" if uid % 2 else "en"
+    languages[7] = "de"
+    assert len(languages) == MIN_OVERLAY * 3
+    assert languages.get(7) == "de"
+    assert languages.get(8) == "en"
+    assert languages.get(0) is None
+    assert "8" not in languages
+    ids = [uid for uid, _ in languages.items()]
+    assert ids == sorted(ids)
+
+    restored = LanguageMap.load(languages.dump())
+    assert list(restored.items()) == list(languages.items())
@@ -63,7 +63,9 @@ def test_resend_callback_sends_credentials():
 
     # Admin should get confirmation
     assert update.replies[0][0] == tr("credentials_resent", "en")
-    # Two messages sent to the buyer
-    assert len(context.bot.sent) == 2
-    assert context.bot.sent[0][0] == 2
-    assert context.bot.sent[1][0] == 2
+    # One message with the credentials and code button sent to the buyer
+    assert len(context.bot.sent) == 1
+    uid, text, markup = context.bot.sent[0]
+    assert uid == 2
+    assert text.startswith(tr("credentials_msg", "en").format(username="u", password="p"))
+    assert markup.inline_keyboard[0][0].callback_data == "code:p1"
@@ -0,0 +1,175 @@
+import sys
+from pathlib import Path
+import types
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bot  # noqa: E402
+from bot import resend, resend_job_callback, run_resend, data, storage, ADMIN_ID  # noqa: E402
+from botlib.translations import tr  # noqa: E402
+
+
+class DummyBot:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.sent = []
+        self.edits = []
+
+    async def send_message(self, uid, text, *args, **kwargs):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(uid)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None):
+        self.edits.append((text, reply_markup))
+
+
+class DummyUpdate:
+    def __init__(self, user_id):
+        self.replies = []
+        self.message = types.SimpleNamespace(
+            from_user=types.SimpleNamespace(id=user_id),
+            reply_text=self._reply,
+            text='/resend',
+        )
+        self.effective_user = self.message.from_user
+
+    async def _reply(self, text, reply_markup=None):
+        self.replies.append((text, reply_markup))
+        return types.SimpleNamespace(chat_id=ADMIN_ID, message_id=len(self.replies))
+
+
+class DummyCallbackUpdate:
+    def __init__(self, user_id, data_str):
+        self.edits = []
+
+        async def edit(text, reply_markup=None):
+            self.edits.append(text)
+
+        async def answer():
+            pass
+
+        self.callback_query = types.SimpleNamespace(
+            data=data_str,
+            edit_message_text=edit,
+            from_user=types.SimpleNamespace(id=user_id),
+            answer=answer,
+        )
+        self.effective_user = self.callback_query.from_user
+        self.message = None
+
+
+class DummyContext:
+    def __init__(self, args=None, bot_=None):
+        self.args = args or []
+        self.user_data = {}
+        self.bot = bot_ or DummyBot()
+
+
+@pytest.fixture(autouse=True)
+def no_save(monkeypatch):
+    async def dummy_save(_data):
+        pass
+
+    monkeypatch.setattr(storage, 'save', dummy_save)
+    monkeypatch.setattr(bot, 'RESEND_BATCH', 100)
+    monkeypatch.setattr(bot, 'RESEND_PROGRESS_INTERVAL', 0)
+
+
+def product_with_buyers(count):
+    return {'p1': {'price': '1', 'username': 'u', 'password': 'p', 'buyers': list(range(1000, 1000 + count))}}
+
+
+def test_resend_reports_progress_in_one_message():
+    data['products'] = product_with_buyers(250)
+    update = DummyUpdate(ADMIN_ID)
+    context = DummyContext(['p1'])
+
+    async def run():
+        await resend(update, context)
+        await bot.jobs.join('resend:p1')
+
+    asyncio.run(run())
+    assert len(update.replies) == 1
+    assert sorted(context.bot.sent) == list(range(1000, 1250))
+    texts = [text for text, _ in context.bot.edits]
+    assert texts[:2] == [
+        'Resending p1: 100 sent, 0 failed, 150 left',
+        'Resending p1: 200 sent, 0 failed, 50 left',
+    ]
+    assert texts[-1] == tr('resend_report', 'en').format(sent=250, total=250)
+    assert 'p1' not in data['resends']
+
+
+def test_resend_resumes_from_checkpoint():
+    data['products'] = product_with_buyers(5)
+    data['resends'] = {
+        'p1': {'lang': 'en', 'position': 3, 'total': 5, 'sent': 3, 'failed': [], 'message_id': None}
+    }
+    dummy = DummyBot()
+
+    async def run():
+        bot.jobs.start('resend:p1', run_resend(dummy, 'p1'))
+        await bot.jobs.join('resend:p1')
+
+    asyncio.run(run())
+    assert dummy.sent == [1003, 1004]
+    assert data['resends'] == {}
+
+
+def test_resend_can_be_cancelled():
+    data['products'] = product_with_buyers(1000)
+    dummy = DummyBot(delay=0.001)
+    update = DummyUpdate(ADMIN_ID)
+
+    async def run():
+        await resend(update, DummyContext(['p1'], dummy))
+        second = DummyUpdate(ADMIN_ID)
+        await resend(second, DummyContext(['p1'], dummy))
+        assert second.replies[0][0] == tr('resend_running', 'en').format(product_id='p1')
+        await asyncio.sleep(0.05)
+        cancel = DummyCallbackUpdate(ADMIN_ID, 'resendcancel:p1')
+        await resend_job_callback(cancel, DummyContext())
+        return cancel
+
+    cancel = asyncio.run(run())
+    assert 'resend:p1' not in bot.jobs
+    assert 'p1' not in data['resends']
+    assert len(dummy.sent) < 1000
+    assert cancel.edits[0].startswith('Resend of p1 cancelled')
+
+
+def test_resend_skips_no_buyer_removed_meanwhile(monkeypatch):
+    monkeypatch.setattr(bot, 'RESEND_BATCH', 10)
+    data['products'] = product_with_buyers(30)
+    data['resends'] = {
+        'p1': {'lang': 'en', 'position': 0, 'total': 30, 'sent': 0, 'failed': [], 'message_id': None}
+    }
+
+    class RemovingBot(DummyBot):
+        async def send_message(self, uid, text, *args, **kwargs):
+            self.sent.append(uid)
+            if uid == 1015:
+                # Two buyers already handled and one of the batch being sent
+                for gone in (1000, 1001, 1018):
+                    await bot.remove_buyers('p1', gone)
+
+    dummy = RemovingBot()
+
+    async def run():
+        bot.jobs.start('resend:p1', run_resend(dummy, 'p1'))
+        await bot.jobs.join('resend:p1')
+
+    asyncio.run(run())
+    assert len(dummy.sent) == len(set(dummy.sent))
+    assert set(data['products']['p1']['buyers']) <= set(dummy.sent)
+
+
+def test_cancel_of_finished_resend_says_so():
+    data['resends'] = {}
+    cancel = DummyCallbackUpdate(ADMIN_ID, 'resendcancel:p1')
+    asyncio.run(resend_job_callback(cancel, DummyContext()))
+    assert cancel.edits == [tr('resend_not_running', 'en').format(product_id='p1')]
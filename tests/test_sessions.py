@@ -0,0 +1,79 @@
+import asyncio
+import types
+
+from botlib.sessions import SessionEvictor
+
+
+class DummyApplication:
+    def __init__(self):
+        self.user_data = {}
+
+    def drop_user_data(self, user_id):
+        self.user_data.pop(user_id, None)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_idle_users_expire_after_ttl():
+    app = DummyApplication()
+    clock = Clock()
+    sessions = SessionEvictor(max_users=0, ttl=60, clock=clock)
+    for uid in (1, 2):
+        app.user_data[uid] = {"lang": "fa"}
+        sessions.touch(app, uid)
+    clock.now = 45
+    sessions.touch(app, 2)
+    clock.now = 90
+    sessions.touch(app, 3)
+    assert 1 not in app.user_data
+    assert 2 in app.user_data
+    assert sessions.stats() == {"resident": 2, "evicted": 1}
+
+
+def test_least_recent_users_beyond_cap_are_dropped():
+    app = DummyApplication()
+    sessions = SessionEvictor(max_users=2, ttl=0, clock=Clock())
+    for uid in (1, 2, 1, 3):
+        app.user_data[uid] = {}
+        sessions.touch(app, uid)
+    assert sorted(app.user_data) == [1, 3]
+    assert sessions.resident == 2
+
+
+def test_handler_touches_effective_user():
+    app = DummyApplication()
+    sessions = SessionEvictor(max_users=1, ttl=0, clock=Clock())
+    app.user_data[1] = {}
+    context = types.SimpleNamespace(application=app)
+    for uid in (1, 2):
+        update = types.SimpleNamespace(effective_user=types.SimpleNamespace(id=uid))
+        asyncio.run(sessions.handler(update, context))
+    asyncio.run(sessions.handler(types.SimpleNamespace(effective_user=None), context))
+    assert 1 not in app.user_data
+    assert sessions.resident == 1
+
+
+def test_users_in_conversation_are_kept():
+    app = DummyApplication()
+    clock = Clock()
+    sessions = SessionEvictor(
+        max_users=2, ttl=60, clock=clock, keep=lambda user_data: "new_product" in user_data
+    )
+    app.user_data[1] = {"new_product": {"pid": "p1"}}
+    sessions.touch(app, 1)
+    for uid in (2, 3, 4):
+        app.user_data[uid] = {}
+        sessions.touch(app, uid)
+    assert sorted(app.user_data) == [1, 4]
+    clock.now = 100
+    sessions.touch(app, 5)
+    assert sorted(app.user_data) == [1]
+    app.user_data[1].pop("new_product")
+    sessions.touch(app, 6)
+    assert 1 not in app.user_data
@@ -8,7 +8,7 @@ import pytest
 pytest.importorskip("telegram")
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
-from bot import setlang, data  # noqa: E402
+from bot import setlang, prefs  # noqa: E402
 from botlib.translations import tr  # noqa: E402
 
 
@@ -32,20 +32,20 @@ class DummyContext:
 
 
 def test_setlang_valid():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyUpdate(42)
     context = DummyContext(['fa'])
     asyncio.run(setlang(update, context))
     assert context.user_data['lang'] == 'fa'
-    assert data['languages']['42'] == 'fa'
+    assert prefs.get_lang(42) == 'fa'
     assert update.replies == [tr('language_set', 'fa')]
 
 
 def test_setlang_invalid():
-    data['languages'] = {}
+    prefs.clear()
     update = DummyUpdate(42)
     context = DummyContext(['zz'])
     asyncio.run(setlang(update, context))
     assert context.user_data['lang'] == 'en'
-    assert '42' not in data['languages']
+    assert 42 not in prefs.languages
     assert update.replies == [tr('unsupported_language', 'en')]
@@ -0,0 +1,180 @@
+import asyncio
+import sqlite3
+
+from botlib.sqlite_storage import SQLiteStorage, import_json
+from botlib.storage import JSONStorage
+
+FERNET_KEY = b"MDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDA="
+
+
+def revealed(storage, data):
+    """Return *data* with every sealed credential decrypted."""
+    products = {
+        pid: {k: storage.cipher.reveal(v) for k, v in product.items()}
+        for pid, product in data["products"].items()
+    }
+    return {**data, "products": products}
+
+
+def sample_data():
+    return {
+        "products": {
+            "p1": {
+                "price": "1",
+                "username": "user",
+                "password": "pass",
+                "secret": "secret",
+                "name": "Name",
+                "buyers": [3, 2],
+            },
+            "p2": {"price": "2", "buyers": []},
+        },
+        "pending": [{"user_id": 5, "product_id": "p2", "file_id": "f"}],
+        "languages": {"3": "fa"},
+    }
+
+
+def test_sqlite_roundtrip_encrypts_credentials(tmp_path):
+    path = tmp_path / "data.db"
+    data = sample_data()
+
+    async def run():
+        storage = SQLiteStorage(path, FERNET_KEY)
+        await storage.save(data)
+        loaded = await storage.load()
+        await storage.close()
+        return storage, loaded
+
+    storage, loaded = asyncio.run(run())
+    assert revealed(storage, loaded) == data
+    with sqlite3.connect(path) as conn:
+        username, secret = conn.execute(
+            "SELECT username, secret FROM products WHERE pid = 'p1'"
+        ).fetchone()
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert username != "user"
+    assert secret.startswith("gAAAA")
+    assert mode == "wal"
+
+
+def test_sqlite_touched_paths_update_single_rows(tmp_path):
+    path = tmp_path / "data.db"
+    data = sample_data()
+
+    async def run():
+        storage = SQLiteStorage(path, FERNET_KEY)
+        await storage.save(data)
+        data["languages"]["7"] = "en"
+        storage.touch("languages", "7")
+        data["products"]["p2"]["buyers"].append(5)
+        data["pending"] = []
+        storage.touch("products", "p2", "buyers")
+        storage.touch("pending")
+        del data["products"]["p1"]
+        storage.touch("products", "p1")
+        await storage.save(data)
+        loaded = await storage.load()
+        await storage.close()
+        return storage, loaded
+
+    storage, loaded = asyncio.run(run())
+    assert revealed(storage, loaded) == data
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT lang FROM languages WHERE user_id = 7").fetchone() == ("en",)
+        assert conn.execute("SELECT pid, user_id FROM buyers").fetchall() == [("p2", 5)]
+        assert conn.execute("SELECT * FROM products WHERE pid = 'p1'").fetchone() is None
+
+
+def test_sqlite_single_buyers_and_pending_rows(tmp_path):
+    path = tmp_path / "data.db"
+
+    async def run():
+        storage = SQLiteStorage(path, FERNET_KEY)
+        data = sample_data()
+        await storage.save(data)
+        data = await storage.load()
+        buyers = data["products"]["p1"]["buyers"]
+        buyers.append(9)
+        storage.touch("products", "p1", "buyers", 9)
+        buyers.discard(3)
+        storage.touch("products", "p1", "buyers", 3)
+        data["pending"].add(5, "p2", "g")
+        storage.touch("pending", 5, "p2")
+        data["pending"].add(6, "p1", "h")
+        storage.touch("pending", 6, "p1")
+        await storage.save(data)
+        with sqlite3.connect(path) as conn:
+            proofs = conn.execute("SELECT rowid, user_id, file_id FROM pending ORDER BY rowid").fetchall()
+        data["pending"].pop(5, "p2")
+        storage.touch("pending", 5, "p2")
+        await storage.save(data)
+        loaded = await storage.load()
+        await storage.close()
+        return data, proofs, loaded
+
+    data, proofs, loaded = asyncio.run(run())
+    with sqlite3.connect(path) as conn:
+        buyers = conn.execute("SELECT rowid, user_id FROM buyers WHERE pid = 'p1' ORDER BY rowid").fetchall()
+    # The untouched buyer and proof keep their rows
+    assert buyers == [(2, 2), (3, 9)]
+    assert proofs == [(1, 5, "f"), (2, 5, "g"), (3, 6, "h")]
+    assert loaded["products"]["p1"]["buyers"] == [2, 9]
+    assert loaded["pending"] == data["pending"]
+
+
+def test_import_json(tmp_path):
+    json_path = tmp_path / "data.json"
+    db_path = tmp_path / "data.db"
+    data = sample_data()
+    asyncio.run(JSONStorage(json_path, FERNET_KEY).save(data))
+
+    counts = asyncio.run(import_json(json_path, db_path, FERNET_KEY))
+    assert counts == {"products": 2, "pending": 1, "languages": 1}
+
+    storage = SQLiteStorage(db_path, FERNET_KEY)
+
+    async def load():
+        loaded = await storage.load()
+        await storage.close()
+        return loaded
+
+    assert revealed(storage, asyncio.run(load())) == data
+
+
+def test_sqlite_keeps_merged_payment_proofs(tmp_path):
+    data = sample_data()
+    data["pending"] = [
+        {"user_id": 5, "product_id": "p2", "file_id": "f", "file_ids": ["f", "g"]},
+    ]
+
+    async def run():
+        storage = SQLiteStorage(tmp_path / "data.db", FERNET_KEY)
+        await storage.save(data)
+        loaded = await storage.load()
+        await storage.close()
+        return loaded
+
+    assert asyncio.run(run())["pending"] == data["pending"]
+
+
+def test_sqlite_outbox_rows(tmp_path):
+    data = sample_data()
+    entry = {"user_id": 3, "product_id": "p1", "event": "credentials", "lang": "fa", "attempts": 2}
+
+    async def run():
+        storage = SQLiteStorage(tmp_path / "data.db", FERNET_KEY)
+        await storage.save(data)
+        data["outbox"] = {"3:p1:credentials": entry}
+        storage.touch("outbox", "3:p1:credentials")
+        await storage.save(data)
+        saved = (await storage.load())["outbox"]
+        del data["outbox"]["3:p1:credentials"]
+        storage.touch("outbox", "3:p1:credentials")
+        await storage.save(data)
+        loaded = await storage.load()
+        await storage.close()
+        return saved, loaded
+
+    saved, loaded = asyncio.run(run())
+    assert saved == {"3:p1:credentials": entry}
+    assert "outbox" not in loaded
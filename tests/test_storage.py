@@ -1,11 +1,21 @@
 import json
 import asyncio
 
-from botlib.storage import JSONStorage
+from botlib.indexes import BuyerSet
+from botlib.storage import JSONStorage, Sealed, WriteBehindStorage
 
 FERNET_KEY = b"MDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDA="
 
 
+def revealed(storage, data):
+    """Return *data* with every sealed credential decrypted."""
+    products = {
+        pid: {k: storage.cipher.reveal(v) for k, v in product.items()}
+        for pid, product in data["products"].items()
+    }
+    return {**data, "products": products}
+
+
 def test_storage_encrypts_and_decrypts(tmp_path):
     path = tmp_path / "data.json"
     storage = JSONStorage(path, FERNET_KEY)
@@ -27,5 +37,369 @@ def test_storage_encrypts_and_decrypts(tmp_path):
     assert enc["username"] != "user"
     assert enc["password"] != "pass"
     assert enc["secret"].startswith("gAAAA")
+    loaded = asyncio.run(storage.load())
+    assert revealed(storage, loaded) == data
+
+
+def test_journal_appends_touched_paths(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY, journal=True)
+    data = {
+        "products": {
+            "p1": {"price": "1", "username": "user", "password": "pass", "secret": "s", "buyers": []}
+        },
+        "pending": [],
+        "languages": {},
+    }
+    asyncio.run(storage.save(data))
+    snapshot = path.read_text()
+
+    data["languages"]["42"] = "fa"
+    storage.touch("languages", "42")
+    data["products"]["p1"]["password"] = "new"
+    storage.touch("products", "p1", "password")
+    asyncio.run(storage.save(data))
+
+    assert path.read_text() == snapshot
+    lines = storage.journal_path.read_text().splitlines()
+    assert len(lines) == 2
+    assert "new" not in storage.journal_path.read_text()
+
+    loaded = asyncio.run(JSONStorage(path, FERNET_KEY, journal=True).load())
+    assert revealed(storage, loaded) == data
+
+
+def test_journal_replays_deletes_and_ignores_torn_record(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY, journal=True)
+    data = {"products": {"p1": {"price": "1", "buyers": []}}, "pending": [], "languages": {}}
+    asyncio.run(storage.save(data))
+    del data["products"]["p1"]
+    storage.touch("products", "p1")
+    asyncio.run(storage.save(data))
+    with open(storage.journal_path, "a") as fh:
+        fh.write('{"path": ["languages", "1"], "val')
+
     loaded = asyncio.run(storage.load())
     assert loaded == data
+
+
+def test_journal_compacts_into_snapshot(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY, journal=True, compact_every=3)
+    data = {"products": {}, "pending": [], "languages": {}}
+    for uid in range(4):
+        data["languages"][str(uid)] = "fa"
+        storage.touch("languages", str(uid))
+        asyncio.run(storage.save(data))
+
+    # The third record triggered a snapshot, the fourth went to a new journal
+    assert len(storage.journal_path.read_text().splitlines()) == 1
+    with open(path) as fh:
+        assert set(json.load(fh)["languages"]) == {"0", "1", "2"}
+    assert asyncio.run(storage.load()) == data
+
+
+def test_unchanged_credentials_reuse_ciphertext(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY)
+    data = {
+        "products": {
+            "p1": {"price": "1", "username": "user", "password": "pass", "secret": "s", "buyers": []}
+        },
+        "pending": [],
+        "languages": {},
+    }
+    asyncio.run(storage.save(data))
+    first = json.loads(path.read_text())["products"]["p1"]
+    assert storage.cipher.misses == 3
+
+    data["languages"]["42"] = "fa"
+    asyncio.run(storage.save(data))
+    second = json.loads(path.read_text())["products"]["p1"]
+    assert second == first
+    assert storage.cipher.stats()["hits"] == 3
+
+    data["products"]["p1"]["password"] = "new"
+    storage.cipher.invalidate("p1", "password")
+    asyncio.run(storage.save(data))
+    third = json.loads(path.read_text())["products"]["p1"]
+    assert third["username"] == first["username"]
+    assert third["password"] != first["password"]
+    assert storage.cipher.misses == 4
+
+
+def test_loaded_ciphertext_is_reused(tmp_path):
+    path = tmp_path / "data.json"
+    data = {"products": {"p1": {"price": "1", "username": "user", "buyers": []}}}
+    asyncio.run(JSONStorage(path, FERNET_KEY).save(data))
+    token = json.loads(path.read_text())["products"]["p1"]["username"]
+
+    storage = JSONStorage(path, FERNET_KEY)
+    loaded = asyncio.run(storage.load())
+    asyncio.run(storage.save(loaded))
+    assert json.loads(path.read_text())["products"]["p1"]["username"] == token
+    assert storage.cipher.misses == 0
+
+
+class CountingStorage:
+    path = "counting"
+
+    def __init__(self):
+        self.saves = []
+        self.closed = False
+
+    async def save(self, data):
+        self.saves.append(dict(data))
+        return True
+
+    async def close(self):
+        self.closed = True
+
+
+def test_write_behind_coalesces_burst():
+    inner = CountingStorage()
+    storage = WriteBehindStorage(inner, 0.05)
+    data = {"n": 0}
+
+    async def burst():
+        for i in range(100):
+            data["n"] = i
+            await storage.save(data)
+        assert inner.saves == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(burst())
+    assert inner.saves == [{"n": 99}]
+    assert storage.flushes == 1
+
+
+def test_write_behind_wait_and_close():
+    inner = CountingStorage()
+    storage = WriteBehindStorage(inner, 10)
+
+    async def run():
+        waiter = asyncio.ensure_future(storage.save({"a": 1}, wait=True))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await storage.save({"a": 2})
+        await storage.close()
+        assert await waiter
+
+    asyncio.run(run())
+    assert inner.saves == [{"a": 2}]
+    assert inner.closed
+
+
+def test_write_behind_waiters_see_failed_writes(tmp_path):
+    missing = tmp_path / "missing" / "data.json"
+    storage = WriteBehindStorage(JSONStorage(missing, FERNET_KEY), 10)
+
+    async def run():
+        waiter = asyncio.ensure_future(storage.save({"products": {}, "pending": []}, wait=True))
+        await asyncio.sleep(0)
+        written = await storage.flush()
+        return written, await waiter
+
+    assert asyncio.run(run()) == (False, False)
+    assert not missing.exists()
+
+
+def test_save_keeps_event_loop_responsive(tmp_path):
+    storage = JSONStorage(tmp_path / "data.json", FERNET_KEY)
+    data = {
+        "products": {
+            f"p{i}": {"price": "1", "username": f"u{i}", "password": "p", "secret": "s", "buyers": [1, 2]}
+            for i in range(2000)
+        },
+        "pending": [],
+        "languages": {str(i): "en" for i in range(10000)},
+    }
+
+    async def run():
+        ticks = 0
+        save = asyncio.ensure_future(storage.save(data))
+        while not save.done():
+            ticks += 1
+            await asyncio.sleep(0.001)
+        await save
+        await storage.close()
+        return ticks
+
+    # Fernet work for 6000 fresh credentials happens on the worker thread
+    assert asyncio.run(run()) > 5
+    loaded = asyncio.run(JSONStorage(tmp_path / "data.json", FERNET_KEY).load())
+    assert revealed(storage, loaded) == data
+
+
+def test_streamed_snapshot_is_valid_json(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY)
+    data = {
+        "products": {
+            "p\"1": {"price": "1", "username": "user", "password": "pass", "buyers": [1]},
+            "p2": {"price": "2", "buyers": []},
+        },
+        "pending": [{"user_id": 1, "product_id": "p2", "file_id": "f"}],
+        "languages": {"1": "fa"},
+        "extra": {"nested": [1, 2]},
+    }
+    asyncio.run(storage.save(data))
+    raw = json.loads(path.read_text())
+    assert raw["products"]["p\"1"]["username"].startswith("gAAAA")
+    assert raw["extra"] == {"nested": [1, 2]}
+    # The live data keeps its plaintext
+    assert data["products"]["p\"1"]["password"] == "pass"
+    assert revealed(storage, asyncio.run(storage.load())) == data
+
+
+def test_snapshot_copies_only_touched_products(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY)
+    data = {"products": {pid: {"price": "1", "password": pid, "buyers": [1]} for pid in ("p1", "p2", "p3")}}
+    asyncio.run(storage.save(data))
+    encrypted = []
+    encrypt_product = storage.cipher.encrypt_product
+
+    def counting(pid, product):
+        encrypted.append(pid)
+        return encrypt_product(pid, product)
+
+    storage.cipher.encrypt_product = counting
+    data["products"]["p2"]["price"] = "5"
+    storage.touch("products", "p2", "price")
+    data["products"]["p4"] = {"price": "4", "buyers": []}
+    storage.touch("products", "p4")
+    del data["products"]["p3"]
+    storage.touch("products", "p3")
+    asyncio.run(storage.save(data))
+    assert encrypted == ["p2", "p4"]
+    assert revealed(storage, asyncio.run(storage.load())) == data
+
+    # Saving with nothing touched copies every product again
+    asyncio.run(storage.save(data))
+    assert encrypted[2:] == ["p1", "p2", "p4"]
+
+
+def test_load_keeps_credentials_sealed_until_revealed(tmp_path):
+    path = tmp_path / "data.json"
+    data = {
+        "products": {"p1": {"price": "1", "username": "user", "password": "pass", "buyers": []}},
+        "pending": [],
+        "languages": {},
+    }
+    asyncio.run(JSONStorage(path, FERNET_KEY).save(data))
+
+    storage = JSONStorage(path, FERNET_KEY)
+    loaded = asyncio.run(storage.load())
+    product = loaded["products"]["p1"]
+    assert isinstance(product["password"], Sealed)
+    assert "'pass'" not in repr(product)
+    assert storage.cipher.stats()["revealed"] == 0
+
+    assert storage.cipher.reveal(product["password"]) == "pass"
+    assert storage.cipher.reveal(product["password"]) == "pass"
+    assert storage.cipher.stats()["revealed"] == 1
+
+    # Unchanged sealed credentials are written back without re-encrypting
+    asyncio.run(storage.save(loaded))
+    assert storage.cipher.misses == 0
+
+
+def test_buyers_load_as_index_and_save_as_list(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY, journal=True)
+    data = {"products": {"p1": {"price": "1", "buyers": [3, 1]}}, "pending": [], "languages": {}}
+    asyncio.run(storage.save(data))
+
+    loaded = asyncio.run(storage.load())
+    buyers = loaded["products"]["p1"]["buyers"]
+    assert isinstance(buyers, BuyerSet)
+    buyers.append(2)
+    storage.touch("products", "p1", "buyers", 2)
+    asyncio.run(storage.save(loaded))
+    # Only the added buyer is journaled, not the whole list
+    assert json.loads(storage.journal_path.read_text()) == {"path": ["products", "p1", "buyers"], "add": 2}
+
+    replayed = asyncio.run(JSONStorage(path, FERNET_KEY, journal=True).load())
+    assert isinstance(replayed["products"]["p1"]["buyers"], BuyerSet)
+    assert replayed["products"]["p1"]["buyers"] == [3, 1, 2]
+
+    asyncio.run(JSONStorage(path, FERNET_KEY).save(replayed))
+    assert json.loads(path.read_text())["products"]["p1"]["buyers"] == [3, 1, 2]
+
+
+def test_journal_records_single_buyers_and_pending_entries(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY, journal=True)
+    data = {
+        "products": {"p1": {"price": "1", "buyers": [1, 2, 3]}},
+        "pending": [{"user_id": 5, "product_id": "p1", "file_id": "a"}],
+    }
+    asyncio.run(storage.save(data))
+    loaded = asyncio.run(storage.load())
+    buyers = loaded["products"]["p1"]["buyers"]
+    pending = loaded["pending"]
+
+    for uid in (9, 7):
+        buyers.append(uid)
+        storage.touch("products", "p1", "buyers", uid)
+    buyers.discard(2)
+    storage.touch("products", "p1", "buyers", 2)
+    pending.add(5, "p1", "b")
+    storage.touch("pending", 5, "p1")
+    pending.add(6, "p1", "c")
+    storage.touch("pending", 6, "p1")
+    asyncio.run(storage.save(loaded))
+    pending.pop(6, "p1")
+    storage.touch("pending", 6, "p1")
+    asyncio.run(storage.save(loaded))
+
+    records = [json.loads(line) for line in storage.journal_path.read_text().splitlines()]
+    assert sorted(min(r.keys() - {"path"}) for r in records) == ["add", "add", "pop", "put", "put", "remove"]
+    assert all("value" not in r for r in records)
+    replayed = asyncio.run(JSONStorage(path, FERNET_KEY, journal=True).load())
+    assert replayed["products"]["p1"]["buyers"] == [1, 3, 9, 7]
+    assert replayed["pending"] == [{"user_id": 5, "product_id": "p1", "file_id": "a", "file_ids": ["a", "b"]}]
+
+
+def test_journal_records_outbox_entries(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY, journal=True)
+    data = {"products": {"p1": {"price": "1", "buyers": []}}, "pending": []}
+    asyncio.run(storage.save(data))
+
+    data["products"]["p1"]["buyers"].append(2)
+    storage.touch("products", "p1", "buyers")
+    data["outbox"] = {"2:p1:credentials": {"user_id": 2, "product_id": "p1", "event": "credentials"}}
+    storage.touch("outbox", "2:p1:credentials")
+    asyncio.run(storage.save(data))
+
+    loaded = asyncio.run(JSONStorage(path, FERNET_KEY, journal=True).load())
+    assert loaded["outbox"] == data["outbox"]
+    assert loaded["products"]["p1"]["buyers"] == [2]
+
+
+def test_cancelled_save_keeps_changes_pending(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JSONStorage(path, FERNET_KEY)
+    data = {"products": {"p1": {"price": "1", "buyers": []}, "p2": {"price": "2", "buyers": []}}}
+
+    async def run():
+        await storage.save(data)
+        data["products"]["p1"]["buyers"].append(5)
+        storage.touch("products", "p1", "buyers", 5)
+        save = asyncio.ensure_future(storage.save(data))
+        await asyncio.sleep(0)
+        save.cancel()
+        await asyncio.gather(save, return_exceptions=True)
+        # A later save of another product still writes the buyer
+        data["products"]["p2"]["price"] = "3"
+        storage.touch("products", "p2", "price")
+        await storage.save(data)
+        await storage.close()
+
+    asyncio.run(run())
+    saved = json.loads(path.read_text())["products"]
+    assert saved["p1"]["buyers"] == [5]
+    assert saved["p2"]["price"] == "3"
@@ -1,8 +1,10 @@
+import json
+import logging
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # noqa: E402
-from botlib.translations import tr  # noqa: E402
+from botlib.translations import Catalogs, tr  # noqa: E402
 
 
 def test_tr_welcome_farsi():
@@ -71,3 +73,41 @@ def test_tr_menu_resend():
 def test_tr_delete_strings():
     assert tr('select_product_delete', 'en').startswith('Select a product')
     assert tr('confirm_delete', 'fa').startswith('حذف')
+
+
+def write_locales(path, **tables):
+    for lang, texts in tables.items():
+        (path / f'{lang}.json').write_text(json.dumps(texts), encoding='utf-8')
+    return Catalogs(path)
+
+
+def test_locales_define_the_same_keys():
+    catalogs = Catalogs()
+    keys = {lang: set(catalogs._read(lang)) for lang in catalogs.languages()}
+    assert keys['en'] == keys['fa']
+
+
+def test_missing_keys_reported_once_and_filled(tmp_path, caplog):
+    catalogs = write_locales(
+        tmp_path,
+        en={'hello': 'Hello {name}', 'bye': 'Bye'},
+        xx={'hello': 'Salut {name}'},
+    )
+    with caplog.at_level(logging.WARNING, logger='botlib.translations'):
+        assert catalogs['xx']['hello'] == 'Salut {name}'
+        assert catalogs['xx']['bye'] == 'Bye'
+        catalogs['xx']['bye']
+    assert [r.getMessage() for r in caplog.records] == ['Locale xx lacks 1 keys: bye']
+
+
+def test_mismatched_placeholders_use_default(tmp_path):
+    catalogs = write_locales(tmp_path, en={'hello': 'Hello {name}'}, xx={'hello': 'Salut {nom}'})
+    assert catalogs['xx']['hello'].format(name='a') == 'Hello a'
+
+
+def test_unknown_language_and_key_fall_back(tmp_path):
+    catalogs = write_locales(tmp_path, en={'hello': 'Hello'})
+    assert catalogs['zz']['hello'] == 'Hello'
+    assert catalogs['en']['nope'] == 'nope'
+    assert 'zz' not in catalogs
+    assert tr('nope', 'fa') == 'nope'
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import sys
+import types
+from pathlib import Path
+import pytest
+
+
+pytest.importorskip("telegram")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import botlib.webhook  # noqa: E402
+from botlib.webhook import MAX_HEADERS, SECRET_HEADER, WebhookServer, bench, sample_updates  # noqa: E402
+
+
+async def request(port, method, path, body=b"", secret="token", extra=""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: test\r\n{SECRET_HEADER}: {secret}\r\n{extra}"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status = await reader.readline()
+    writer.close()
+    return int(status.split()[1])
+
+
+def serve(*requests):
+    """Send *requests* to a fresh server; return the app and the statuses."""
+    app = types.SimpleNamespace(bot=None, update_queue=None)
+
+    async def run():
+        app.update_queue = asyncio.Queue()
+        server = WebhookServer(app, "127.0.0.1", 0, "/hook", "token")
+        await server.start()
+        try:
+            return [await request(server.bound_port, *r) for r in requests]
+        finally:
+            await server.stop()
+
+    return app, asyncio.run(run())
+
+
+def test_update_is_queued():
+    body = json.dumps(sample_updates(1)[0]).encode()
+    app, statuses = serve(("POST", "/hook", body))
+    assert statuses == [200]
+    update = app.update_queue.get_nowait()
+    assert update.update_id == 1
+    assert update.message.text == "/start"
+
+
+def test_invalid_requests_are_refused():
+    body = json.dumps(sample_updates(1)[0]).encode()
+    app, statuses = serve(
+        ("POST", "/hook", body, "wrong"),
+        ("POST", "/other", body),
+        ("GET", "/hook"),
+        ("POST", "/hook", b"{not json"),
+    )
+    assert statuses == [403, 404, 405, 400]
+    assert app.update_queue.empty()
+
+
+def test_non_object_updates_are_refused():
+    app, statuses = serve(("POST", "/hook", b"null"), ("POST", "/hook", b"[1, 2]"))
+    assert statuses == [400, 400]
+    assert app.update_queue.empty()
+
+
+def test_update_with_wrong_field_types_is_refused():
+    app, statuses = serve(("POST", "/hook", b'{"update_id": 1, "message": "x"}'))
+    assert statuses == [400]
+    assert app.update_queue.empty()
+
+
+def test_overlong_request_line_is_refused():
+    body = json.dumps(sample_updates(1)[0]).encode()
+    app, statuses = serve(("POST", "/hook?" + "a" * 100000, body), ("POST", "/hook", body))
+    assert statuses == [400, 200]
+
+
+def test_stalled_clients_are_disconnected(monkeypatch):
+    monkeypatch.setattr(botlib.webhook, "REQUEST_TIMEOUT", 0.1)
+    app = types.SimpleNamespace(bot=None, update_queue=None)
+    body = json.dumps(sample_updates(1)[0]).encode()
+
+    async def run():
+        app.update_queue = asyncio.Queue()
+        server = WebhookServer(app, "127.0.0.1", 0, "/hook", "token", max_connections=2)
+        await server.start()
+        stalled = []
+        try:
+            # One client stops within the headers, the other within the body
+            for head in (b"POST /hook HTTP/1.1\r\nHost: test\r\n", b"POST /hook HTTP/1.1\r\nContent-Length: 10\r\n\r\n{"):
+                reader, writer = await asyncio.open_connection("127.0.0.1", server.bound_port)
+                writer.write(head)
+                await writer.drain()
+                stalled.append((reader, writer))
+            status = await asyncio.wait_for(request(server.bound_port, "POST", "/hook", body), 5)
+            closed = [await asyncio.wait_for(reader.read(), 5) for reader, _ in stalled]
+            return status, closed
+        finally:
+            for _, writer in stalled:
+                writer.close()
+            await server.stop()
+
+    status, closed = asyncio.run(run())
+    assert status == 200
+    assert closed == [b"", b""]
+
+
+def test_oversized_headers_are_refused():
+    body = json.dumps(sample_updates(1)[0]).encode()
+    many = "".join(f"X-Pad-{i}: 1\r\n" for i in range(MAX_HEADERS))
+    huge = f"X-Pad: {'a' * 100000}\r\n"
+    app, statuses = serve(
+        ("POST", "/hook", body, "token", many),
+        ("POST", "/hook", body, "token", huge),
+        ("POST", "/hook", body),
+    )
+    assert statuses == [431, 431, 200]
+
+
+def test_run_webhook_stops_server_when_registration_fails(monkeypatch):
+    import bot
+
+    servers = []
+
+    class RecordingServer(WebhookServer):
+        def __init__(self, *args):
+            super().__init__(*args)
+            servers.append(self)
+
+    class FailingBot:
+        async def set_webhook(self, *args, **kwargs):
+            raise RuntimeError("setWebhook failed")
+
+    async def noop(*args):
+        pass
+
+    app = types.SimpleNamespace(
+        bot=FailingBot(), initialize=noop, post_init=noop, start=noop, stop=noop,
+        shutdown=noop, post_shutdown=noop,
+    )
+    monkeypatch.setattr(bot, "WebhookServer", RecordingServer)
+    monkeypatch.setattr(bot, "config", types.SimpleNamespace(
+        webhook_secret="token", webhook_listen="127.0.0.1", webhook_port=0, webhook_path="/hook",
+        webhook_max_connections=1, webhook_url="https://example.com/hook",
+    ))
+    with pytest.raises(RuntimeError):
+        asyncio.run(bot.run_webhook(app))
+    assert servers[0]._server is None
+
+
+def test_bench_reports_latency():
+    result = asyncio.run(bench(sample_updates(50), connections=2))
+    assert result["updates"] == 50
+    assert result["per_second"] > 0
+    assert result["webhook_p50_ms"] <= result["webhook_p99_ms"]